@@ -0,0 +1,115 @@
+"""Probabilistic membership filter for digests.
+
+A Bloom filter over every md5, sha1 and sha256 in the FILE table, persisted to a file that is memory mapped at
+startup. A negative answer means the digest is definitely not in the database, so the query can be skipped.
+"""
+
+import math
+import mmap
+import os
+import struct
+from typing import Callable
+
+from .database import db_version, setup_engine
+
+MAGIC = b"NSRLBLM1"
+# magic, number of bits, number of hash functions, length of the database version that follows
+HEADER = struct.Struct("<8sQQQ")
+
+
+class BloomFilter:
+    """Read-only Bloom filter backed by a memory mapped file."""
+
+    def __init__(
+        self, bits: bytes | bytearray | memoryview | mmap.mmap, num_bits: int, num_hashes: int, version: str = ""
+    ):
+        self._bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.version = version
+
+    @staticmethod
+    def positions(raw: bytes, num_bits: int, num_hashes: int):
+        """Yield the bit positions for a raw digest.
+
+        Digests are already uniformly distributed, so the two base hashes for double hashing are taken straight
+        from the digest bytes rather than rehashing.
+        """
+        h1 = int.from_bytes(raw[:8], "little")
+        h2 = int.from_bytes(raw[8:16], "little") | 1
+        for i in range(num_hashes):
+            yield (h1 + i * h2) % num_bits
+
+    def __contains__(self, digest: str) -> bool:
+        """Return False only if the digest is definitely not in the filter."""
+        try:
+            raw = bytes.fromhex(digest)
+        except ValueError:
+            return True
+        bits = self._bits
+        for pos in self.positions(raw, self.num_bits, self.num_hashes):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @classmethod
+    def open(cls, filepath: str) -> "BloomFilter":
+        """Memory map a filter file."""
+        with open(filepath, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_bits, num_hashes, version_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            data.close()
+            raise ValueError(f"Not a digest filter file: '{filepath}'")
+        offset = HEADER.size + version_len
+        version = data[HEADER.size : offset].decode()
+        return cls(memoryview(data)[offset:], num_bits, num_hashes, version=version)
+
+    @staticmethod
+    def size_for(capacity: int, false_positive_rate: float) -> tuple[int, int]:
+        """Return the optimal number of bits and hash functions for the capacity and false positive rate."""
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return num_bits, num_hashes
+
+
+def build_filter(
+    db_filepath: str,
+    filepath: str,
+    false_positive_rate: float,
+    progress: Callable[[int, int], None] | None = None,
+) -> BloomFilter:
+    """Build a filter of every digest in the FILE table and write it to filepath.
+
+    Progress is reported every million rows with the rows processed and the total rows.
+    """
+    engine, _ = setup_engine(db_filepath)
+    try:
+        db = engine.connect()
+        version = db_version(db)
+        # row count is an upper bound on distinct hashes, over estimating only lowers the false positive rate
+        rows = db.exec_driver_sql("SELECT COUNT(*) FROM FILE").scalar()
+        num_bits, num_hashes = BloomFilter.size_for(rows * 3, false_positive_rate)
+        bits = bytearray((num_bits + 7) // 8)
+        positions = BloomFilter.positions
+        for i, row in enumerate(db.exec_driver_sql("SELECT sha256, sha1, md5 FROM FILE"), start=1):
+            for digest in row:
+                for pos in positions(bytes.fromhex(digest), num_bits, num_hashes):
+                    bits[pos >> 3] |= 1 << (pos & 7)
+            if progress and i % 1_000_000 == 0:
+                progress(i, rows)
+        db.close()
+    finally:
+        engine.dispose()
+
+    # write to a temporary file first so a running server never maps a partial filter
+    encoded_version = version.encode()
+    tmp = f"{filepath}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, num_bits, num_hashes, len(encoded_version)))
+        f.write(encoded_version)
+        f.write(bits)
+    os.replace(tmp, filepath)
+    # the bits built are returned as they are, a copy would double the memory used by building a large filter
+    return BloomFilter(bits, num_bits, num_hashes, version=version)
@@ -0,0 +1,65 @@
+"""Streamed bulk lookups of newline delimited digests."""
+
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+# longer than any supported digest, anything past this on a line is dropped so input without newlines can't grow
+# the buffer without bound
+MAX_LINE_LENGTH = 128
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class LineSplitter:
+    """Split chunks of newline delimited input into stripped, non-empty lines."""
+
+    def __init__(self, max_length: int = MAX_LINE_LENGTH):
+        self.max_length = max_length
+        self._partial = b""
+        # the start of the current line was too long and has already been returned
+        self._truncated = False
+
+    def _decode(self, lines: list[bytes]) -> list[str]:
+        decoded = (line[: self.max_length].strip().decode("ascii", errors="replace") for line in lines)
+        return [line for line in decoded if line]
+
+    def feed(self, data: bytes) -> list[str]:
+        """Add a chunk of input, returning the lines it completes."""
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if lines and self._truncated:
+            # remainder of a line that was already truncated
+            lines.pop(0)
+            self._truncated = False
+        if len(self._partial) > self.max_length:
+            if not self._truncated:
+                lines.append(self._partial[: self.max_length])
+                self._truncated = True
+            self._partial = b""
+        return self._decode(lines)
+
+    def flush(self) -> list[str]:
+        """Return the final line if the input didn't end with a newline."""
+        partial, self._partial = self._partial, b""
+        if self._truncated:
+            self._truncated = False
+            return []
+        return self._decode([partial])
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """Streaming response that can start before the request body has been fully read.
+
+    Starlette's StreamingResponse watches for disconnects by reading request messages, which would consume the body
+    from under a handler that is still streaming the upload. A disconnect is noticed when reading the body instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Stream the response."""
+        try:
+            await self.stream_response(send)
+        except OSError as e:
+            raise ClientDisconnect() from e
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,94 @@
+"""In-process cache of lookup results."""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+# returned by get when the key isn't cached, as None is a valid cached result
+MISSING = object()
+
+
+def file_signature(filepath: str) -> tuple | None:
+    """Identify the current contents of a file by its inode, size and modification time."""
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class LookupCache:
+    """Bounded LRU cache of lookup results that expire after a time to live.
+
+    Both hits and negative results are cached. All entries are dropped when the watched database file changes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, watch_path: str | None = None, check_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[tuple[str, str], tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._watch_path = watch_path
+        self._check_interval = check_interval
+        self._next_check = 0.0
+        self._signature = file_signature(watch_path) if watch_path else None
+
+    def _check_watched(self, now: float):
+        """Clear the cache if the watched file has changed, at most once per check interval."""
+        if not self._watch_path or now < self._next_check:
+            return
+        self._next_check = now + self._check_interval
+        signature = file_signature(self._watch_path)
+        if signature != self._signature:
+            self._signature = signature
+            self._entries.clear()
+            self.invalidations += 1
+
+    def get(self, kind: str, digest: str) -> Any:
+        """Return the cached result for the kind of query and digest, or MISSING."""
+        key = (kind, digest.upper())
+        now = time.monotonic()
+        with self._lock:
+            self._check_watched(now)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, kind: str, digest: str, value: Any):
+        """Cache the result for the kind of query and digest."""
+        key = (kind, digest.upper())
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def recent(self, count: int) -> list[tuple[str, str]]:
+        """Return the kind and digest of up to count of the most recently used results, most recent first."""
+        with self._lock:
+            return list(itertools.islice(reversed(self._entries), count))
+
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache counters."""
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -3,10 +3,17 @@
 CLI for server.
 """
 
+import copy
+import os
+import sys
+import time
+
 import typer
 import uvicorn
+import uvicorn.config
 
-from . import settings
+from . import bloom, bulk, crud, database, hashstore, ingest, optimize, settings
+from . import prefork as prefork_server
 
 cli = typer.Typer()
 
@@ -17,21 +24,202 @@ def server(
     port: int = settings.server.port,
     workers: int = settings.server.workers,
     forwarded_allow_ips: str = settings.server.forwarded_allow_ips,
+    prefork: bool = settings.server.prefork,
 ):
     """Run the server."""
     headers: list[str, str] = []
     for header_label, header_val in settings.server.headers.items():
         headers.append((header_label.strip(), header_val.strip()))
 
-    uvicorn.run(
-        "azul_nsrl_lookup_server.server:app",
-        host=host,
-        port=port,
-        workers=workers,
-        forwarded_allow_ips=forwarded_allow_ips,
-        headers=headers,
+    # log messages from the server the same way as uvicorn's own
+    log_config = copy.deepcopy(uvicorn.config.LOGGING_CONFIG)
+    log_config["loggers"][__package__] = {"handlers": ["default"], "level": "INFO", "propagate": False}
+
+    if prefork:
+        config = uvicorn.Config(
+            "azul_nsrl_lookup_server.server:app",
+            host=host,
+            port=port,
+            workers=workers,
+            forwarded_allow_ips=forwarded_allow_ips,
+            headers=headers,
+            log_config=log_config,
+        )
+        prefork_server.run(config, workers)
+    else:
+        uvicorn.run(
+            "azul_nsrl_lookup_server.server:app",
+            host=host,
+            port=port,
+            workers=workers,
+            forwarded_allow_ips=forwarded_allow_ips,
+            headers=headers,
+            log_config=log_config,
+        )
+
+
+@cli.command()
+def index(
+    filepath: str = settings.db.filepath,
+    check: bool = typer.Option(False, help="Only report missing indexes, exit non-zero if any are missing."),
+):
+    """Build the md5 and sha1 indexes needed for fast lookups by those digests."""
+    engine, _ = database.setup_engine(filepath)
+    try:
+        missing = database.missing_hash_indexes(engine)
+    finally:
+        engine.dispose()
+
+    if not missing:
+        typer.echo("All digest indexes present.")
+        return
+    typer.echo(f"Missing indexes for: {', '.join(missing)}")
+    if check:
+        raise typer.Exit(code=1)
+
+    def progress(name: str, elapsed: float):
+        typer.echo(f"\rBuilding {name}... {elapsed:.0f}s", nl=False, err=True)
+
+    for name in database.build_hash_indexes(filepath, progress=progress):
+        typer.echo(f"\rBuilt {name}.", err=True)
+
+
+@cli.command(name="ingest")
+def ingest_release(
+    archive: str = typer.Argument(..., help="Zip archive of a full database or delta from NIST, or its .db or .sql."),
+    filepath: str = settings.db.filepath,
+    batch_size: int = typer.Option(ingest.BATCH_SIZE, help="Delta statements applied per transaction."),
+    defer_indexes: bool = typer.Option(
+        False,
+        help="Drop the md5 and sha1 indexes while applying a delta and build them again afterwards, "
+        "for a copy of the database that isn't being served.",
+    ),
+    index: bool = typer.Option(False, help="Build the md5 and sha1 indexes afterwards if they are missing."),
+    threads: int = typer.Option(min(os.cpu_count() or 1, 8), help="Threads used to sort rows when building indexes."),
+):
+    """Extract a full database or apply a delta straight from its archive, resuming if interrupted."""
+    start = time.monotonic()
+    # bytes already done when resuming, so throughput only counts the work done by this run
+    resumed_from: list[int] = []
+
+    def progress(done: int, total: int, statements: int):
+        if not resumed_from:
+            resumed_from.append(done)
+        rate = (done - resumed_from[0]) / max(time.monotonic() - start, 1e-9) / 2**20
+        message = f"\r{done / 2**20:,.0f} of {total / 2**20:,.0f}MB ({done / max(total, 1):.0%}) at {rate:,.1f}MB/s"
+        if statements:
+            message += f", {statements:,} statements applied"
+        typer.echo(message, nl=False, err=True)
+
+    with ingest.Source(archive) as source:
+        if source.is_delta:
+            result = ingest.apply_delta(filepath, source, batch_size, defer_indexes, progress=progress)
+            elapsed = time.monotonic() - start
+            typer.echo(
+                f"\rApplied {result['applied']:,} statements in {elapsed:,.0f}s "
+                f"({result['applied'] / max(elapsed, 1e-9):,.0f}/s), {result['skipped']:,} were already applied.",
+                err=True,
+            )
+            # indexes dropped for the delta are always rebuilt
+            index = index or bool(result["dropped_indexes"])
+        else:
+            written = ingest.extract_database(source, filepath, progress=progress)
+            elapsed = time.monotonic() - start
+            typer.echo(
+                f"\rExtracted {filepath} in {elapsed:,.0f}s ({written / max(elapsed, 1e-9) / 2**20:,.1f}MB/s).",
+                err=True,
+            )
+
+    if index:
+
+        def index_progress(name: str, elapsed: float):
+            typer.echo(f"\rBuilding {name}... {elapsed:.0f}s", nl=False, err=True)
+
+        for name in database.build_hash_indexes(filepath, progress=index_progress, threads=threads):
+            typer.echo(f"\rBuilt {name}.", err=True)
+
+
+@cli.command(name="optimize")
+def optimize_database(
+    output: str = typer.Argument(..., help="Where to write the optimized database."),
+    filepath: str = settings.db.filepath,
+    threads: int = typer.Option(min(os.cpu_count() or 1, 8), help="Threads used to sort rows when building indexes."),
+):
+    """Build a smaller copy of the database with binary digests, which the server uses in place of the original."""
+
+    def progress(name: str, elapsed: float):
+        typer.echo(f"\r{name}... {elapsed:.0f}s", nl=False, err=True)
+
+    built = optimize.optimize_database(filepath, output, progress=progress, threads=threads)
+    size, original = os.path.getsize(output), os.path.getsize(filepath)
+    typer.echo(
+        f"\rOptimized {built['files']:,} files with {built['names']:,} distinct names to {output}, "
+        f"{size / 2**20:,.1f}MB down from {original / 2**20:,.1f}MB ({size / original:.0%}).",
+        err=True,
     )
 
 
+@cli.command()
+def build_filter(
+    filepath: str = settings.db.filepath,
+    output: str = typer.Option(None, help="Where to write the filter, defaults to the filter_filepath setting."),
+    false_positive_rate: float = settings.db.filter_false_positive_rate,
+):
+    """Build the membership filter used to answer lookups for digests not in the database."""
+    output = output or settings.db.filter_filepath or f"{filepath}.filter"
+
+    def progress(done: int, total: int):
+        typer.echo(f"\rAdded {done:,} of {total:,} rows...", nl=False, err=True)
+
+    built = bloom.build_filter(filepath, output, false_positive_rate, progress=progress)
+    typer.echo(f"\rBuilt filter of {built.num_bits // 8:,} bytes with {built.num_hashes} hashes at {output}", err=True)
+
+
+@cli.command()
+def export_store(
+    filepath: str = settings.db.filepath,
+    output: str = typer.Option(None, help="Directory to write the store to, defaults to the hash_store_path setting."),
+):
+    """Export the distinct digests to the compact binary store used to answer existence lookups."""
+    output = output or settings.db.hash_store_path or f"{filepath}.store"
+
+    def progress(name: str, done: int):
+        typer.echo(f"\rWriting {name}... {done:,} records", nl=False, err=True)
+
+    store = hashstore.export_store(filepath, output, progress=progress)
+    typer.echo(f"\rExported {len(store):,} distinct files to {output}", err=True)
+
+
+@cli.command(name="bulk")
+def bulk_lookup(
+    digests: typer.FileBinaryRead = typer.Argument("-", help="File of newline delimited digests, '-' for stdin."),
+    details: bool = typer.Option(False, help="Output all details of each file rather than just its digests."),
+    filepath: str = settings.db.filepath,
+    chunk_size: int = settings.server.bulk_chunk_size,
+):
+    """Look up a list of digests of any size in the database, writing a JSON result per line to stdout."""
+    engine, SessionLocal = database.setup_engine(filepath)
+    splitter = bulk.LineSplitter()
+    chunk: list[str] = []
+
+    def lookup(db, digests: list[str]):
+        for result in crud.lookup_batch(db, digests, details):
+            sys.stdout.write(result.model_dump_json() + "\n")
+
+    try:
+        with SessionLocal() as db:
+            for data in iter(lambda: digests.read(65536), b""):
+                for digest in splitter.feed(data):
+                    chunk.append(digest)
+                    if len(chunk) >= chunk_size:
+                        lookup(db, chunk)
+                        chunk = []
+            chunk.extend(splitter.flush())
+            if chunk:
+                lookup(db, chunk)
+    finally:
+        engine.dispose()
+
+
 if __name__ == "__main__":
     cli()
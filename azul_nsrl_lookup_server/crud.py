@@ -1,10 +1,27 @@
 """Database queries."""
 
-from typing import Union
+from collections import defaultdict
+from typing import Callable, Iterable, Mapping, Union
 
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import Table, func, null, select, tuple_
+from sqlalchemy.orm import Session
 
-from . import models, schema
+from . import models, optimize, schema
+
+# sqlite limits the number of bound parameters in a single statement
+IN_CLAUSE_SIZE = 500
+
+FILE = models.File.__table__
+PKG = models.Pkg.__table__
+MFG = models.Mfg.__table__
+OS = models.Os.__table__
+
+# fields of details that can be requested, package fields are given as 'package.<field>'
+DETAILS_FIELDS = tuple(schema.FileDetails.model_fields)
+PACKAGE_FIELDS = tuple(schema.Package.model_fields)
+
+# package columns of the details statement for a file whose package isn't in PKG
+NO_PACKAGE = (None,) * 10
 
 
 def digest_type(digest: str) -> str:
@@ -20,71 +37,364 @@ def digest_type(digest: str) -> str:
     return digest_type
 
 
+def group_digests(digests: Iterable[str]) -> dict[str, list[str]]:
+    """Group normalised digests by their digest type, dropping duplicates."""
+    groups: dict[str, set[str]] = defaultdict(set)
+    for digest in digests:
+        groups[digest_type(digest)].add(digest.upper())
+    return {k: sorted(v) for k, v in groups.items()}
+
+
+def _chunks(values: list[str], size: int = IN_CLAUSE_SIZE) -> Iterable[list[str]]:
+    """Split values into chunks small enough for a single IN clause."""
+    for i in range(0, len(values), size):
+        yield values[i : i + size]
+
+
+def _file_table(db: Session) -> Table:
+    """The FILE table to query, or the view of files with binary digests if the database is optimized."""
+    return optimize.FILE_BLOB if optimize.is_optimized(db) else FILE
+
+
+def _distinct_statement(files: Table = FILE):
+    """Select the distinct digests straight from FILE rather than through the DISTINCT_HASH view."""
+    return select(files.c.sha256, files.c.sha1, files.c.md5)
+
+
 def get_distinct(db: Session, digest: str) -> Union[schema.DistinctHash, None]:
     """Retrieve distinct file."""
-    kwargs = {digest_type(digest): digest.upper()}
-    query = db.query(models.DistinctHash).filter_by(**kwargs)
-    # debug output for ORM query to SQL:
-    # print(str(query.statement.compile()))
-    return query.first()
+    files = _file_table(db)
+    column = files.c[digest_type(digest)]
+    query = _distinct_statement(files).where(column == digest.upper()).limit(1)
+    # debug output for query to SQL:
+    # print(str(query.compile()))
+    row = db.execute(query).first()
+    if row is None:
+        return None
+    return schema.DistinctHash(sha256=row.sha256, sha1=row.sha1, md5=row.md5)
+
+
+def get_distinct_many(db: Session, digests: Iterable[str]) -> dict[str, schema.DistinctHash]:
+    """Retrieve distinct files for many digests, keyed by the normalised digest."""
+    found = {}
+    files = _file_table(db)
+    for dtype, values in group_digests(digests).items():
+        column = files.c[dtype]
+        for chunk in _chunks(values):
+            for row in db.execute(_distinct_statement(files).distinct().where(column.in_(chunk))):
+                found.setdefault(
+                    getattr(row, dtype), schema.DistinctHash(sha256=row.sha256, sha1=row.sha1, md5=row.md5)
+                )
+    return found
+
+
+def parse_fields(fields: Iterable[str]) -> dict[str, frozenset[str] | None]:
+    """Parse requested details fields, mapping each to the package fields wanted or None for all of them."""
+    parsed: dict[str, frozenset[str] | None] = {}
+    for field in fields:
+        name, _, sub = field.strip().partition(".")
+        if name not in DETAILS_FIELDS or (sub and (name != "package" or sub not in PACKAGE_FIELDS)):
+            valid = list(DETAILS_FIELDS) + [f"package.{f}" for f in PACKAGE_FIELDS]
+            raise ValueError(f"Invalid field '{field.strip()}', must be one of: {', '.join(valid)}")
+        if not sub:
+            parsed[name] = None
+        elif parsed.get(name, frozenset()) is not None:
+            parsed[name] = parsed.get(name, frozenset()) | {sub}
+    return parsed
+
+
+def _details_joins(fields: dict[str, frozenset[str] | None] | None) -> set[str]:
+    """Tables that need to be joined to FILE for the requested fields."""
+    if fields is None or ("package" in fields and fields["package"] is None):
+        return {"PKG", "MFG", "OS"}
+    if "package" not in fields:
+        return set()
+    package = fields["package"]
+    joins = {"PKG"}
+    # the operating system reports the package manufacturer as its own
+    if "manufacturer" in package or "operating_system" in package:
+        joins.add("MFG")
+    if "operating_system" in package:
+        joins.add("OS")
+    return joins
+
+
+def _details_statement(files=FILE, joins: Iterable[str] = ("PKG", "MFG", "OS")):
+    """Select files with their package and its operating system and manufacturer in a single query.
+
+    The operating system manufacturer isn't joined as responses report the package manufacturer for it.
+    Tables not in joins are skipped and their columns selected as NULL, so rows always have the same shape.
+    """
+    joins = set(joins)
+    source = files
+    if "PKG" in joins:
+        source = source.outerjoin(PKG, files.c.package_id == PKG.c.package_id)
+    if "MFG" in joins:
+        source = source.outerjoin(MFG, PKG.c.manufacturer_id == MFG.c.manufacturer_id)
+    if "OS" in joins:
+        source = source.outerjoin(OS, PKG.c.operating_system_id == OS.c.operating_system_id)
+
+    def joined(table, *columns):
+        return [c if table in joins else null() for c in columns]
+
+    return select(
+        files.c.sha256,
+        files.c.sha1,
+        files.c.md5,
+        files.c.file_name,
+        files.c.file_size,
+        files.c.package_id,
+        *joined("PKG", PKG.c.package_id, PKG.c.name, PKG.c.version, PKG.c.language, PKG.c.application_type),
+        *joined("MFG", MFG.c.manufacturer_id, MFG.c.name),
+        *joined("OS", OS.c.operating_system_id, OS.c.name, OS.c.version),
+    ).select_from(source)
+
+
+def _file_details(row: tuple) -> dict:
+    """Convert a row of the details statement into the fields of its response model."""
+    (
+        sha256,
+        sha1,
+        md5,
+        file_name,
+        file_size,
+        _,
+        package_id,
+        package_name,
+        package_version,
+        language,
+        application_type,
+        manufacturer_id,
+        manufacturer_name,
+        operating_system_id,
+        operating_system_name,
+        operating_system_version,
+    ) = row
+    package = None
+    if package_id is not None:
+        manufacturer = None
+        if manufacturer_id is not None:
+            manufacturer = {"name": manufacturer_name}
+        operating_system = None
+        if operating_system_id is not None:
+            operating_system = {
+                "name": operating_system_name,
+                "version": operating_system_version,
+                "manufacturer": manufacturer,
+            }
+        package = {
+            "name": package_name,
+            "version": package_version,
+            "operating_system": operating_system,
+            "manufacturer": manufacturer,
+            "language": language,
+            "application_type": application_type,
+        }
+    return {
+        "sha256": sha256,
+        "sha1": sha1,
+        "md5": md5,
+        "file_name": file_name,
+        "file_size": file_size,
+        "package": package,
+    }
+
+
+def _build_file_details(row: tuple) -> schema.FileDetails:
+    """Convert a row of the details statement straight into its response model."""
+    # validating plain values in one call is cheaper than constructing each nested model
+    return schema.FileDetails(**_file_details(row))
+
 
+def _project(details: dict, fields: dict[str, frozenset[str] | None]) -> dict:
+    """Keep only the requested fields of a file's details."""
+    projected = {}
+    for name, sub in fields.items():
+        value = details[name]
+        if sub is not None and value is not None:
+            value = {k: value[k] for k in PACKAGE_FIELDS if k in sub}
+        projected[name] = value
+    return projected
 
-def get_details(db: Session, digest: str) -> list[schema.FileDetails]:
-    """Retrieve all details for given digest."""
-    kwargs = {digest_type(digest): digest.upper()}
+
+def _with_packages(rows: Iterable[tuple], packages: Mapping[int, tuple]) -> Iterable[tuple]:
+    """Fill in the package columns of rows selected without joins from preloaded packages."""
+    for row in rows:
+        yield row[:6] + packages.get(row[5], NO_PACKAGE)
+
+
+def _unique_files(rows: Iterable[tuple]) -> Iterable[tuple]:
+    """Drop repeated files where a package, OS or manufacturer id matches more than one row."""
+    seen = set()
+    for row in rows:
+        key = row[:6]
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+def get_details(
+    db: Session, digest: str, packages: Mapping[int, tuple] | None = None, plain: bool = False
+) -> list[schema.FileDetails] | list[dict]:
+    """Retrieve all details for given digest, as plain values in the shape of the response model if plain is set."""
+    return get_details_page(db, digest, packages=packages, plain=plain)[0]
+
+
+def get_details_page(
+    db: Session,
+    digest: str,
+    limit: int | None = None,
+    after: tuple | None = None,
+    fields: dict[str, frozenset[str] | None] | None = None,
+    packages: Mapping[int, tuple] | None = None,
+    plain: bool = False,
+) -> tuple[list[schema.FileDetails] | list[dict], tuple | None]:
+    """Retrieve a page of details for given digest, and the key of its last file if there are more.
+
+    Pages are ordered by the FILE primary key, with after being the key of the last file of the previous page.
+    When fields are given only those are returned, as plain values, and only the tables they need are joined.
+    Nothing is joined when packages preloaded from the database are given.
+
+    If plain is set files are returned as plain values in the shape of the response model, skipping building models
+    that would only be serialised again.
+    """
+    table = _file_table(db)
+    column = table.c[digest_type(digest)]
+    files = select(table).where(column == digest.upper())
+    if after is not None:
+        key = table.primary_key.columns
+        files = files.where(tuple_(*key) > tuple_(*after, types=[c.type for c in key]))
+    if limit is not None:
+        # limit files before joining as a file may join to more than one package row
+        files = files.order_by(*table.primary_key.columns).limit(limit + 1)
+    files = files.subquery("FILE")
+    query = _details_statement(files, () if packages is not None else _details_joins(fields))
+    if limit is not None:
+        query = query.order_by(*(files.c[c.name] for c in table.primary_key.columns))
+    # debug output for query to SQL:
+    # print(str(query.compile()))
+    rows = db.execute(query)
+    if packages is not None:
+        rows = _with_packages(rows, packages)
+    rows = list(_unique_files(rows))
+
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = tuple(rows[-1][:6])
+    if fields is not None:
+        return [_project(_file_details(row), fields) for row in rows], next_after
+    build = _file_details if plain else _build_file_details
+    return [build(row) for row in rows], next_after
+
+
+def get_summary(db: Session, digest: str) -> schema.DetailsSummary:
+    """Summarise the packages containing given digest, aggregating in the database."""
+    table = _file_table(db)
+    column = table.c[digest_type(digest)]
+    digest = digest.upper()
+    files = db.execute(select(func.count()).select_from(table).where(column == digest)).scalar()
+
+    name, version, application_type = (
+        func.trim(PKG.c.name),
+        func.trim(PKG.c.version),
+        func.trim(PKG.c.application_type),
+    )
     query = (
-        db.query(models.File)
-        .options(joinedload(models.File.package).joinedload(models.Pkg.manufacturer))
-        .options(
-            joinedload(models.File.package).joinedload(models.Pkg.operating_system).joinedload(models.Os.manufacturer)
-        )
-        .filter_by(**kwargs)
+        select(name, version, application_type, func.count(table.c.package_id.distinct()))
+        .select_from(table.join(PKG, table.c.package_id == PKG.c.package_id))
+        .where(column == digest)
+        .group_by(name, version, application_type)
+        .order_by(name, version, application_type)
     )
-    # debug output for ORM query to SQL:
-    # print(str(query.statement.compile()))
-
-    def build_package_dict(obj: object) -> dict[str, dict]:
-        result = {}
-        if obj.package:
-            result = {
-                "name": obj.package.name,
-                "version": obj.package.version,
-                "language": obj.package.language,
-                "application_type": obj.package.application_type,
-            }
-            os_val = obj.package.operating_system
-            manufacturer = obj.package.manufacturer
-            if manufacturer:
-                result["manufacturer"] = {
-                    "name": manufacturer.name,
-                }
-
-            if os_val:
-                result["operating_system"] = {
-                    "name": os_val.name,
-                    "version": os_val.version,
-                }
-
-                if manufacturer:
-                    result["operating_system"]["manufacturer"] = {
-                        "name": manufacturer.name,
-                    }
-
-        if len(result.keys()) == 0:
-            return None
-        return result
-
-    result = [
-        schema.FileDetails(
-            **{
-                "sha256": r.sha256,
-                "sha1": r.sha1,
-                "md5": r.md5,
-                "file_name": r.file_name,
-                "file_size": r.file_size,
-                "package": build_package_dict(r),
-            }
-        )
-        for r in query.all()
-    ]
-    return result
+    packages: dict[str, dict] = {}
+    application_types: dict[str, int] = defaultdict(int)
+    for name, version, application_type, count in db.execute(query):
+        package = packages.setdefault(name, {"name": name, "versions": [], "application_types": [], "packages": 0})
+        if version not in package["versions"]:
+            package["versions"].append(version)
+        if application_type not in package["application_types"]:
+            package["application_types"].append(application_type)
+        package["packages"] += count
+        application_types[application_type] += count
+    return schema.DetailsSummary(
+        files=files,
+        unique_packages=len(packages),
+        application_types=application_types,
+        packages=list(packages.values()),
+    )
+
+
+def get_package_samples(db: Session, digest: str, limit: int) -> list[schema.FileDetails]:
+    """Retrieve details of given digest for up to limit packages, one for each distinct package name."""
+    files = _file_table(db)
+    column = files.c[digest_type(digest)]
+    name = func.trim(PKG.c.name)
+    query = (
+        _details_statement(files)
+        .where(column == digest.upper(), PKG.c.package_id.is_not(None))
+        # sqlite returns the values of an arbitrary row of the group for the other columns
+        .group_by(name)
+        .order_by(name)
+        .limit(limit)
+    )
+    return [_build_file_details(row) for row in db.execute(query)]
+
+
+def get_details_many(
+    db: Session, digests: Iterable[str], packages: Mapping[int, tuple] | None = None, plain: bool = False
+) -> dict[str, list[schema.FileDetails]] | dict[str, list[dict]]:
+    """Retrieve all details for many digests, keyed by the normalised digest, as plain values if plain is set."""
+    build = _file_details if plain else _build_file_details
+    found = defaultdict(list)
+    files = _file_table(db)
+    statement = _details_statement(files, joins=()) if packages is not None else _details_statement(files)
+    for dtype, values in group_digests(digests).items():
+        column = files.c[dtype]
+        index = ("sha256", "sha1", "md5").index(dtype)
+        for chunk in _chunks(values):
+            rows = db.execute(statement.where(column.in_(chunk)))
+            if packages is not None:
+                rows = _with_packages(rows, packages)
+            for row in _unique_files(rows):
+                found[row[index]].append(build(row))
+    return dict(found)
+
+
+def lookup_batch(
+    db: Session,
+    digests: list[str],
+    details: bool = False,
+    known_missing: Callable[[str], bool] | None = None,
+    packages: Mapping[int, tuple] | None = None,
+    plain: bool = False,
+) -> list[schema.BatchDistinctResult] | list[schema.BatchDetailsResult] | list[dict]:
+    """Look up a batch of digests, returning a result for each in the order given.
+
+    Invalid digests are reported in their result rather than failing the batch, and digests known_missing rules out
+    aren't queried. If plain is set results are plain values in the shape of their response models.
+    """
+    valid, errors = [], {}
+    for digest in digests:
+        try:
+            digest_type(digest)
+        except ValueError as e:
+            errors[digest] = str(e)
+        else:
+            if known_missing is None or not known_missing(digest):
+                valid.append(digest)
+
+    results = []
+    if details:
+        found = get_details_many(db, valid, packages=packages, plain=plain)
+        for digest in digests:
+            entities = found.get(digest.upper(), [])
+            result = {"digest": digest, "found": bool(entities), "error": errors.get(digest), "results": entities}
+            results.append(result if plain else schema.BatchDetailsResult(**result))
+    else:
+        found = get_distinct_many(db, valid)
+        for digest in digests:
+            entity = found.get(digest.upper())
+            result = {"digest": digest, "found": entity is not None, "error": errors.get(digest), "result": entity}
+            results.append(result if plain else schema.BatchDistinctResult(**result))
+    return results
@@ -1,6 +1,13 @@
 """Database connection setup."""
 
-from sqlalchemy import create_engine
+import os
+import sqlite3
+import time
+from typing import Callable
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import URL, Connection, Engine
 from sqlalchemy.ext.declarative import DeferredReflection
 from sqlalchemy.orm import declarative_base, sessionmaker
 
@@ -9,14 +16,116 @@ from . import settings
 DB_FILE = settings.db.filepath
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_FILE}"
 
+# Secondary indexes for the digest columns that aren't the leading column of the FILE primary key
+HASH_INDEXES = {
+    "md5": "IDX_FILE__MD5",
+    "sha1": "IDX_FILE__SHA1",
+}
+# Files with binary digests and dictionary encoded names in a database built by the 'optimize' command, which has no
+# primary key so every digest column needs an index
+PACKED_TABLE = "FILE_PACKED"
+PACKED_HASH_INDEXES = {
+    "sha256": "IDX_FILE_PACKED__SHA256",
+    "md5": "IDX_FILE_PACKED__MD5",
+    "sha1": "IDX_FILE_PACKED__SHA1",
+}
+
+
+def database_url(filepath: str) -> URL:
+    """Build the URL to open the database with, as a read-only sqlite URI if configured."""
+    if not (settings.db.read_only or settings.db.immutable):
+        return URL.create("sqlite", database=filepath)
+    query = {"mode": "ro", "uri": "true"}
+    if settings.db.immutable:
+        query["immutable"] = "1"
+    return URL.create("sqlite", database=f"file:{quote(os.path.abspath(filepath))}", query=query)
+
+
+def connection_pragmas() -> dict[str, str | int]:
+    """PRAGMAs to apply to each new connection from the settings."""
+    pragmas = {}
+    if settings.db.read_only or settings.db.immutable:
+        pragmas["query_only"] = 1
+    for name in ("mmap_size", "cache_size", "temp_store"):
+        value = getattr(settings.db, name)
+        if value is not None:
+            pragmas[name] = value
+    return pragmas
 
-def setup_engine():
+
+def setup_engine(filepath: str = DB_FILE):
     """Delay setting up the engine until called."""
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(
+        database_url(filepath),
+        connect_args={"check_same_thread": False},
+        pool_size=settings.db.max_connections,
+    )
+    pragmas = connection_pragmas()
+    if pragmas:
+
+        @event.listens_for(engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name} = {value}")
+            finally:
+                cursor.close()
+
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     return engine, SessionLocal
 
 
+def db_version(conn: Connection) -> str:
+    """Identify the release(s) of NSRL contained in a database."""
+    return ",".join(r[0] for r in conn.exec_driver_sql("SELECT version FROM VERSION ORDER BY version"))
+
+
+def _hash_index_layout(tables: set[str]) -> tuple[str, dict[str, str]]:
+    """Return the table holding the digests and the indexes it needs, for a database with the given tables."""
+    if PACKED_TABLE in tables:
+        return PACKED_TABLE, PACKED_HASH_INDEXES
+    return "FILE", HASH_INDEXES
+
+
+def missing_hash_indexes(engine: Engine) -> list[str]:
+    """Return the digest columns that can't be looked up without scanning the FILE table."""
+    inspector = inspect(engine)
+    table, indexes = _hash_index_layout(set(inspector.get_table_names()))
+    existing = {index["name"] for index in inspector.get_indexes(table)}
+    return [column for column, name in indexes.items() if name not in existing]
+
+
+def build_hash_indexes(
+    filepath: str, progress: Callable[[str, float], None] | None = None, threads: int = 0
+) -> list[str]:
+    """Create any missing digest column indexes in the database, returning the names of those created.
+
+    Progress is reported periodically with the index being built and the seconds spent on it so far. With threads
+    set, sqlite sorts the rows of each index with that many helper threads.
+    """
+    created = []
+    db = sqlite3.connect(filepath)
+    try:
+        if threads:
+            db.execute(f"PRAGMA threads = {int(threads)}")
+        table, indexes = _hash_index_layout({r[0] for r in db.execute("SELECT name FROM sqlite_master")})
+        existing = {r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for column, name in indexes.items():
+            if name in existing:
+                continue
+            if progress:
+                start = time.monotonic()
+                db.set_progress_handler(lambda: progress(name, time.monotonic() - start), 10_000_000)  # noqa: B023
+            db.execute(f"CREATE INDEX {name} ON {table} ({column})")  # noqa: S608
+            db.commit()
+            db.set_progress_handler(None, 0)
+            created.append(name)
+    finally:
+        db.close()
+    return created
+
+
 Base = declarative_base()
 
 
@@ -0,0 +1,66 @@
+"""In-memory copies of the package, operating system and manufacturer tables.
+
+These tables are tiny compared to FILE, so holding them in memory lets details queries read only FILE and resolve
+each file's package without joining.
+"""
+
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+from . import crud
+from .database import db_version
+
+
+class Dimensions:
+    """Package details by package id, in the column order of the details statement after the FILE columns."""
+
+    def __init__(self, packages: dict[int, tuple], version: str = ""):
+        self.packages = packages
+        self.version = version
+
+    def __len__(self) -> int:
+        """Return the number of packages."""
+        return len(self.packages)
+
+    @classmethod
+    def load(cls, conn: Connection) -> "Dimensions":
+        """Load the tables from the database."""
+        PKG, MFG, OS = crud.PKG, crud.MFG, crud.OS
+        # the same joins as the details statement, with the first row kept for ids repeated in PKG
+        query = select(
+            PKG.c.package_id,
+            PKG.c.name,
+            PKG.c.version,
+            PKG.c.language,
+            PKG.c.application_type,
+            MFG.c.manufacturer_id,
+            MFG.c.name,
+            OS.c.operating_system_id,
+            OS.c.name,
+            OS.c.version,
+        ).select_from(
+            PKG.outerjoin(MFG, PKG.c.manufacturer_id == MFG.c.manufacturer_id).outerjoin(
+                OS, PKG.c.operating_system_id == OS.c.operating_system_id
+            )
+        )
+        packages: dict[int, tuple] = {}
+        strings: dict[str, str] = {}
+        for row in conn.execute(query):
+            if row[0] not in packages:
+                # names, versions and languages repeat across many packages, only keep one copy of each
+                packages[row[0]] = tuple(strings.setdefault(v, v) if isinstance(v, str) else v for v in row)
+        return cls(packages, version=db_version(conn))
+
+    def memory_size(self) -> int:
+        """Estimate the bytes used by the tables, counting each shared object once."""
+        seen = set()
+        size = sys.getsizeof(self.packages)
+        for key, row in self.packages.items():
+            size += sys.getsizeof(row)
+            for value in (key, *row):
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        return size
@@ -0,0 +1,48 @@
+"""Bounded execution of blocking database work from async request handlers."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class ExecutorBusy(Exception):
+    """Too much database work is already waiting to run."""
+
+
+class DBExecutor:
+    """Run blocking database calls on a dedicated pool of threads, one per database connection.
+
+    Keeping database work off Starlette's shared threadpool means the number of concurrent queries is bounded by
+    the connection pool rather than by the number of requests waiting on them.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int = 0):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="nsrl-db")
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        # only modified from the event loop so doesn't need a lock
+        self.pending = 0
+
+    @property
+    def busy(self) -> bool:
+        """Whether max_pending calls are already queued or running."""
+        return bool(self.max_pending) and self.pending >= self.max_pending
+
+    async def run(self, fn: Callable[..., Any], /, *args, admitted: bool = False, **kwargs) -> Any:
+        """Run fn on the pool, raising ExecutorBusy if max_pending calls are already queued or running.
+
+        Calls for work that was already admitted, such as later chunks of a streamed request, always wait their turn.
+        """
+        if not admitted and self.busy:
+            raise ExecutorBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        """Wait for running calls to finish and stop the threads."""
+        self._pool.shutdown(wait=True)
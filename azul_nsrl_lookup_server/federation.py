@@ -0,0 +1,65 @@
+"""Lookups across several RDS databases.
+
+Datasets such as the modern, legacy, Android and iOS RDS sets are kept as separate databases, possibly on different
+disks, each with its own engine. Lookups query all of them concurrently, each with a deadline after which its query
+is interrupted so a slow disk can't tie up database threads.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from .database import setup_engine
+
+# sqlite virtual machine instructions between checks of the deadline, a few hundred microseconds of work
+PROGRESS_INTERVAL = 10000
+
+# deadline of the query running on each thread, as a time.monotonic() value
+_local = threading.local()
+
+
+class Shard:
+    """A database holding one dataset."""
+
+    def __init__(self, name: str, filepath: str):
+        if not os.path.isfile(filepath):
+            raise FileNotFoundError(f"Database '{filepath}' for dataset '{name}' does not exist.")
+        self.name = name
+        self.filepath = filepath
+        self.engine, self.sessions = setup_engine(filepath)
+        enable_deadlines(self.engine)
+
+    def dispose(self):
+        """Close the database."""
+        self.engine.dispose()
+
+
+def _past_deadline() -> int:
+    """Progress handler interrupting the running query once past its thread's deadline."""
+    deadline = getattr(_local, "deadline", None)
+    return int(deadline is not None and time.monotonic() > deadline)
+
+
+def enable_deadlines(engine: Engine):
+    """Let queries on new connections from the engine be interrupted by call_with_deadline."""
+
+    @event.listens_for(engine, "connect")
+    def _set_progress_handler(dbapi_connection, connection_record):
+        dbapi_connection.set_progress_handler(_past_deadline, PROGRESS_INTERVAL)
+
+
+def call_with_deadline(
+    fn: Callable[..., Any], sessions: sessionmaker, deadline: float | None, /, *args, **kwargs
+) -> Any:
+    """Call fn with a new session, interrupting its queries with an OperationalError once the deadline passes."""
+    _local.deadline = deadline
+    try:
+        with sessions() as db:
+            return fn(db, *args, **kwargs)
+    finally:
+        _local.deadline = None
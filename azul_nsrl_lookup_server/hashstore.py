@@ -0,0 +1,194 @@
+"""Compact binary store of the distinct digests in the database.
+
+The store is a directory with a file per digest type, each a sorted array of fixed width records of raw digest bytes
+that is memory mapped at startup:
+
+- sha256.bin holds the sha256, sha1 and md5 of every distinct file, sorted by sha256.
+- sha1.bin and md5.bin hold each sha1 or md5 sorted, followed by the index of its file in sha256.bin.
+
+Digests are uniformly distributed so lookups use interpolation search, touching only a few pages of each file.
+"""
+
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+from typing import Callable
+
+from .database import db_version, setup_engine
+
+MAGIC = b"NSRLHST1"
+# magic, number of records, length of the database version that follows
+HEADER = struct.Struct("<8sQQ")
+# index of a file in sha256.bin
+INDEX = struct.Struct("<I")
+
+DIGEST_SIZES = {"sha256": 32, "sha1": 20, "md5": 16}
+RECORD_SIZE = sum(DIGEST_SIZES.values())
+
+
+# interpolation steps before falling back to bisection, bounding the probes for skewed data
+MAX_INTERPOLATIONS = 8
+
+
+def _search(data: mmap.mmap, offset: int, width: int, count: int, key: bytes) -> int:
+    """Return the index of a record starting with key, or -1 if there isn't one.
+
+    Uniformly distributed keys are found in a handful of probes by interpolating on their first 8 bytes.
+    """
+    size = len(key)
+    target = int.from_bytes(key[:8], "big")
+    lo, hi = 0, count
+    lo_value, hi_value = 0, 1 << 64
+    steps = 0
+    while lo < hi:
+        if steps < MAX_INTERPOLATIONS and hi_value > lo_value:
+            mid = lo + (target - lo_value) * (hi - lo) // (hi_value - lo_value)
+        else:
+            mid = (lo + hi) // 2
+        if mid < lo:
+            mid = lo
+        elif mid >= hi:
+            mid = hi - 1
+        steps += 1
+        start = offset + mid * width
+        probe = data[start : start + size]
+        if probe < key:
+            lo = mid + 1
+            lo_value = int.from_bytes(probe[:8], "big")
+        elif probe > key:
+            hi = mid
+            hi_value = int.from_bytes(probe[:8], "big")
+        else:
+            return mid
+    return -1
+
+
+def _open(filepath: str) -> tuple[mmap.mmap, int, int, str]:
+    """Memory map a store file, returning the mapping, offset of the first record, record count and version."""
+    with open(filepath, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, count, version_len = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        data.close()
+        raise ValueError(f"Not a hash store file: '{filepath}'")
+    offset = HEADER.size + version_len
+    return data, offset, count, data[HEADER.size : offset].decode()
+
+
+class HashStore:
+    """Read-only lookups of distinct files by any of their digests."""
+
+    def __init__(self, files: dict[str, tuple[mmap.mmap, int, int]], version: str = ""):
+        self._files = files
+        self.version = version
+
+    def __len__(self) -> int:
+        """Return the number of distinct files in the store."""
+        return self._files["sha256"][2]
+
+    def get(self, digest: str) -> tuple[str, str, str] | None:
+        """Return the sha256, sha1 and md5 of the file with the digest, or None if it isn't in the store."""
+        try:
+            key = bytes.fromhex(digest)
+        except ValueError:
+            return None
+        if len(key) == DIGEST_SIZES["sha256"]:
+            dtype, width = "sha256", RECORD_SIZE
+        elif len(key) in (DIGEST_SIZES["sha1"], DIGEST_SIZES["md5"]):
+            dtype = "sha1" if len(key) == DIGEST_SIZES["sha1"] else "md5"
+            width = len(key) + INDEX.size
+        else:
+            return None
+
+        data, offset, count = self._files[dtype]
+        index = _search(data, offset, width, count, key)
+        if index < 0:
+            return None
+        if dtype != "sha256":
+            (index,) = INDEX.unpack_from(data, offset + index * width + len(key))
+        records, offset, _ = self._files["sha256"]
+        start = offset + index * RECORD_SIZE
+        record = records[start : start + RECORD_SIZE]
+        return record[:32].hex().upper(), record[32:52].hex().upper(), record[52:].hex().upper()
+
+    @classmethod
+    def open(cls, directory: str) -> "HashStore":
+        """Memory map the files of a store."""
+        files, versions = {}, set()
+        for dtype in DIGEST_SIZES:
+            data, offset, count, version = _open(os.path.join(directory, f"{dtype}.bin"))
+            files[dtype] = (data, offset, count)
+            versions.add(version)
+        if len(versions) != 1:
+            raise ValueError(f"Hash store files in '{directory}' are from different releases: {sorted(versions)}")
+        return cls(files, version=versions.pop())
+
+
+def export_store(
+    db_filepath: str,
+    directory: str,
+    progress: Callable[[str, int], None] | None = None,
+) -> HashStore:
+    """Export the distinct digests of the database to a store in directory.
+
+    Progress is reported periodically with the name of the file being written and the records written so far.
+    """
+    os.makedirs(directory, exist_ok=True)
+    engine, _ = setup_engine(db_filepath)
+    try:
+        db = engine.connect()
+        version = db_version(db)
+        encoded_version = version.encode()
+        header_size = HEADER.size + len(encoded_version)
+
+        # sort the sha1 and md5 indexes with sqlite so the export doesn't need to fit in memory
+        with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+            sorter = sqlite3.connect(os.path.join(tmpdir, "sort.db"))
+            sorter.executescript(
+                "PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;"
+                "CREATE TABLE sha1 (digest BLOB, idx INTEGER); CREATE TABLE md5 (digest BLOB, idx INTEGER);"
+            )
+
+            # the same rows as DISTINCT_HASH, but querying FILE directly lets sqlite read them in order from the
+            # primary key, which leads with the digests, rather than sorting the whole view
+            rows = db.exec_driver_sql("SELECT DISTINCT sha256, sha1, md5 FROM FILE ORDER BY sha256, sha1, md5")
+            with open(os.path.join(directory, "sha256.bin.tmp"), "wb") as f:
+                f.write(bytes(header_size))
+                count = 0
+                while batch := rows.fetchmany(100_000):
+                    sha1s, md5s = [], []
+                    for sha256, sha1, md5 in batch:
+                        sha1_raw, md5_raw = bytes.fromhex(sha1), bytes.fromhex(md5)
+                        f.write(bytes.fromhex(sha256) + sha1_raw + md5_raw)
+                        sha1s.append((sha1_raw, count))
+                        md5s.append((md5_raw, count))
+                        count += 1
+                    sorter.executemany("INSERT INTO sha1 VALUES (?, ?)", sha1s)
+                    sorter.executemany("INSERT INTO md5 VALUES (?, ?)", md5s)
+                    if progress:
+                        progress("sha256.bin", count)
+                if count > 1 << (INDEX.size * 8):
+                    raise ValueError(f"Too many distinct files for a hash store: {count}")
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, count, len(encoded_version)) + encoded_version)
+            sorter.commit()
+
+            for dtype in ("sha1", "md5"):
+                with open(os.path.join(directory, f"{dtype}.bin.tmp"), "wb") as f:
+                    f.write(HEADER.pack(MAGIC, count, len(encoded_version)) + encoded_version)
+                    query = f"SELECT digest, idx FROM {dtype} ORDER BY digest"  # noqa: S608
+                    for i, (raw, index) in enumerate(sorter.execute(query), start=1):
+                        f.write(raw + INDEX.pack(index))
+                        if progress and i % 100_000 == 0:
+                            progress(f"{dtype}.bin", i)
+            sorter.close()
+        db.close()
+    finally:
+        engine.dispose()
+
+    # swap in all files once written so a running server never maps a partial store
+    for dtype in DIGEST_SIZES:
+        os.replace(os.path.join(directory, f"{dtype}.bin.tmp"), os.path.join(directory, f"{dtype}.bin"))
+    return HashStore.open(directory)
@@ -0,0 +1,284 @@
+"""Ingest NSRL releases straight from their zip archives.
+
+Full databases are extracted from their archive, resuming a partial extraction. Deltas are streamed from their
+archive and applied in batched transactions, recording how far they got in the database in the same transactions, so
+an interrupted update resumes where it stopped rather than starting again.
+"""
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import zipfile
+from typing import BinaryIO, Callable, Iterator
+
+from .database import HASH_INDEXES, PACKED_TABLE
+
+# statements applied per transaction, at most this many are redone when resuming
+BATCH_SIZE = 50000
+# page cache while applying a delta in KiB, and pages written to the WAL between copying them into the database.
+# Fewer, larger checkpoints sped up applying a delta by a third.
+CACHE_SIZE = 256 * 1024
+WAL_CHECKPOINT_PAGES = 100000
+# bytes extracted per write
+CHUNK_SIZE = 16 * 2**20
+# table recording the progress of applying each delta to the database
+PROGRESS_TABLE = "INGEST_PROGRESS"
+# batches of statements read ahead of those being applied
+READ_AHEAD = 4
+# statements controlling transactions in a delta, replaced by the batches
+_TRANSACTION = re.compile(rb"\s*(BEGIN|COMMIT|END|ROLLBACK)\b", re.IGNORECASE)
+# whitespace and comments before the start of a statement
+_LEADING_COMMENTS = re.compile(rb"(\s+|--[^\n]*|/\*.*?\*/)*", re.DOTALL)
+
+# called with the bytes read so far, the total bytes and the number of statements applied
+Progress = Callable[[int, int, int], None]
+
+
+class Source:
+    """A database or delta, either a plain file or the largest of its type in a zip archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._archive = None
+        if zipfile.is_zipfile(path):
+            self._archive = zipfile.ZipFile(path)
+            members = [m for m in self._archive.infolist() if m.filename.lower().endswith((".db", ".sql"))]
+            if not members:
+                self._archive.close()
+                raise ValueError(f"Archive '{path}' has no .db or .sql file.")
+            self._member = max(members, key=lambda m: m.file_size)
+            self.name = self._member.filename
+            self.size = self._member.file_size
+            # the CRC identifies the delta even if the archive is renamed
+            self.id = f"{os.path.basename(self.name)}:{self._member.CRC:08x}"
+        else:
+            self.name = path
+            self.size = os.path.getsize(path)
+            self.id = f"{os.path.basename(path)}:{self.size}"
+        self.is_delta = self.name.lower().endswith(".sql")
+
+    def open(self) -> BinaryIO:
+        """Open the database or delta for reading, decompressing it as it is read."""
+        if self._archive is not None:
+            return self._archive.open(self._member)
+        return open(self.path, "rb")
+
+    def close(self):
+        """Close the archive."""
+        if self._archive is not None:
+            self._archive.close()
+
+    def __enter__(self) -> "Source":
+        """Use the source as a context manager, closing it on exit."""
+        return self
+
+    def __exit__(self, *exc):
+        """Close the archive."""
+        self.close()
+
+
+def _split(sql: bytes) -> tuple[list[bytes], bytes]:
+    """Split SQL into its complete statements, one each, and whatever follows the last of them."""
+    complete = []
+    start = 0
+    end = sql.find(b";")
+    while end != -1:
+        if sqlite3.complete_statement(sql[start : end + 1].decode()):
+            complete.append(sql[start : end + 1])
+            start = end + 1
+        end = sql.find(b";", end + 1)
+    return complete, sql[start:]
+
+
+def statements(lines: Iterator[bytes]) -> Iterator[tuple[bytes, int]]:
+    """Split SQL into single statements, each with the bytes read up to the end of its line.
+
+    Comments are kept with the statement following them.
+    """
+    pending = []
+    read = 0
+    for line in lines:
+        read += len(line)
+        pending.append(line)
+        if line.rstrip().endswith(b";"):
+            complete, rest = _split(b"".join(pending))
+            if complete:
+                pending = [rest] if rest.strip() else []
+                for statement in complete:
+                    yield statement, read
+    complete, rest = _split(b"".join(pending))
+    for statement in complete + ([rest] if rest.strip() else []):
+        yield statement, read
+
+
+def _is_transaction(statement: bytes) -> bool:
+    """Whether a statement controls a transaction, after any comments before it."""
+    return bool(_TRANSACTION.match(statement, _LEADING_COMMENTS.match(statement).end()))
+
+
+def _read_batches(source: Source, skip: int, batch_size: int, batches: queue.Queue, stop: threading.Event):
+    """Read batches of statements from the source onto a queue, after skipping those already applied.
+
+    Run on its own thread so decompressing and parsing overlaps with applying the statements. Ends with None, or the
+    exception raised reading the source.
+    """
+    batch = []
+    try:
+        with source.open() as f:
+            for count, (statement, read) in enumerate(statements(iter(f.readline, b"")), 1):
+                if count <= skip:
+                    continue
+                batch.append(statement)
+                if len(batch) >= batch_size:
+                    batches.put((batch, read))
+                    batch = []
+                if stop.is_set():
+                    return
+        if batch:
+            batches.put((batch, source.size))
+        batches.put(None)
+    except Exception as e:
+        batches.put(e)
+
+
+def apply_delta(
+    filepath: str,
+    source: Source,
+    batch_size: int = BATCH_SIZE,
+    defer_indexes: bool = False,
+    progress: Progress | None = None,
+) -> dict:
+    """Apply the delta SQL from the source to the database, resuming from where a previous attempt stopped.
+
+    Returns the statements applied and skipped as already applied, and the digest indexes dropped for the delta, which
+    should be rebuilt afterwards. With defer_indexes, the md5 and sha1 indexes are dropped rather than updated row by
+    row, which is much slower for large deltas than building them again.
+
+    Each batch is committed as it is applied, so apply deltas to a copy of a database being served and swap to it once
+    complete. Lookups on the database itself would otherwise see part of the delta, and scan the FILE table for md5 and
+    sha1 digests while their indexes are dropped.
+    """
+    db = sqlite3.connect(filepath, isolation_level=None, check_same_thread=False)
+    try:
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (PACKED_TABLE,)).fetchone():
+            raise ValueError(f"Database '{filepath}' is optimized, apply deltas to the database it was built from.")
+        # WAL with normal sync survives a crash of the process with the last committed batch intact
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute(f"PRAGMA cache_size = -{CACHE_SIZE}")
+        db.execute(f"PRAGMA wal_autocheckpoint = {WAL_CHECKPOINT_PAGES}")
+        db.execute(
+            f"CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} ("
+            "source TEXT PRIMARY KEY, statements INTEGER NOT NULL, completed INTEGER NOT NULL, dropped_indexes TEXT)"
+        )
+        row = db.execute(
+            f"SELECT statements, completed, dropped_indexes FROM {PROGRESS_TABLE} WHERE source = ?",  # noqa: S608
+            (source.id,),
+        ).fetchone()
+        if row is None:
+            dropped = []
+            db.execute("BEGIN")
+            if defer_indexes:
+                existing = {r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+                for name in HASH_INDEXES.values():
+                    if name in existing:
+                        db.execute(f"DROP INDEX {name}")
+                        dropped.append(name)
+            db.execute(
+                f"INSERT INTO {PROGRESS_TABLE} VALUES (?, 0, 0, ?)",  # noqa: S608
+                (source.id, ",".join(dropped)),
+            )
+            db.execute("COMMIT")
+            row = (0, 0, ",".join(dropped))
+        skipped, completed, dropped = row[0], row[1], [name for name in (row[2] or "").split(",") if name]
+        applied = 0
+        if not completed:
+            applied = _apply(db, source, skipped, batch_size, progress)
+            db.execute(f"UPDATE {PROGRESS_TABLE} SET completed = 1 WHERE source = ?", (source.id,))  # noqa: S608
+        # return to a single file so the database can be opened read-only or immutable
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        db.close()
+    return {"applied": applied, "skipped": skipped, "dropped_indexes": dropped}
+
+
+def _apply(db: sqlite3.Connection, source: Source, skip: int, batch_size: int, progress: Progress | None) -> int:
+    """Apply statements from the source after skip in batched transactions, returning the number applied."""
+    batches = queue.Queue(maxsize=READ_AHEAD)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_batches, args=(source, skip, batch_size, batches, stop), name="nsrl-ingest-reader", daemon=True
+    )
+    reader.start()
+    applied = 0
+    try:
+        while (item := batches.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            batch, read = item
+            db.execute("BEGIN")
+            try:
+                for statement in batch:
+                    if not _is_transaction(statement):
+                        db.execute(statement.decode())
+                db.execute(
+                    f"UPDATE {PROGRESS_TABLE} SET statements = statements + ? WHERE source = ?",  # noqa: S608
+                    (len(batch), source.id),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            applied += len(batch)
+            if progress:
+                progress(read, source.size, skip + applied)
+    finally:
+        stop.set()
+        # unblock the reader if it is waiting for room on the queue
+        while reader.is_alive():
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                reader.join(0.1)
+    return applied
+
+
+def extract_database(source: Source, output: str, progress: Progress | None = None) -> int:
+    """Extract a full database from the source to output, returning the bytes written.
+
+    The database is written to a .partial file and moved into place once complete. A partial file left by an
+    interrupted extraction of the same source is resumed from, with the bytes already written decompressed but not
+    written again.
+    """
+    partial = f"{output}.partial"
+    # the source the partial file is extracted from, so a partial extraction of another release isn't resumed
+    partial_id = f"{partial}.id"
+    done = 0
+    if os.path.exists(partial) and os.path.exists(partial_id):
+        with open(partial_id) as f:
+            if f.read() == source.id:
+                done = os.path.getsize(partial)
+    # the last chunk may not have been written completely
+    done = max(0, done - done % CHUNK_SIZE - CHUNK_SIZE)
+    with open(partial_id, "w") as f:
+        f.write(source.id)
+    written = 0
+    with source.open() as f, open(partial, "r+b" if os.path.exists(partial) else "wb") as out:
+        out.truncate(done)
+        out.seek(done)
+        position = 0
+        while chunk := f.read(CHUNK_SIZE):
+            start, position = position, position + len(chunk)
+            if position > done:
+                out.write(chunk[max(0, done - start) :])
+                written = position - done
+            if progress:
+                progress(position, source.size, 0)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(partial, output)
+    os.remove(partial_id)
+    return written
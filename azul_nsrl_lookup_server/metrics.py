@@ -0,0 +1,219 @@
+"""Lightweight Prometheus metrics.
+
+Only counters, gauges and histograms are supported, each observation costs a lock and a bisect so
+instrumentation can be left on in production. Metrics are per process, with multiple workers each one reports its
+own values.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+# default latency buckets in seconds, from 100us to 10s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    """Base for a metric with a fixed set of label names."""
+
+    type = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        """Return the metric in the Prometheus text exposition format."""
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    type = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        """Increase the count for the label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Return the count for the label values."""
+        return self._values.get(labels, 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in values]
+
+
+class Gauge(Metric):
+    """Value read from a callback when metrics are collected."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, description: str, callback: Callable[[], float | None]):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def _samples(self) -> list[str]:
+        value = self.callback()
+        return [] if value is None else [f"{self.name} {value}"]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(
+        self, name: str, description: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # per label values, a count for each bucket plus +Inf and the sum of observations
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        """Record an observation for the label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, *labels: str) -> int:
+        """Return the number of observations for the label values."""
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = [(k, list(counts), total[0]) for k, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts, strict=True):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return samples
+
+
+class Registry:
+    """Collection of metrics to expose."""
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric, replacing any existing one with the same name."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+requests = registry.register(Counter("nsrl_requests_total", "Requests by route and status code.", ("route", "status")))
+request_seconds = registry.register(
+    Histogram("nsrl_request_seconds", "Time to respond to requests by route.", ("route",))
+)
+stage_seconds = registry.register(
+    Histogram("nsrl_stage_seconds", "Time spent in each stage of handling a request.", ("stage",))
+)
+details_rows = registry.register(
+    Histogram(
+        "nsrl_details_rows",
+        "Rows returned by each details query.",
+        buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+    )
+)
+
+# time the current request's handler finished, to attribute the rest of the response time to serialisation
+_handler_done: ContextVar[list[float] | None] = ContextVar("nsrl_handler_done", default=None)
+
+
+@contextmanager
+def timer(stage: str):
+    """Record the time spent in a block against a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
+
+
+def handler_done():
+    """Mark the current request's handler as finished, the response is serialised after this."""
+    marker = _handler_done.get()
+    if marker is not None:
+        marker.append(time.perf_counter())
+
+
+def _route_name(scope: dict) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    return getattr(endpoint, "__name__", type(endpoint).__name__)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing responses and their serialisation."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        """Time the request."""
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        marker: list[float] = []
+        token = _handler_done.set(marker)
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if marker:
+                    stage_seconds.observe(time.perf_counter() - marker[0], "serialize")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _handler_done.reset(token)
+            route = _route_name(scope)
+            requests.inc(route, status)
+            request_seconds.observe(time.perf_counter() - start, route)
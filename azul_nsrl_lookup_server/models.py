@@ -1,17 +1,24 @@
-"""Pydantic models.
+"""SQLAlchemy models.
 
-Models for validation and swagger ui.
+Models of the RDS tables, reflected from the database served or mapped from their declared columns when API-only.
 """
 
 import datetime
 
 from sqlalchemy import TIMESTAMP, Column, ForeignKey, Integer, String
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import relationship
 
+from . import settings
 from .database import Base, Reflected
 
+# the declared columns match the RDS schema, so API-only servers map them on Base as they are rather than reflecting
+# the schema of each database they open
+_bases = (Base,) if settings.server.api_only else (Reflected, Base)
 
-class File(Reflected, Base):
+
+class File(*_bases):
     """File details."""
 
     __tablename__ = "FILE"
@@ -26,7 +33,7 @@ class File(Reflected, Base):
     package = relationship("Pkg", back_populates="files")
 
 
-class Mfg(Reflected, Base):
+class Mfg(*_bases):
     """Manufacturer."""
 
     __tablename__ = "MFG"
@@ -39,7 +46,7 @@ class Mfg(Reflected, Base):
     packages = relationship("Pkg", back_populates="manufacturer")
 
 
-class Os(Reflected, Base):
+class Os(*_bases):
     """Operating System details."""
 
     __tablename__ = "OS"
@@ -54,7 +61,7 @@ class Os(Reflected, Base):
     packages = relationship("Pkg", back_populates="operating_system")
 
 
-class Pkg(Reflected, Base):
+class Pkg(*_bases):
     """Application package details."""
 
     __tablename__ = "PKG"
@@ -73,7 +80,7 @@ class Pkg(Reflected, Base):
     files = relationship("File", back_populates="package")
 
 
-class Version(Reflected, Base):
+class Version(*_bases):
     """File version."""
 
     __tablename__ = "VERSION"
@@ -85,7 +92,7 @@ class Version(Reflected, Base):
     description = Column(String, nullable=False)
 
 
-class DistinctHash(Reflected, Base):
+class DistinctHash(*_bases):
     """Distinct file VIEW."""
 
     __tablename__ = "DISTINCT_HASH"
@@ -93,3 +100,18 @@ class DistinctHash(Reflected, Base):
     sha256 = Column(String, primary_key=True)
     sha1 = Column(String, primary_key=True)
     md5 = Column(String, primary_key=True)
+
+
+def check_schema(conn: Connection):
+    """Check the database has the tables and columns declared by the models, raising ValueError if not.
+
+    Every table is read in a single query with a limit of 0, so sqlite checks the columns exist without reading rows.
+    """
+    tables = [
+        f"(SELECT {', '.join(table.columns.keys())} FROM {table.name} LIMIT 0)"  # noqa: S608
+        for table in Base.metadata.sorted_tables
+    ]
+    try:
+        conn.exec_driver_sql(f"SELECT 1 FROM {', '.join(tables)}").all()  # noqa: S608
+    except OperationalError as e:
+        raise ValueError(f"Database doesn't match the RDS schema: {e.orig}") from e
@@ -0,0 +1,160 @@
+"""Optimized layout of the NSRL database.
+
+The RDS stores digests as uppercase hex, and the FILE primary key over every column stores each row twice. An
+optimized database built from it holds the files in a single FILE_PACKED table with the digests as raw bytes and the
+file names replaced by ids into FILE_NAME, most common names first so their ids take the fewest bytes. This takes
+less than half the space, so more of the digest indexes and files fit in memory.
+
+The FILE_BLOB view joins the file names back with the digests left as bytes, and is queried in place of FILE by
+lookups, with digests converted to and from hex as they are bound and read. A FILE view with hex digests, and the
+DISTINCT_HASH view over it, keep the database readable as an RDS database by anything else.
+"""
+
+import os
+import sqlite3
+import time
+import weakref
+from typing import Callable
+
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
+
+from .database import PACKED_HASH_INDEXES, PACKED_TABLE
+
+NAME_TABLE = "FILE_NAME"
+VIEW = "FILE_BLOB"
+# tables copied unchanged from the source database
+COPIED_TABLES = ("MFG", "OS", "PKG", "VERSION")
+# page cache while building in KiB
+CACHE_SIZE = 256 * 1024
+
+SCHEMA = (
+    f"CREATE TABLE {NAME_TABLE} (name_id INTEGER PRIMARY KEY, file_name VARCHAR NOT NULL)",
+    f"CREATE TABLE {PACKED_TABLE} ("
+    " sha256 BLOB NOT NULL, sha1 BLOB NOT NULL, md5 BLOB NOT NULL,"
+    " name_id INTEGER NOT NULL, file_size INTEGER NOT NULL, package_id INTEGER NOT NULL)",
+)
+
+VIEWS = (
+    f"CREATE VIEW {VIEW} AS SELECT f.sha256, f.sha1, f.md5, n.file_name, f.file_size, f.package_id"  # noqa: S608
+    f" FROM {PACKED_TABLE} f LEFT JOIN {NAME_TABLE} n ON n.name_id = f.name_id",
+    "CREATE VIEW FILE AS SELECT hex(sha256) AS sha256, hex(sha1) AS sha1, hex(md5) AS md5, file_name, file_size,"  # noqa: S608
+    f" package_id FROM {VIEW}",
+    "CREATE VIEW DISTINCT_HASH AS SELECT DISTINCT sha256, sha1, md5 FROM FILE",
+)
+
+
+class HexDigest(TypeDecorator):
+    """A digest stored as raw bytes, bound and read as uppercase hex."""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        """Convert a hex digest to bytes, leaving anything that isn't hex as bytes that match no digest."""
+        if not isinstance(value, str):
+            return value
+        try:
+            return bytes.fromhex(value)
+        except ValueError:
+            return value.encode()
+
+    def process_result_value(self, value, dialect):
+        """Convert a digest to uppercase hex."""
+        return value.hex().upper() if value is not None else None
+
+
+# the view lookups query in an optimized database, with the same columns and key as FILE
+FILE_BLOB = Table(
+    VIEW,
+    MetaData(),
+    Column("sha256", HexDigest, primary_key=True),
+    Column("sha1", HexDigest, primary_key=True),
+    Column("md5", HexDigest, primary_key=True),
+    Column("file_name", String, primary_key=True),
+    Column("file_size", Integer, primary_key=True),
+    Column("package_id", Integer, primary_key=True),
+)
+
+# whether the database of each engine is optimized, checked once per engine
+_optimized: weakref.WeakKeyDictionary[Engine, bool] = weakref.WeakKeyDictionary()
+
+
+def is_optimized(db: Connection | Session) -> bool:
+    """Whether the database a connection or session is using has the optimized layout."""
+    engine = db.get_bind().engine if isinstance(db, Session) else db.engine
+    optimized = _optimized.get(engine)
+    if optimized is None:
+        query = text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name")
+        optimized = _optimized[engine] = db.execute(query, {"name": PACKED_TABLE}).first() is not None
+    return optimized
+
+
+def optimize_database(
+    filepath: str, output: str, progress: Callable[[str, float], None] | None = None, threads: int = 0
+) -> dict[str, int]:
+    """Build an optimized copy of the database at output, returning the number of files and distinct names.
+
+    The copy is built in a .partial file and moved into place once complete. Progress is reported periodically with
+    the step being done and the seconds spent on it so far.
+    """
+    partial = f"{output}.partial"
+    if os.path.exists(partial):
+        os.unlink(partial)
+    db = sqlite3.connect(partial, isolation_level=None)
+    try:
+        # nothing is kept if the build fails, so there is no need for a journal
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(f"PRAGMA cache_size = -{CACHE_SIZE}")
+        if threads:
+            db.execute(f"PRAGMA threads = {int(threads)}")
+        if sqlite3.sqlite_version_info < (3, 41):
+            db.create_function("unhex", 1, bytes.fromhex, deterministic=True)
+        db.execute("ATTACH DATABASE ? AS source", (filepath,))
+        schema = dict(db.execute("SELECT name, sql FROM source.sqlite_master WHERE type = 'table'"))
+        if PACKED_TABLE in schema:
+            raise ValueError(f"Database '{filepath}' is already optimized.")
+
+        def step(name: str, sql: str) -> int:
+            if progress:
+                start = time.monotonic()
+                db.set_progress_handler(lambda: progress(name, time.monotonic() - start), 10_000_000)
+            try:
+                return db.execute(sql).rowcount
+            finally:
+                db.set_progress_handler(None, 0)
+
+        db.execute("BEGIN")
+        for table in COPIED_TABLES:
+            db.execute(schema[table])
+            step(f"Copying {table}", f"INSERT INTO {table} SELECT * FROM source.{table}")  # noqa: S608
+        for sql in SCHEMA:
+            db.execute(sql)
+        names = step(
+            "Encoding file names",
+            f"INSERT INTO {NAME_TABLE} (file_name) "  # noqa: S608
+            "SELECT file_name FROM source.FILE GROUP BY file_name ORDER BY count(*) DESC, file_name",
+        )
+        # look up the id of each name while packing files without leaving an index of names in the database
+        db.execute("CREATE TEMP TABLE NAME_ID (file_name VARCHAR PRIMARY KEY, name_id INTEGER NOT NULL) WITHOUT ROWID")
+        step("Indexing file names", f"INSERT INTO temp.NAME_ID SELECT file_name, name_id FROM {NAME_TABLE}")  # noqa: S608
+        # in sha256 order, read straight from the primary key of the source, so files with the same digest are together
+        files = step(
+            "Packing files",
+            f"INSERT INTO {PACKED_TABLE} "  # noqa: S608
+            "SELECT unhex(f.sha256), unhex(f.sha1), unhex(f.md5), n.name_id, f.file_size, f.package_id "
+            "FROM source.FILE f JOIN temp.NAME_ID n ON n.file_name = f.file_name ORDER BY f.sha256",
+        )
+        db.execute("DROP TABLE temp.NAME_ID")
+        for column, name in PACKED_HASH_INDEXES.items():
+            step(f"Building {name}", f"CREATE INDEX {name} ON {PACKED_TABLE} ({column})")
+        for sql in VIEWS:
+            db.execute(sql)
+        db.execute("COMMIT")
+    finally:
+        db.close()
+    os.replace(partial, output)
+    return {"files": files, "names": names}
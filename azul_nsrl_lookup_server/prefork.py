@@ -0,0 +1,92 @@
+"""Serve with worker processes forked from a parent that has already loaded the app and opened the database.
+
+uvicorn's own workers are spawned, so each one imports the app, reflects the database and loads any preloaded tables
+itself. Forked workers instead share the parent's copies of these copy-on-write, and with sqlite memory mapping the
+database pages are shared through the OS page cache, so memory used grows much more slowly with workers.
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+# workers exiting faster than this after starting aren't restarted, as the next would most likely fail the same way
+MIN_UPTIME = 5
+
+
+def _run_worker(config: uvicorn.Config, sock: socket.socket):
+    """Serve requests in a forked worker until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    status = 1
+    try:
+        uvicorn.Server(config).run(sockets=[sock])
+        status = 0
+    except BaseException:
+        logger.exception("Worker [%d] failed.", os.getpid())
+    finally:
+        # skip the parent's exit handlers and buffered output, which it will run itself
+        os._exit(status)
+
+
+def fork_worker(config: uvicorn.Config, sock: socket.socket) -> int:
+    """Fork a worker serving requests on the socket, returning its pid."""
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(config, sock)
+    logger.info("Started worker [%d]", pid)
+    return pid
+
+
+def run(config: uvicorn.Config, workers: int):
+    """Load the app and open the database, then fork workers serving it and restart any that exit unexpectedly."""
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Pre-fork serving needs os.fork, which isn't available on this platform.")
+    from . import server
+
+    config.load()
+    server.prepare()
+    sock = config.bind_socket()
+    # objects created so far are only read by workers, stop the collector touching them so their pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("Started parent process [%d]", os.getpid())
+
+    children = {fork_worker(config, sock): time.monotonic() for _ in range(workers)}
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < MIN_UPTIME:
+            logger.error("Worker [%d] exited with %d straight after starting, not restarting it.", pid, code)
+            continue
+        logger.warning("Worker [%d] exited with %d, restarting it.", pid, code)
+        children[fork_worker(config, sock)] = time.monotonic()
+
+    sock.close()
+    logger.info("Stopped parent process [%d]", os.getpid())
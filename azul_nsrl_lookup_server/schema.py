@@ -3,7 +3,9 @@
 Database Schema extracted from the distributed NSRL database.
 """
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+
+from . import settings
 
 
 class DistinctFile(BaseModel):
@@ -100,12 +102,108 @@ class FileDetails(File):
     package: Package | None = None
 
 
-class SummaryPackageVersions(BaseModel):
-    """A temporary structure to hold package versions."""
+class BatchLookup(BaseModel):
+    """Digests to look up in a single request."""
+
+    digests: list[str] = Field(max_length=settings.server.max_batch_size)
+
+
+class BatchResult(BaseModel):
+    """Lookup result for a single digest of a batch."""
+
+    digest: str
+    found: bool = False
+    error: str | None = None
+
+
+class BatchDistinctResult(BatchResult):
+    """Batch result for an existence lookup."""
+
+    result: DistinctHash | None = None
+
+
+class BatchDetailsResult(BatchResult):
+    """Batch result for a detailed lookup."""
+
+    results: list[FileDetails] = []
+
+
+class DatasetFileDetails(FileDetails):
+    """Complete info for a file in one of the federated datasets."""
+
+    dataset: str
+
+
+class FederatedResult(BaseModel):
+    """Lookup result for a digest across all datasets."""
+
+    digest: str
+    # datasets containing the file
+    datasets: list[str] = []
+    # datasets that couldn't be searched, with the reason
+    errors: dict[str, str] = {}
+
+
+class FederatedDistinctResult(FederatedResult):
+    """Federated result for an existence lookup."""
+
+    result: DistinctHash | None = None
+
+
+class FederatedDetailsResult(FederatedResult):
+    """Federated result for a detailed lookup, with each file tagged by the dataset it is in."""
+
+    results: list[DatasetFileDetails] = []
+
+
+class CacheStats(BaseModel):
+    """Lookup cache counters."""
+
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class SwapRequest(BaseModel):
+    """A database release to swap to."""
+
+    filepath: str
+    # filter and hash store for the release, defaulting to the configured paths
+    filter_filepath: str | None = None
+    hash_store_path: str | None = None
+
+
+class SwapResult(BaseModel):
+    """The database release being served after a swap."""
+
+    filepath: str
+    version: str
+    # cached lookups re-run against the new database before swapping to it
+    warmed: int
+    seconds: float
+
+
+class PackageSummary(BaseModel):
+    """Versions and application types of the packages with the same name that contain a file."""
+
+    name: str
+    versions: list[str]
+    application_types: list[str]
+    # number of packages of this name containing the file
+    packages: int
+
+
+class DetailsSummary(BaseModel):
+    """Summary of the packages containing a file."""
 
-    name: str = ""
-    app_type: str = ""
-    versions: set[str] = set
+    # number of FILE rows, as returned by details
+    files: int
+    unique_packages: int
+    # number of packages containing the file by application type
+    application_types: dict[str, int]
+    packages: list[PackageSummary]
 
 
 class FlatDetails(File):
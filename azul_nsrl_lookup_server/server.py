@@ -3,192 +3,951 @@
 The lookup server.
 """
 
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+import secrets
+import time
 from contextlib import asynccontextmanager
-from importlib.resources import files
+from dataclasses import dataclass, field
+from typing import Any
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+from pydantic_core import to_json
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+from . import __version__, bulk, crud, federation, metrics, models, schema, settings, warmup
+from .bloom import BloomFilter
+from .cache import MISSING, LookupCache
+from .database import db_version, missing_hash_indexes, setup_engine
+from .dimensions import Dimensions
+from .executor import DBExecutor, ExecutorBusy
+from .hashstore import HashStore
+from .sharedcache import SharedCache
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServedDatabase:
+    """A database served by the server, along with the filter, store, tables and caches loaded for its release.
+
+    Swapping to another database replaces the whole of it in a single assignment, so each request sees either the
+    previous database or the new one and never a mix of them.
+    """
+
+    engine: Engine
+    sessions: sessionmaker
+    # release(s) of NSRL in the database
+    version: str
+    # path the database was opened from, watched for a new release replacing it
+    path: str
+    # real path and inode of the database file, to notice when it is replaced
+    file_id: tuple[str, int] | None
+    # optional filter of digests in the database
+    membership_filter: BloomFilter | None = None
+    # optional store of distinct digests answering existence lookups
+    hash_store: HashStore | None = None
+    # optional in-memory copies of the tables joined for details
+    dimensions: Dimensions | None = None
+    # optional cache of lookup results
+    lookup_cache: LookupCache | None = None
+    # optional cache of details lookups shared with the other workers on the node
+    shared_cache: SharedCache | None = None
+    # requests using it, so it is only closed once they have finished after a swap
+    in_flight: int = field(default=0, compare=False)
+
+    @property
+    def packages(self) -> dict[int, tuple] | None:
+        """Preloaded packages to resolve details from, if enabled."""
+        return self.dimensions.packages if self.dimensions is not None else None
+
+    def known_missing(self, digest: str) -> bool:
+        """Whether the membership filter rules out the digest being in the database."""
+        return self.membership_filter is not None and digest not in self.membership_filter
+
+
+# database being served, opened at startup rather than on import so the models can be reflected from it
+served: ServedDatabase | None = None
+# other datasets searched by the federated lookups, opened at startup
+shards: list[federation.Shard] = []
+# threads running database queries for requests, created at startup
+db_executor: DBExecutor | None = None
+# database queries in flight, shared by concurrent identical lookups
+flights = SingleFlight()
+# engines being closed after a swap, held so their tasks aren't garbage collected
+draining: set[asyncio.Task] = set()
+swap_lock = asyncio.Lock()
+# whether startup, including any warmup, has finished so lookups can be routed here
+ready = False
+
+
+def _current() -> ServedDatabase:
+    """The database being served, once one has been opened."""
+    if served is None:
+        raise RuntimeError("No database is being served.")
+    return served
+
+
+def file_id(filepath: str) -> tuple[str, int] | None:
+    """Identify the file a path currently refers to by its real path and inode."""
+    path = os.path.realpath(filepath)
+    try:
+        return path, os.stat(path).st_ino
+    except OSError:
+        return None
+
+
+def load_filter(filepath: str, version: str) -> BloomFilter | None:
+    """Load the membership filter if it exists and was built from the same database release."""
+    if not os.path.exists(filepath):
+        logger.warning("Membership filter '%s' does not exist, run the 'build-filter' command.", filepath)
+        return None
+    loaded = BloomFilter.open(filepath)
+    if loaded.version != version:
+        logger.warning(
+            "Membership filter '%s' was built for release '%s' not '%s', ignoring it.",
+            filepath,
+            loaded.version,
+            version,
+        )
+        return None
+    return loaded
+
+
+def load_store(directory: str, version: str) -> HashStore | None:
+    """Load the hash store if it exists and was exported from the same database release."""
+    if not os.path.isdir(directory):
+        logger.warning("Hash store '%s' does not exist, run the 'export-store' command.", directory)
+        return None
+    loaded = HashStore.open(directory)
+    if loaded.version != version:
+        logger.warning(
+            "Hash store '%s' was exported from release '%s' not '%s', ignoring it.",
+            directory,
+            loaded.version,
+            version,
+        )
+        return None
+    return loaded
+
+
+def _load_dimensions(conn: Connection) -> Dimensions:
+    """Load the dimension tables into memory, logging the memory used."""
+    loaded = Dimensions.load(conn)
+    logger.info(
+        "Loaded %d packages for release '%s' into memory using %.1fMB.",
+        len(loaded),
+        loaded.version,
+        loaded.memory_size() / 2**20,
+    )
+    return loaded
+
+
+def load_dimensions():
+    """Load the dimension tables into memory if they aren't loaded or the database release has changed."""
+    # a swap to another database while loading brings its own tables, so these are only used by the previous one
+    current = _current()
+    with current.engine.connect() as conn:
+        if current.dimensions is not None and current.dimensions.version == db_version(conn):
+            return
+        current.dimensions = _load_dimensions(conn)
+
+
+async def watch_dimensions(interval: float):
+    """Periodically reload the dimension tables when the database release changes."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(load_dimensions)
+        except Exception:
+            logger.exception("Failed to reload dimension tables.")
+
+
+def _warm(cache: LookupCache, sessions: sessionmaker, keys: list[tuple[str, str]], packages: dict | None) -> int:
+    """Re-run lookups against a database to fill its cache, oldest first so the most recent stay most recent."""
+    queries = {"exists": crud.get_distinct, "details": crud.get_details, "summary": crud.get_summary}
+    warmed = 0
+    with sessions() as db:
+        for kind, digest in reversed(keys):
+            if kind not in queries:
+                continue
+            kwargs = {"packages": packages, "plain": True} if kind == "details" else {}
+            cache.set(kind, digest, queries[kind](db, digest, **kwargs))
+            warmed += 1
+    return warmed
+
+
+def open_database(
+    filepath: str,
+    filter_filepath: str | None = None,
+    hash_store_path: str | None = None,
+    warm_from: LookupCache | None = None,
+    warm_up: bool = False,
+) -> ServedDatabase:
+    """Open a database along with the membership filter, hash store and preloaded tables for its release.
+
+    Returns the database to serve lookups from. The database is warmed up if warm_up is set, and the lookups
+    most recently cached in warm_from are re-run against it so its cache starts warm.
+    """
+    # open the file a symlink currently points to, so new connections don't follow the symlink to another release
+    path, filepath = filepath, os.path.realpath(filepath)
+    new_engine, sessions = setup_engine(filepath)
+    if settings.db.datasets:
+        federation.enable_deadlines(new_engine)
+    try:
+        if not settings.server.api_only:
+            # reflect tables lazily on startup, this does nothing once they are reflected
+            models.Reflected.prepare(
+                bind=new_engine,
+                views=True,
+            )
+        missing = missing_hash_indexes(new_engine)
+        if missing:
+            logger.warning(
+                "No index for %s digests, lookups by these will scan the FILE table. Run the 'index' command to fix.",
+                ", ".join(missing),
+            )
+        with new_engine.connect() as conn:
+            if settings.server.api_only:
+                # the models aren't reflected, so check they match the database before serving from it
+                models.check_schema(conn)
+            version = db_version(conn)
+            opened = ServedDatabase(
+                engine=new_engine,
+                sessions=sessions,
+                version=version,
+                path=path,
+                file_id=file_id(filepath),
+                membership_filter=load_filter(filter_filepath, version) if filter_filepath else None,
+                hash_store=load_store(hash_store_path, version) if hash_store_path else None,
+                dimensions=_load_dimensions(conn) if settings.db.preload_dimensions else None,
+            )
+            if settings.server.shared_cache_filepath:
+                # the size tells apart databases of the same release, such as the modern and legacy sets
+                opened.shared_cache = SharedCache(
+                    settings.server.shared_cache_filepath,
+                    settings.server.shared_cache_size * 2**20,
+                    f"{version}:{os.path.getsize(filepath)}",
+                )
+        if warm_up:
+            warm_database(opened)
+        if settings.server.cache_size > 0:
+            cache = LookupCache(settings.server.cache_size, settings.server.cache_ttl, watch_path=filepath)
+            if warm_from is not None:
+                _warm(cache, sessions, warm_from.recent(settings.db.swap_warm_count), opened.packages)
+            opened.lookup_cache = cache
+    except Exception:
+        new_engine.dispose()
+        raise
+    return opened
+
+
+def warm_database(opened: ServedDatabase):
+    """Read the pages most lookups need from a database, along with the configured sample of digests."""
+    sample = []
+    if settings.db.warmup_sample_filepath:
+        sample = warmup.read_sample(settings.db.warmup_sample_filepath, settings.db.warmup_sample_size)
+    warmed = warmup.warm_up(
+        opened.engine,
+        opened.sessions,
+        probes=settings.db.warmup_probes,
+        sample=sample,
+        packages=opened.packages,
+        threads=settings.db.max_connections,
+    )
+    logger.info(
+        "Warmed up database '%s' in %.1fs with %d index probes and %d sample lookups.",
+        opened.engine.url.database,
+        warmed["seconds"],
+        warmed["probes"],
+        warmed["sample"],
+    )
 
-from fastapi import Depends, FastAPI, Form, HTTPException, Request
-from fastapi.openapi.docs import (
-    get_swagger_ui_html,
-    get_swagger_ui_oauth2_redirect_html,
-)
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
 
-from . import __version__, crud, models, schema, settings
-from .database import setup_engine
+async def warm_up_then_ready():
+    """Warm up the database being served, then report ready.
+
+    Warming only makes the first lookups faster, so the server is ready even if it fails.
+    """
+    global ready
+    try:
+        await run_in_threadpool(warm_database, _current())
+    except Exception:
+        logger.exception("Failed to warm up the database.")
+    ready = True
 
-# don't try to load on import so we can effectively relfectively load
-global SessionLocal
+
+def serve(opened: ServedDatabase | None):
+    """Serve lookups from an opened database, or stop serving any."""
+    global served
+    served = opened
+
+
+def open_shards():
+    """Open the other datasets searched by the federated lookups."""
+    global shards
+    opened = []
+    try:
+        for name, filepath in settings.db.datasets.items():
+            if name == settings.db.dataset:
+                raise ValueError(f"Dataset '{name}' is already the name of the main database.")
+            shard = federation.Shard(name, filepath)
+            opened.append(shard)
+            missing = missing_hash_indexes(shard.engine)
+            if missing:
+                logger.warning("No index for %s digests in dataset '%s'.", ", ".join(missing), name)
+            logger.info("Opened dataset '%s' from '%s'.", name, filepath)
+    except Exception:
+        for shard in opened:
+            shard.dispose()
+        raise
+    shards = opened
+
+
+def prepare():
+    """Open and warm up the database before forking workers, so they share it rather than each loading their own."""
+    serve(
+        open_database(
+            settings.db.filepath,
+            settings.db.filter_filepath,
+            settings.db.hash_store_path,
+            warm_up=settings.db.warmup,
+        )
+    )
+    open_shards()
+    # sqlite connections can't be used across a fork, each worker opens its own from the pool
+    _current().engine.dispose()
+    for shard in shards:
+        shard.dispose()
+
+
+async def drain(previous: ServedDatabase, timeout: float):
+    """Close a database once the requests using it have finished, or the timeout has passed."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while previous.in_flight and loop.time() < deadline:
+        await asyncio.sleep(0.05)
+    if previous.in_flight:
+        logger.warning("Closing the previous database with %d requests still using it.", previous.in_flight)
+    # connections still checked out are closed when they are returned
+    previous.engine.dispose()
+
+
+async def swap_database(
+    filepath: str, filter_filepath: str | None = None, hash_store_path: str | None = None
+) -> schema.SwapResult:
+    """Swap to serving lookups from another database file without dropping requests.
+
+    The new database is opened, checked and its cache warmed in a thread while requests continue on the current one.
+    Requests that started before the swap finish on the previous database, which is closed once they have.
+    """
+    async with swap_lock:
+        start = time.perf_counter()
+        if not os.path.isfile(filepath):
+            raise ValueError(f"Database '{filepath}' does not exist.")
+        opened = await run_in_threadpool(
+            open_database,
+            filepath,
+            filter_filepath or settings.db.filter_filepath,
+            hash_store_path or settings.db.hash_store_path,
+            served.lookup_cache if served is not None else None,
+            settings.db.warmup,
+        )
+        previous = served
+        serve(opened)
+        if previous is not None:
+            task = asyncio.create_task(drain(previous, settings.db.drain_timeout))
+            draining.add(task)
+            task.add_done_callback(draining.discard)
+
+    result = schema.SwapResult(
+        filepath=opened.file_id[0] if opened.file_id else filepath,
+        version=opened.version,
+        warmed=opened.lookup_cache.stats()["size"] if opened.lookup_cache is not None else 0,
+        seconds=time.perf_counter() - start,
+    )
+    logger.info(
+        "Swapped to database '%s' release '%s' in %.1fs with %d lookups cached.",
+        result.filepath,
+        result.version,
+        result.seconds,
+        result.warmed,
+    )
+    return result
+
+
+async def watch_database(interval: float):
+    """Periodically swap to a new release when the path the database was opened from is replaced.
+
+    This is the configured database file until an admin swap to another one.
+    """
+    failed = None
+    while True:
+        await asyncio.sleep(interval)
+        path = _current().path
+        current = file_id(path)
+        if current is None or current == _current().file_id or current == failed:
+            continue
+        try:
+            await swap_database(path)
+        except Exception:
+            failed = current
+            logger.exception("Failed to swap to database '%s'.", current[0])
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Function to run at startup of the fastapi server to create the database."""
-    global SessionLocal
-    engine, SessionLocal = setup_engine()
-
-    # reflect tables lazily on startup
-    models.Reflected.prepare(
-        bind=engine,
-        views=True,
-    )
+    global db_executor, ready, shards
+    start = time.perf_counter()
+    # the database is already open and warmed up if this worker was forked from a prepared parent
+    prepared = served is not None
+    if not prepared:
+        serve(open_database(settings.db.filepath, settings.db.filter_filepath, settings.db.hash_store_path))
+        open_shards()
+    db_executor = DBExecutor(settings.db.max_connections, settings.db.max_pending)
+    watchers = []
+    if settings.db.warmup and not prepared:
+        # warm up in the background so the server can answer liveness checks meanwhile
+        watchers.append(asyncio.create_task(warm_up_then_ready()))
+    else:
+        ready = True
+    if settings.db.preload_dimensions:
+        watchers.append(asyncio.create_task(watch_dimensions(settings.db.dimensions_check_interval)))
+    if settings.db.swap_check_interval > 0:
+        watchers.append(asyncio.create_task(watch_database(settings.db.swap_check_interval)))
+    logger.info("Started serving database '%s' in %.2fs.", _current().path, time.perf_counter() - start)
 
     yield
 
     # shutdown logic
-    engine.dispose()
+    ready = False
+    for watcher in watchers:
+        watcher.cancel()
+    db_executor.shutdown()
+    _current().engine.dispose()
+    serve(None)
+    for shard in shards:
+        shard.dispose()
+    shards = []
 
 
 app = FastAPI(
     title="NSRL Lookup",
     version=str(__version__),
     root_path=settings.server.root_path.rstrip("/"),
+    # the docs are served from the bundled swagger assets along with the UI, rather than from a CDN
+    docs_url=None,
     redoc_url=None,
     lifespan=lifespan,
 )
-static_path = files(__package__).joinpath("static")
-app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
-templates_path = files(__package__).joinpath("templates")
-templates = Jinja2Templates(directory=str(templates_path))
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.registry.register(
+    metrics.Gauge(
+        "nsrl_db_connections_in_use",
+        "Database connections checked out of the pool.",
+        lambda: served.engine.pool.checkedout() if served is not None else None,
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "nsrl_db_pending",
+        "Lookups queued or running on the database executor.",
+        lambda: db_executor.pending if db_executor is not None else None,
+    )
+)
+metrics.registry.register(
+    metrics.Gauge(
+        "nsrl_lookups_coalesced",
+        "Lookups that shared a database query already in flight for the same digest rather than running their own.",
+        lambda: flights.shared,
+    )
+)
+for _stat in ("hits", "misses", "size"):
+    metrics.registry.register(
+        metrics.Gauge(
+            f"nsrl_cache_{_stat}",
+            f"Lookup cache {_stat}.",
+            lambda stat=_stat: served.lookup_cache.stats()[stat] if served and served.lookup_cache else None,
+        )
+    )
+for _stat in ("hits", "misses", "evictions"):
+    metrics.registry.register(
+        metrics.Gauge(
+            f"nsrl_shared_cache_{_stat}",
+            f"Shared cache {_stat} by this worker.",
+            lambda stat=_stat: served.shared_cache.stats()[stat] if served and served.shared_cache else None,
+        )
+    )
 
 
 # Dependency
-def get_db():
-    """Get a connection to the database."""
-    db = SessionLocal()
+async def get_db():
+    """Get a connection to the database.
+
+    Sessions only connect when first used, so creating one doesn't block the event loop. Each session is counted
+    against its database while open, so a swapped out database is only closed once the requests using it have finished.
+    The database served is kept in the session's info, so a request uses the same one throughout.
+    """
+    current = _current()
+    current.in_flight += 1
+    db = current.sessions(info={"served": current})
     try:
         yield db
     finally:
         db.close()
+        current.in_flight -= 1
+
+
+def _served(db: Session) -> ServedDatabase:
+    """The database a request's session was opened on."""
+    return db.info["served"]
 
 
 # standard error repsonses
 responses = {
     404: {"description": "Item not found"},
     400: {"description": "Bad request"},
+    503: {"description": "Server busy"},
 }
+federated_responses = {
+    **responses,
+    504: {"description": "File not found in the datasets searched, and others couldn't be searched in time"},
+}
+
+
+def _timed_call(fn, db: Session, *args, **kwargs):
+    """Call fn with a session, recording the time taken against a stage named after it.
+
+    The session is closed afterwards, returning its connection to the pool rather than holding it while the request
+    waits on anything else. Otherwise requests holding every connection while waiting for a database thread for their
+    next query would deadlock with the threads waiting for a connection.
+    """
+    try:
+        with metrics.timer(fn.__name__):
+            return fn(db, *args, **kwargs)
+    finally:
+        db.close()
+
+
+async def run_db(fn, db: Session, *args, admitted: bool = False, **kwargs):
+    """Run a blocking database call with the request's session without blocking the event loop."""
+    if db_executor is None:
+        return await run_in_threadpool(_timed_call, fn, db, *args, **kwargs)
+    try:
+        return await db_executor.run(_timed_call, fn, db, *args, admitted=admitted, **kwargs)
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail="Server busy, try again later.") from e
+
+
+def _validate(digest: str):
+    """Reject digests that aren't a supported type."""
+    try:
+        crud.digest_type(digest)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+async def _query(kind: str, query, digest: str, db: Session, cache: LookupCache | None, **kwargs):
+    """Run a query for a digest in the database, caching its result.
+
+    Details are looked up in the shared cache first if enabled, and those found in the database are added to it.
+    Results from the shared cache are left encoded as JSON.
+    """
+    shared = _served(db).shared_cache if kind == "details" else None
+    entity = await run_in_threadpool(shared.get, kind, digest) if shared else MISSING
+    if entity is MISSING:
+        entity = await run_db(query, db, digest=digest, **kwargs)
+        if kind == "details":
+            metrics.details_rows.observe(len(entity))
+        # misses are left to the membership filter rather than filling the shared cache with them
+        if shared and entity:
+            await run_in_threadpool(shared.set, kind, digest, entity)
+    if cache:
+        cache.set(kind, digest, entity)
+    return entity
+
+
+async def _cached(kind: str, query, digest: str, db: Session, **kwargs):
+    """Run a query for a digest in the database, through the lookup cache if enabled.
+
+    Concurrent lookups of the same kind for the same digest that miss the cache share a single query.
+    """
+    cache = _served(db).lookup_cache
+    entity = cache.get(kind, digest) if cache else MISSING
+    if entity is not MISSING:
+        return entity
+    if not settings.server.coalesce_lookups:
+        return await _query(kind, query, digest, db, cache, **kwargs)
+    current = _served(db)
+    # lookups on different releases during a swap don't share queries
+    key = (kind, digest.upper(), current.engine)
+    return await flights.do(key, _shared_query, kind, query, digest, current, cache, **kwargs)
 
 
-def _lookup(
+async def _shared_query(kind: str, query, digest: str, current: ServedDatabase, cache: LookupCache | None, **kwargs):
+    """Run a query shared by concurrent lookups with a session of its own, so it doesn't depend on any one of them.
+
+    The session is counted against the database like those of requests, so it isn't closed under the query.
+    """
+    current.in_flight += 1
+    db = current.sessions(info={"served": current})
+    try:
+        return await _query(kind, query, digest, db, cache, **kwargs)
+    finally:
+        db.close()
+        current.in_flight -= 1
+
+
+async def _lookup(
     digest: str,
     db: Session,
     details: bool = False,
 ):
-    """Look up a digest in the database."""
-    try:
-        if not details:
-            entity = crud.get_distinct(db, digest=digest)
-        else:
-            entity = crud.get_details(db, digest=digest)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e)) from e
+    """Look up a digest in the database.
+
+    Existence lookups are answered from the hash store when it is loaded. Otherwise only cache misses that can't be
+    ruled out by the membership filter leave the event loop to query the database.
+    """
+    _validate(digest)
+    current = _served(db)
+    if current.hash_store is not None and not details:
+        found = current.hash_store.get(digest)
+        entity = schema.DistinctHash(sha256=found[0], sha1=found[1], md5=found[2]) if found else None
+    elif current.known_missing(digest):
+        entity = None
+    elif details:
+        entity = await _cached("details", crud.get_details, digest, db, packages=current.packages, plain=True)
+    else:
+        entity = await _cached("exists", crud.get_distinct, digest, db)
     if not entity:
         raise HTTPException(status_code=404, detail="File not in dataset.")
     return entity
 
 
+async def _summary(digest: str, db: Session) -> schema.DetailsSummary:
+    """Summarise the packages containing a digest."""
+    _validate(digest)
+    result = None if _served(db).known_missing(digest) else await _cached("summary", crud.get_summary, digest, db)
+    if not result or not result.files:
+        raise HTTPException(status_code=404, detail="File not in dataset.")
+    return result
+
+
+def json_response(content: Any, headers: dict[str, str] | None = None) -> Response:
+    """Encode content already in the shape of the route's response model straight to JSON.
+
+    FastAPI would validate returned content against the response model again before encoding it, which for large
+    details responses costs more than the query. The response model is still declared for the OpenAPI schema.
+    Content that is already encoded, such as from the shared cache, is sent as is.
+    """
+    body = content if isinstance(content, bytes) else to_json(content)
+    return Response(body, media_type="application/json", headers=headers)
+
+
 @app.get("/exists/{digest}", response_model=schema.DistinctHash, responses={**responses})
-def exists(digest: str, db: Session = Depends(get_db)):
+async def exists(digest: str, db: Session = Depends(get_db)):
     """Return hashes of requested file if it exists in the database."""
-    return _lookup(digest=digest, db=db, details=False)
+    result = await _lookup(digest=digest, db=db, details=False)
+    metrics.handler_done()
+    return json_response(result)
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    """Decode the FILE primary key of the last result of the previous page."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor.") from e
+    if (
+        not isinstance(key, list)
+        or len(key) != len(crud.FILE.primary_key.columns)
+        or not all(isinstance(v, str) for v in key[:4])
+        # sqlite integers are 64 bit, larger values can't be compared with the key
+        or not all(isinstance(v, int) and -(2**63) <= v < 2**63 for v in key[4:])
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return tuple(key)
 
 
 @app.get("/details/{digest}", response_model=list[schema.FileDetails], responses={**responses})
-def details(digest: str, db: Session = Depends(get_db)):
-    """Return all detailed information about the requested file."""
-    return _lookup(digest=digest, db=db, details=True)
+async def details(
+    digest: str,
+    limit: int | None = Query(
+        None, ge=1, le=settings.server.max_page_size, description="Maximum files to return, the rest are paged."
+    ),
+    after: str | None = Query(None, description="X-Next-Cursor header from the previous page."),
+    fields: str | None = Query(
+        None, description="Comma separated fields to return, such as 'file_name,package.name,package.version'."
+    ),
+    db: Session = Depends(get_db),
+):
+    """Return all detailed information about the requested file.
 
+    Responses are paged when a limit is given, with the cursor for the next page in the X-Next-Cursor header.
+    """
+    if limit is None and after is None and fields is None:
+        result = await _lookup(digest=digest, db=db, details=True)
+        metrics.handler_done()
+        return json_response(result)
 
-@app.post("/", response_class=HTMLResponse, include_in_schema=False)
-def results(request: Request, digest: str = Form(), detailed: bool = Form(False), db: Session = Depends(get_db)):
-    """Return results from ui query."""
+    _validate(digest)
     try:
-        result = _lookup(digest=digest, db=db, details=detailed)
-    except HTTPException as err:
-        return templates.TemplateResponse(
-            "index.html", {"request": request, "results": [], "detailed": False, "pkg_stats": None, "err": err}
-        )
+        projection = crud.parse_fields(fields.split(",")) if fields is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    key = _decode_cursor(after) if after is not None else None
 
-    # exists query
-    if not detailed:
-        return templates.TemplateResponse(
-            "index.html",
-            {"request": request, "results": [result], "detailed": False, "pkg_stats": None, "err": None},
+    result, next_key = [], None
+    current = _served(db)
+    if not current.known_missing(digest):
+        result, next_key = await run_db(
+            crud.get_details_page, db, digest, limit, key, projection, packages=current.packages, plain=True
         )
+        metrics.details_rows.observe(len(result))
+    if not result and key is None:
+        raise HTTPException(status_code=404, detail="File not in dataset.")
+    headers = {"X-Next-Cursor": _encode_cursor(next_key)} if next_key else {}
+    metrics.handler_done()
+    return json_response(result, headers=headers)
+
+
+@app.get("/summary/{digest}", response_model=schema.DetailsSummary, responses={**responses})
+async def summary(digest: str, db: Session = Depends(get_db)):
+    """Return a summary of the packages containing the requested file, their versions and application types."""
+    result = await _summary(digest=digest, db=db)
+    metrics.handler_done()
+    return json_response(result)
+
+
+@app.post("/exists", response_model=list[schema.BatchDistinctResult], responses={**responses})
+async def exists_batch(batch: schema.BatchLookup, db: Session = Depends(get_db)):
+    """Return hashes of each requested file that exists in the database."""
+    results = await run_db(crud.lookup_batch, db, batch.digests, False, _served(db).known_missing, plain=True)
+    metrics.handler_done()
+    return json_response(results)
 
-    # get details
-    results: list[schema.FlatDetails] = []
-    packages: dict[str, schema.SummaryPackageVersions] = dict()
-    for r in result:
-        package = r.package
-        # If the package name or application type isn't set we can't get more info
-        if not package or not package.name or not package.application_type:
-            continue
 
-        if package.name in packages:
-            # accumulate unique versions
-            packages[package.name].versions.add(package.version)
-        else:
-            packages[package.name] = schema.SummaryPackageVersions(
-                name=package.name.strip(),
-                versions=set([package.version.strip()]),
-                app_type=package.application_type.strip(),
+@app.post("/details", response_model=list[schema.BatchDetailsResult], responses={**responses})
+async def details_batch(batch: schema.BatchLookup, db: Session = Depends(get_db)):
+    """Return all detailed information about each requested file."""
+    current = _served(db)
+    results = await run_db(
+        crud.lookup_batch, db, batch.digests, True, current.known_missing, current.packages, plain=True
+    )
+    metrics.handler_done()
+    return json_response(results)
+
+
+async def _search(main: ServedDatabase | None, sessions: sessionmaker, deadline: float, fn, **kwargs):
+    """Run a lookup against one dataset, interrupting it once the deadline passes."""
+    if main is not None:
+        # count lookups on the main database so it isn't closed under them after a swap
+        main.in_flight += 1
+    try:
+        call = (federation.call_with_deadline, fn, sessions, deadline)
+        with metrics.timer(f"federated_{fn.__name__}"):
+            if db_executor is None:
+                return await asyncio.wait_for(run_in_threadpool(*call, **kwargs), deadline - time.monotonic())
+            return await asyncio.wait_for(db_executor.run(*call, **kwargs), deadline - time.monotonic())
+    finally:
+        if main is not None:
+            main.in_flight -= 1
+
+
+async def _federated(digest: str, fn, **kwargs) -> tuple[list[tuple[str, Any]], dict[str, str]]:
+    """Look up a digest in every dataset concurrently.
+
+    Returns the results of the datasets containing it, in the order they are configured, and the reason for each
+    dataset that couldn't be searched. Datasets have dataset_timeout seconds to answer.
+    """
+    _validate(digest)
+    timeout = settings.db.dataset_timeout
+    deadline = time.monotonic() + timeout
+    searches = {}
+    current = _current()
+    if not current.known_missing(digest):
+        # only the main database has preloaded tables
+        main_kwargs = {**kwargs, "packages": current.packages} if "packages" in kwargs else kwargs
+        searches[settings.db.dataset] = _search(current, current.sessions, deadline, fn, digest=digest, **main_kwargs)
+    for shard in shards:
+        searches[shard.name] = _search(None, shard.sessions, deadline, fn, digest=digest, **kwargs)
+
+    results = []
+    errors = {}
+    outcomes = await asyncio.gather(*searches.values(), return_exceptions=True)
+    for name, outcome in zip(searches, outcomes, strict=True):
+        if isinstance(outcome, asyncio.TimeoutError) or (
+            isinstance(outcome, OperationalError) and "interrupted" in str(outcome)
+        ):
+            errors[name] = f"Timed out after {timeout:g}s."
+        elif isinstance(outcome, ExecutorBusy):
+            errors[name] = "Server busy, try again later."
+        elif isinstance(outcome, Exception):
+            logger.error("Federated lookup of '%s' in dataset '%s' failed: %s", digest, name, outcome)
+            errors[name] = "Lookup failed."
+        elif outcome:
+            results.append((name, outcome))
+    if not results:
+        if errors:
+            raise HTTPException(
+                status_code=504, detail=f"File not found, and couldn't search datasets: {', '.join(errors)}."
             )
-            # only record details for unique package names, up to max_results limit
-            if len(results) < settings.ui.max_results:
-                d = schema.FlatDetails(
-                    **r.model_dump(exclude="package"),
-                    package_name=package.name.strip(),
-                    package_app_type=package.application_type.strip(),
-                    package_version=package.version.strip(),
-                    package_language=package.language.strip(),
-                )
-                if package.manufacturer:
-                    d.package_manufacturer = package.manufacturer.name.strip()
-                if package.operating_system:
-                    d.operating_system_name = package.operating_system.name.strip()
-                    d.operating_system_version = package.operating_system.version.strip()
-                    if package.operating_system.manufacturer:
-                        d.operating_system_manufacturer = package.operating_system.manufacturer.name.strip()
-                results.append(d)
-
-    # summary of packages
-    pkg_stats = {
-        "uniq_packages": len(packages),
-        "num_packages": len(result),
+        raise HTTPException(status_code=404, detail="File not in dataset.")
+    return results, errors
+
+
+@app.get("/federated/exists/{digest}", response_model=schema.FederatedDistinctResult, responses=federated_responses)
+async def federated_exists(digest: str):
+    """Return hashes of the requested file and the datasets containing it, searching all datasets."""
+    results, errors = await _federated(digest, crud.get_distinct)
+    result = {
+        "digest": digest,
+        "datasets": [name for name, _ in results],
+        "errors": errors,
+        "result": schema.DistinctHash.model_validate(results[0][1]),
+    }
+    metrics.handler_done()
+    return json_response(result)
+
+
+@app.get("/federated/details/{digest}", response_model=schema.FederatedDetailsResult, responses=federated_responses)
+async def federated_details(digest: str):
+    """Return all detailed information about the requested file from all datasets, tagged by dataset."""
+    results, errors = await _federated(digest, crud.get_details, packages=None, plain=True)
+    result = {
+        "digest": digest,
+        "datasets": [name for name, _ in results],
+        "errors": errors,
+        "results": [{**details, "dataset": name} for name, rows in results for details in rows],
     }
+    metrics.details_rows.observe(len(result["results"]))
+    metrics.handler_done()
+    return json_response(result)
 
-    return templates.TemplateResponse(
-        "index.html",
-        {"request": request, "results": results, "detailed": detailed, "pkg_stats": pkg_stats, "err": None},
-    )
 
+async def _bulk_results(request: Request, db: Session, details: bool):
+    """Look up digests as they are uploaded, yielding NDJSON results for each chunk."""
+    splitter = bulk.LineSplitter()
+    chunk: list[str] = []
+    current = _served(db)
 
-@app.get("/", response_class=HTMLResponse, include_in_schema=False)
-def root(request: Request) -> dict:
-    """Main landing page."""
-    return templates.TemplateResponse(
-        "index.html", {"request": request, "results": [], "detailed": None, "pkg_stats": None, "err": None}
-    )
+    async def lookup(digests: list[str]) -> bytes:
+        results = await run_db(
+            crud.lookup_batch, db, digests, details, current.known_missing, current.packages, plain=True, admitted=True
+        )
+        return b"".join(to_json(r) + b"\n" for r in results)
 
+    async for data in request.stream():
+        for digest in splitter.feed(data):
+            chunk.append(digest)
+            if len(chunk) >= settings.server.bulk_chunk_size:
+                yield await lookup(chunk)
+                chunk = []
+    chunk.extend(splitter.flush())
+    if chunk:
+        yield await lookup(chunk)
+
+
+def _bulk_response(request: Request, db: Session, details: bool) -> bulk.UploadStreamingResponse:
+    if db_executor is not None and db_executor.busy:
+        raise HTTPException(status_code=503, detail="Server busy, try again later.")
+    return bulk.UploadStreamingResponse(_bulk_results(request, db, details), media_type=bulk.NDJSON_MEDIA_TYPE)
+
+
+bulk_body = {
+    "requestBody": {
+        "required": True,
+        "content": {"text/plain": {"schema": {"type": "string", "description": "Newline delimited digests."}}},
+    }
+}
+
+
+@app.post(
+    "/bulk/exists",
+    response_class=bulk.UploadStreamingResponse,
+    responses={200: {"content": {bulk.NDJSON_MEDIA_TYPE: {}}}, 503: responses[503]},
+    openapi_extra=bulk_body,
+)
+async def exists_bulk(request: Request, db: Session = Depends(get_db)):
+    """Stream a BatchDistinctResult line for each line of an uploaded list of digests, of any size."""
+    return _bulk_response(request, db, details=False)
+
+
+@app.post(
+    "/bulk/details",
+    response_class=bulk.UploadStreamingResponse,
+    responses={200: {"content": {bulk.NDJSON_MEDIA_TYPE: {}}}, 503: responses[503]},
+    openapi_extra=bulk_body,
+)
+async def details_bulk(request: Request, db: Session = Depends(get_db)):
+    """Stream a BatchDetailsResult line for each line of an uploaded list of digests, of any size."""
+    return _bulk_response(request, db, details=True)
+
+
+@app.get("/cache/stats", response_model=schema.CacheStats, include_in_schema=False)
+def cache_stats():
+    """Return the hit and miss counters of the lookup cache."""
+    cache = served.lookup_cache if served is not None else None
+    if not cache:
+        raise HTTPException(status_code=404, detail="Lookup cache is disabled.")
+    return cache.stats()
+
+
+def check_admin_token(x_admin_token: str | None = Header(None)):
+    """Only allow admin requests with the configured token, hiding admin endpoints when there isn't one."""
+    if not settings.server.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(
+        x_admin_token.encode(), settings.server.admin_token.encode()
+    ):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@app.post(
+    "/admin/swap",
+    response_model=schema.SwapResult,
+    dependencies=[Depends(check_admin_token)],
+    include_in_schema=False,
+)
+async def admin_swap(swap: schema.SwapRequest):
+    """Swap to serving lookups from another database file, such as a new NSRL release."""
+    try:
+        return await swap_database(swap.filepath, swap.filter_filepath, swap.hash_store_path)
+    except (OSError, ValueError, SQLAlchemyError) as e:
+        raise HTTPException(status_code=400, detail=f"Failed to open database: {e}") from e
+
+
+@app.get("/ready", include_in_schema=False)
+async def ready_endpoint():
+    """Report whether the server has started and warmed up, for use as a readiness probe."""
+    if not ready:
+        raise HTTPException(status_code=503, detail="Warming up.")
+    return {"ready": True}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics_endpoint():
+    """Return metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
-# enable offline access to docs
-@app.get("/docs", include_in_schema=False)
-async def custom_swagger_ui_html(request: Request) -> HTMLResponse:
-    """Show the API documentation via Swagger."""
-    return get_swagger_ui_html(
-        openapi_url=r"{app.root_path}{app.openapi_url}",
-        title=f"{app.title} - Swagger UI",
-        oauth2_redirect_url=app.swagger_ui_oauth2_redirect_url,
-        swagger_js_url=f"{app.root_path}/static/js/swagger-ui-bundle.js",
-        swagger_css_url=f"{app.root_path}/static/css/swagger-ui.css",
-    )
 
+# API-only servers leave out the web UI and API docs, along with importing what they need
+if not settings.server.api_only:
+    from . import ui
 
-@app.get(app.swagger_ui_oauth2_redirect_url, include_in_schema=False)
-async def swagger_ui_redirect():
-    """Enable offline swagger redirect."""
-    return get_swagger_ui_oauth2_redirect_html()
+    ui.include(app, get_db, run_db, _lookup, _summary)
@@ -1,5 +1,7 @@
 """Configurable settings."""
 
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +9,55 @@ class DB(BaseSettings):
     """Settings for the DB."""
 
     filepath: str = "./rdsv3_modern_minimal.db"
+    # Name of the dataset in filepath, such as the modern, legacy, Android or iOS RDS set, for federated lookups
+    dataset: str = "modern"
+    # Other RDS databases searched alongside filepath by the federated lookup endpoints, by dataset name. For example
+    # NSRL_DB_DATASETS='{"legacy": "/data/legacy.db", "android": "/data/android.db"}'
+    datasets: dict[str, str] = dict()
+    # Seconds each dataset has to answer a federated lookup before its query is interrupted and reported as failed
+    dataset_timeout: float = 5
+    # Membership filter used to answer definite misses without querying the database, disabled when unset.
+    # Build it with the 'build-filter' command.
+    filter_filepath: str | None = None
+    # Target false positive rate used when building the membership filter
+    filter_false_positive_rate: float = 0.001
+    # Directory of a binary hash store answering existence lookups without querying the database, disabled when
+    # unset. Create it with the 'export-store' command.
+    hash_store_path: str | None = None
+    # Load the PKG, OS and MFG tables into memory at startup so details lookups only query FILE
+    preload_dimensions: bool = False
+    # Seconds between checks for a new database release to reload the preloaded tables from
+    dimensions_check_interval: float = 60
+    # Warm the database in the background at startup, only reporting ready on /ready once done. New releases are
+    # also warmed before being swapped to.
+    warmup: bool = False
+    # Lookups spread evenly across each digest index when warming, reading the index pages most lookups pass through
+    warmup_probes: int = 4096
+    # File of digests, one per line, to look up when warming, such as those most often requested
+    warmup_sample_filepath: str | None = None
+    # Maximum digests read from the warmup sample file
+    warmup_sample_size: int = 10000
+    # Open the database read-only and reject any statement that would modify it
+    read_only: bool = False
+    # Promise sqlite the database file will not change while open, skipping all file locking. Implies read_only.
+    # Only enable this if the file is replaced rather than updated in place.
+    immutable: bool = False
+    # PRAGMAs applied to every new connection, unset values keep the sqlite defaults.
+    # mmap_size is capped by the sqlite build, commonly at 2GB.
+    mmap_size: int | None = None
+    cache_size: int | None = None
+    temp_store: Literal["default", "file", "memory"] | None = None
+    # Number of database connections, and threads running queries for async requests, in each worker
+    max_connections: int = 8
+    # Requests waiting for a database thread before new ones are rejected with a 503, 0 for no limit
+    max_pending: int = 0
+    # Seconds between checks for the database file being replaced, such as by moving a new release over it or
+    # repointing a symlink, to swap to it without a restart. 0 disables the check.
+    swap_check_interval: float = 0
+    # Most recently cached lookups re-run against a new database before swapping to it, so its cache starts warm
+    swap_warm_count: int = 1000
+    # Seconds to wait for requests still using the previous database to finish before closing it
+    drain_timeout: float = 30
     model_config = SettingsConfigDict(env_prefix="nsrl_db_")
 
 
@@ -16,6 +67,12 @@ class Server(BaseSettings):
     host: str = "localhost"
     port: int = 8853
     workers: int = 1
+    # Fork workers from a parent that has already opened the database, so they share its memory copy-on-write rather
+    # than each being spawned to load their own copy. Not supported on Windows.
+    prefork: bool = False
+    # Serve only the REST API, without the web UI and API docs, and map the models from their declared columns rather
+    # than reflecting the schema of the database, so workers start faster
+    api_only: bool = False
     prefix: str = ""
     root_path: str = "/"
     # All IPs are allowed by default as forwarded_allow_ips doesn't support IP ranges (making it impossible to
@@ -23,6 +80,25 @@ class Server(BaseSettings):
     forwarded_allow_ips: str = "*"
     # Security headers applied to the uvicorn server
     headers: dict[str, str] = dict()
+    # Maximum number of digests accepted by the batch lookup endpoints
+    max_batch_size: int = 10000
+    # Maximum number of files returned in a page of details
+    max_page_size: int = 10000
+    # Number of digests read from a bulk upload before looking them up and streaming their results
+    bulk_chunk_size: int = 1000
+    # Number of lookup results to cache in each worker, 0 disables caching
+    cache_size: int = 10000
+    # Seconds before a cached lookup result expires
+    cache_ttl: float = 300
+    # File caching details lookups found in the database, shared by every worker on the node and kept across
+    # restarts. Checked when a lookup misses the cache of each worker, disabled when unset.
+    shared_cache_filepath: str | None = None
+    # Maximum size of the shared cache in MB, the least recently used results are evicted beyond it
+    shared_cache_size: int = 1024
+    # Share one database query between concurrent lookups of the same digest rather than each running their own
+    coalesce_lookups: bool = True
+    # Token required in the X-Admin-Token header of admin requests, admin endpoints are disabled when unset
+    admin_token: str | None = None
     model_config = SettingsConfigDict(env_prefix="nsrl_server_")
 
 
@@ -0,0 +1,129 @@
+"""Cache of lookup results shared by every worker on a node and kept across restarts.
+
+Results are stored as JSON in a sqlite file in WAL mode, so workers read it concurrently while one of them writes.
+They are returned still encoded, as decoding a large result only to encode it again for the response can take as
+long as querying the database for it.
+Each database release has its own results, so those of a previous release are never returned and age out. Once the
+file reaches its size limit the least recently used results are evicted.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from pydantic_core import to_json
+
+from .cache import MISSING
+
+logger = logging.getLogger(__name__)
+
+# seconds a write waits for another worker to finish writing before the result is left uncached
+BUSY_TIMEOUT = 0.5
+# seconds between recording further use of a result, so repeated hits don't each write to the file
+TOUCH_INTERVAL = 60
+# fraction of the results evicted at once when the file is full, results larger than this fraction aren't cached
+EVICT_FRACTION = 0.1
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS RESULT (key VARCHAR PRIMARY KEY, value BLOB NOT NULL, used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS IDX_RESULT__USED ON RESULT (used)",
+)
+
+
+class SharedCache:
+    """Size bounded LRU cache of lookup results for a database release in a sqlite file."""
+
+    def __init__(self, filepath: str, max_bytes: int, release: str):
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.release = release
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # sqlite connections can't be shared with forked workers, each thread of each process opens its own
+        self._local = threading.local()
+        db = sqlite3.connect(filepath, timeout=BUSY_TIMEOUT)
+        try:
+            db.execute("PRAGMA journal_mode = WAL")
+            for sql in SCHEMA:
+                db.execute(sql)
+            db.commit()
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, opening it if needed."""
+        if getattr(self._local, "pid", None) != os.getpid():
+            db = sqlite3.connect(self.filepath, timeout=BUSY_TIMEOUT, isolation_level=None)
+            # a crash may lose the last results written, but never corrupts the file
+            db.execute("PRAGMA synchronous = NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return self._local.db
+
+    def _key(self, kind: str, digest: str) -> str:
+        return f"{self.release}:{kind}:{digest.upper()}"
+
+    def get(self, kind: str, digest: str) -> Any:
+        """Return the cached result for the kind of query and digest encoded as JSON, or MISSING."""
+        key = self._key(kind, digest)
+        db = self._connect()
+        try:
+            row = db.execute("SELECT value, used FROM RESULT WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            # a broken cache only makes lookups slower
+            logger.warning("Failed to read the shared cache '%s'.", self.filepath, exc_info=True)
+            row = None
+        if row is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            try:
+                db.execute("UPDATE RESULT SET used = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError:
+                # another worker is writing, its last use is recorded by a later hit
+                pass
+        return row[0]
+
+    def set(self, kind: str, digest: str, value: Any):
+        """Cache the result for the kind of query and digest, evicting the least recently used if full."""
+        data = to_json(value)
+        if len(data) > self.max_bytes * EVICT_FRACTION:
+            return
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            logger.debug("Shared cache busy, not caching %s result for %s.", kind, digest)
+            return
+        try:
+            db.execute("INSERT OR REPLACE INTO RESULT VALUES (?, ?, ?)", (self._key(kind, digest), data, time.time()))
+            if self._used_bytes(db) > self.max_bytes:
+                count = db.execute("SELECT count(*) FROM RESULT").fetchone()[0]
+                evict = max(1, int(count * EVICT_FRACTION))
+                db.execute(
+                    "DELETE FROM RESULT WHERE key IN (SELECT key FROM RESULT ORDER BY used LIMIT ?)",
+                    (evict,),
+                )
+                self.evictions += evict
+            db.execute("COMMIT")
+        except BaseException as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            if not isinstance(e, sqlite3.Error):
+                raise
+            logger.warning("Failed to write to the shared cache '%s'.", self.filepath, exc_info=True)
+
+    @staticmethod
+    def _used_bytes(db: sqlite3.Connection) -> int:
+        """Bytes of the file holding results, excluding pages freed by evictions that will be reused."""
+        pages = db.execute("PRAGMA page_count").fetchone()[0] - db.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages * db.execute("PRAGMA page_size").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache counters."""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
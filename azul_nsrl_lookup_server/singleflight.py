@@ -0,0 +1,43 @@
+"""Coalescing of concurrent identical lookups."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Share one run of a lookup between all concurrent callers asking for the same key.
+
+    The first caller starts the lookup as a task and later callers with the same key wait on it rather than running
+    their own, all getting its result or exception. The lookup is shielded from callers being cancelled, so it
+    completes for the rest. Keys are forgotten once their lookup finishes, so results are never served stale.
+    Only used from the event loop so doesn't need a lock.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        """Return the number of lookups in flight."""
+        return len(self._flights)
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], /, *args, **kwargs) -> Any:
+        """Return the result of awaiting fn, or of the call already in flight for the key."""
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        """Forget a finished lookup."""
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # every caller may have been cancelled, so mark any exception retrieved to avoid it being logged
+        if not task.cancelled():
+            task.exception()
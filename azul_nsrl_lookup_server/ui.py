@@ -0,0 +1,117 @@
+"""NSRL Minimal Lookup Server.
+
+The web UI and API documentation, only imported by servers that aren't API-only.
+"""
+
+from importlib.resources import files
+from typing import Callable
+
+from fastapi import APIRouter, Depends, FastAPI, Form, HTTPException, Request
+from fastapi.openapi.docs import (
+    get_swagger_ui_html,
+    get_swagger_ui_oauth2_redirect_html,
+)
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from sqlalchemy.orm import Session
+
+from . import crud, metrics, schema, settings
+
+static_path = files(__package__).joinpath("static")
+
+templates_path = files(__package__).joinpath("templates")
+templates = Jinja2Templates(directory=str(templates_path))
+
+
+def _render(request: Request, context: dict) -> HTMLResponse:
+    """Render the UI page, timing the template."""
+    with metrics.timer("render"):
+        return templates.TemplateResponse(request, "index.html", context)
+
+
+def include(app: FastAPI, get_db: Callable, run_db: Callable, lookup: Callable, summary: Callable):
+    """Serve the web UI and API docs from the app, looking up digests with the server's functions.
+
+    The functions are passed in by the server rather than imported from it, as it includes the UI while it is set up.
+    """
+    router = APIRouter(include_in_schema=False)
+
+    @router.post("/", response_class=HTMLResponse)
+    async def results(
+        request: Request, digest: str = Form(), detailed: bool = Form(False), db: Session = Depends(get_db)
+    ):
+        """Return results from ui query."""
+        try:
+            if detailed:
+                pkg_summary = await summary(digest=digest, db=db)
+                samples = await run_db(crud.get_package_samples, db, digest, settings.ui.max_results)
+            else:
+                result = await lookup(digest=digest, db=db, details=False)
+        except HTTPException as err:
+            return _render(request, {"results": [], "detailed": False, "pkg_stats": None, "err": err})
+
+        # exists query
+        if not detailed:
+            return _render(
+                request,
+                {"results": [result], "detailed": False, "pkg_stats": None, "err": None},
+            )
+
+        # details of a file from each uniquely named package, up to max_results
+        results: list[schema.FlatDetails] = []
+        for r in samples:
+            package = r.package
+            d = schema.FlatDetails(
+                **r.model_dump(exclude="package"),
+                package_name=package.name.strip(),
+                package_app_type=package.application_type.strip(),
+                package_version=package.version.strip(),
+                package_language=package.language.strip(),
+            )
+            if package.manufacturer:
+                d.package_manufacturer = package.manufacturer.name.strip()
+            if package.operating_system:
+                d.operating_system_name = package.operating_system.name.strip()
+                d.operating_system_version = package.operating_system.version.strip()
+                if package.operating_system.manufacturer:
+                    d.operating_system_manufacturer = package.operating_system.manufacturer.name.strip()
+            results.append(d)
+
+        # summary of packages
+        pkg_stats = {
+            "uniq_packages": pkg_summary.unique_packages,
+            "num_packages": pkg_summary.files,
+        }
+
+        return _render(
+            request,
+            {"results": results, "detailed": detailed, "pkg_stats": pkg_stats, "err": None},
+        )
+
+    @router.get("/", response_class=HTMLResponse)
+    def root(request: Request) -> dict:
+        """Main landing page."""
+        return templates.TemplateResponse(
+            request, "index.html", {"results": [], "detailed": None, "pkg_stats": None, "err": None}
+        )
+
+    # enable offline access to docs
+    @router.get("/docs")
+    async def custom_swagger_ui_html(request: Request) -> HTMLResponse:
+        """Show the API documentation via Swagger."""
+        return get_swagger_ui_html(
+            openapi_url=r"{app.root_path}{app.openapi_url}",
+            title=f"{app.title} - Swagger UI",
+            oauth2_redirect_url=app.swagger_ui_oauth2_redirect_url,
+            swagger_js_url=f"{app.root_path}/static/js/swagger-ui-bundle.js",
+            swagger_css_url=f"{app.root_path}/static/css/swagger-ui.css",
+        )
+
+    @router.get(app.swagger_ui_oauth2_redirect_url)
+    async def swagger_ui_redirect():
+        """Enable offline swagger redirect."""
+        return get_swagger_ui_oauth2_redirect_html()
+
+    app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
+    app.include_router(router)
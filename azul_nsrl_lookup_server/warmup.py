@@ -0,0 +1,95 @@
+"""Warm up a database before serving lookups from it.
+
+The first lookups against a large database are slow while sqlite reads the pages they need from disk. Every lookup
+passes through the upper levels of a digest index, so probing each index at evenly spaced keys reads those levels
+ahead of time. Running each lookup query once also fills the pool of connections and the compiled statement cache.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Mapping
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+from . import crud, optimize
+from .database import PACKED_TABLE, missing_hash_indexes
+
+# digests of each type that are never in the database, used to run each lookup query once
+PLACEHOLDERS = ("0" * 32, "0" * 40, "0" * 64)
+# digests looked up together when replaying a sample
+SAMPLE_CHUNK_SIZE = 1000
+
+
+def probe_keys(count: int) -> list[str]:
+    """Return count hex prefixes evenly spaced across the digest keyspace."""
+    return [f"{i * 2**32 // count:08X}" for i in range(count)]
+
+
+def _probe(engine: Engine, columns: list[str], keys: list[str]) -> int:
+    """Look up the first digest at or after each key in the index for each column."""
+    probed = 0
+    with engine.connect() as conn:
+        # the digests of an optimized database are bytes, which compare in the same order as their hex
+        table, convert = (PACKED_TABLE, bytes.fromhex) if optimize.is_optimized(conn) else ("FILE", str)
+        for column in columns:
+            # only the digest is selected so the lookup reads the index without the table
+            query = text(f"SELECT {column} FROM {table} WHERE {column} >= :key ORDER BY {column} LIMIT 1")  # noqa: S608
+            for key in keys:
+                conn.execute(query, {"key": convert(key)}).first()
+                probed += 1
+    return probed
+
+
+def read_sample(filepath: str, limit: int | None = None) -> list[str]:
+    """Read up to limit digests from a file with one per line."""
+    digests = []
+    with open(filepath) as f:
+        for line in f:
+            digest = line.strip()
+            if digest:
+                digests.append(digest)
+                if limit is not None and len(digests) >= limit:
+                    break
+    return digests
+
+
+def warm_up(
+    engine: Engine,
+    sessions: sessionmaker,
+    probes: int = 4096,
+    sample: Iterable[str] = (),
+    packages: Mapping[int, tuple] | None = None,
+    threads: int = 1,
+) -> dict[str, float]:
+    """Read the pages most lookups need from the database, returning what was done and how long it took.
+
+    The indexes are probed from several threads at once, so reads from disk overlap and each pooled connection is
+    opened. Digest columns without an index are skipped, as probing them would scan the whole table.
+    """
+    start = time.perf_counter()
+    missing = missing_hash_indexes(engine)
+    columns = [column for column in ("sha256", "sha1", "md5") if column not in missing]
+    keys = probe_keys(probes)
+    threads = max(1, min(threads, len(keys)))
+    with ThreadPoolExecutor(threads) as pool:
+        probed = sum(pool.map(lambda part: _probe(engine, columns, part), [keys[i::threads] for i in range(threads)]))
+
+    replayed = 0
+    with sessions() as db:
+        for digest in PLACEHOLDERS:
+            crud.get_distinct(db, digest)
+            crud.get_details(db, digest, packages=packages)
+            crud.get_details_page(db, digest, limit=1, packages=packages)
+            crud.get_summary(db, digest)
+            crud.get_package_samples(db, digest, 1)
+        crud.lookup_batch(db, list(PLACEHOLDERS), packages=packages)
+        crud.lookup_batch(db, list(PLACEHOLDERS), details=True, packages=packages)
+
+        sample = list(sample)
+        for i in range(0, len(sample), SAMPLE_CHUNK_SIZE):
+            chunk = sample[i : i + SAMPLE_CHUNK_SIZE]
+            crud.lookup_batch(db, chunk, details=True, packages=packages)
+            replayed += len(chunk)
+    return {"probes": probed, "sample": replayed, "seconds": time.perf_counter() - start}
@@ -0,0 +1,4 @@
+"""Performance benchmarks for the lookup server.
+
+Run from the repository root, e.g. ``python -m benchmarks.bench_exists --help``.
+"""
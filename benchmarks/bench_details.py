@@ -0,0 +1,111 @@
+"""Compare detailed lookups through ORM hydration against the single JOIN statement."""
+
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import Session, joinedload
+
+from azul_nsrl_lookup_server import crud, database, models, schema
+
+from . import synthetic
+
+
+def orm_lookup(db: Session, digest: str) -> list[schema.FileDetails]:
+    """Detailed lookup as previously implemented, loading ORM objects with joinedload."""
+    kwargs = {crud.digest_type(digest): digest.upper()}
+    query = (
+        db.query(models.File)
+        .options(joinedload(models.File.package).joinedload(models.Pkg.manufacturer))
+        .options(
+            joinedload(models.File.package).joinedload(models.Pkg.operating_system).joinedload(models.Os.manufacturer)
+        )
+        .filter_by(**kwargs)
+    )
+
+    def build_package_dict(obj):
+        result = {}
+        if obj.package:
+            result = {
+                "name": obj.package.name,
+                "version": obj.package.version,
+                "language": obj.package.language,
+                "application_type": obj.package.application_type,
+            }
+            os_val = obj.package.operating_system
+            manufacturer = obj.package.manufacturer
+            if manufacturer:
+                result["manufacturer"] = {"name": manufacturer.name}
+            if os_val:
+                result["operating_system"] = {"name": os_val.name, "version": os_val.version}
+                if manufacturer:
+                    result["operating_system"]["manufacturer"] = {"name": manufacturer.name}
+        if len(result.keys()) == 0:
+            return None
+        return result
+
+    return [
+        schema.FileDetails(
+            sha256=r.sha256,
+            sha1=r.sha1,
+            md5=r.md5,
+            file_name=r.file_name,
+            file_size=r.file_size,
+            package=build_package_dict(r),
+        )
+        for r in query.all()
+    ]
+
+
+def timed(fn, db: Session, digests: list[str]) -> float:
+    """Return the mean milliseconds per lookup."""
+    start = time.perf_counter()
+    for digest in digests:
+        fn(db, digest)
+    return (time.perf_counter() - start) / len(digests) * 1e3
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    engine, SessionLocal = database.setup_engine(args.db)
+    models.Reflected.prepare(bind=engine, views=True)
+    popular = synthetic.popular_digests(args.db)
+    single = synthetic.sample_digests(args.db, args.lookups)["md5"]
+
+    with SessionLocal() as db:
+        # both paths must produce identical responses
+        for digest in popular[:10] + single[:10]:
+            expected = json.dumps(jsonable_encoder(orm_lookup(db, digest)))
+            assert expected == json.dumps(jsonable_encoder(crud.get_details(db, digest)))  # noqa: S101
+
+        print(f"{'lookup':<24}{'orm (ms)':>12}{'join (ms)':>12}{'speedup':>10}")
+        for label, digests in [("single package", single), (f"{len(popular)} popular files", popular)]:
+            orm = timed(orm_lookup, db, digests)
+            join = timed(crud.get_details, db, digests)
+            print(f"{label:<24}{orm:>12.3f}{join:>12.3f}{orm / join:>9.1f}x")
+
+        # popular files a page at a time, and with only the fields needed to list their packages
+        full = timed(crud.get_details, db, popular)
+        fields = crud.parse_fields(["file_name", "package.name", "package.version"])
+        print(f"\n{'popular files':<24}{'ms':>12}{'speedup':>10}")
+        for label, fn in [
+            ("all rows", crud.get_details),
+            ("first 50", lambda db, d: crud.get_details_page(db, d, limit=50)),
+            ("projected", lambda db, d: crud.get_details_page(db, d, fields=fields)),
+            ("first 50 projected", lambda db, d: crud.get_details_page(db, d, limit=50, fields=fields)),
+        ]:
+            ms = timed(fn, db, popular)
+            print(f"{label:<24}{ms:>12.3f}{full / ms:>9.1f}x")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
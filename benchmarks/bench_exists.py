@@ -0,0 +1,52 @@
+"""Compare existence checks through the DISTINCT_HASH view against direct FILE lookups."""
+
+import argparse
+import time
+
+from sqlalchemy.orm import Session
+
+from azul_nsrl_lookup_server import crud, database, models
+
+from . import synthetic
+
+
+def view_lookup(db: Session, digest: str):
+    """Existence check as previously implemented, through the DISTINCT_HASH view."""
+    kwargs = {crud.digest_type(digest): digest.upper()}
+    return db.query(models.DistinctHash).filter_by(**kwargs).first()
+
+
+def timed(fn, db: Session, digests: list[str]) -> float:
+    """Return the mean microseconds per lookup."""
+    start = time.perf_counter()
+    for digest in digests:
+        fn(db, digest)
+    return (time.perf_counter() - start) / len(digests) * 1e6
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    engine, SessionLocal = database.setup_engine(args.db)
+    models.Reflected.prepare(bind=engine, views=True)
+    hits = synthetic.sample_digests(args.db, args.lookups)
+    misses = synthetic.missing_digests(args.lookups)
+
+    print(f"{'lookup':<16}{'view (us)':>12}{'file (us)':>12}{'speedup':>10}")
+    with SessionLocal() as db:
+        for label, digests in [("hit", hits), ("miss", misses)]:
+            for dtype in ("md5", "sha1", "sha256"):
+                view = timed(view_lookup, db, digests[dtype])
+                direct = timed(crud.get_distinct, db, digests[dtype])
+                print(f"{dtype + ' ' + label:<16}{view:>12.1f}{direct:>12.1f}{view / direct:>9.1f}x")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
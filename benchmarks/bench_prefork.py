@@ -0,0 +1,122 @@
+"""Compare the memory used by workers spawned by uvicorn against workers forked from a prepared parent.
+
+Servers are started with each number of workers, with the PKG, OS and MFG tables preloaded and the database memory
+mapped, and memory is read from /proc once a round of lookups has been served. PSS divides shared pages between the
+processes sharing them, so the total PSS is the memory the server really uses. Linux only.
+"""
+
+import argparse
+import os
+import subprocess  # noqa: S404
+import sys
+import time
+
+import httpx
+
+from . import synthetic
+
+
+def descendants(pid: int) -> list[int]:
+    """Return the processes started by pid, recursively."""
+    found = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            for child in f.read().split():
+                found.append(int(child))
+                found.extend(descendants(int(child)))
+    return found
+
+
+def memory(pid: int) -> dict[str, int]:
+    """Return the RSS, PSS and unshared memory of a process in bytes."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0]) * 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def start(db: str, port: int, workers: int, prefork: bool) -> subprocess.Popen:
+    """Start a server and wait for all its workers to be ready."""
+    env = {
+        **os.environ,
+        "NSRL_DB_FILEPATH": os.path.abspath(db),
+        "NSRL_DB_PRELOAD_DIMENSIONS": "true",
+        "NSRL_DB_MMAP_SIZE": str(2**31 - 2**16),
+        "NSRL_DB_IMMUTABLE": "true",
+        "NSRL_SERVER_CACHE_SIZE": "0",
+    }
+    args = ["--port", str(port), "--workers", str(workers), "--prefork" if prefork else "--no-prefork"]
+    proc = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-m", "azul_nsrl_lookup_server.cli", "server", *args],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    for _ in range(600):
+        try:
+            if httpx.get(f"http://localhost:{port}/ready").status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("Server didn't start")
+
+
+def measure(db: str, port: int, workers: int, prefork: bool, digests: list[str]) -> dict:
+    """Serve lookups from a server, then read the memory used by each of its processes."""
+    proc = start(db, port, workers, prefork)
+    try:
+        # spawned workers may still be starting once one is ready
+        time.sleep(3)
+        for digest in digests:
+            # a new connection per lookup so they are spread across the workers
+            httpx.get(f"http://localhost:{port}/details/{digest}")
+        processes = [proc.pid, *descendants(proc.pid)]
+        return {pid: memory(pid) for pid in processes}
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", help="Database to serve, generated if it doesn't exist.")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--packages", type=int, default=200_000, help="PKG rows when generating the database.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups served before measuring.")
+    parser.add_argument("--port", type=int, default=8898)
+    args = parser.parse_args()
+    args.db = args.db or f"/tmp/nsrl_bench_{args.rows}_pkg{args.packages}.db"  # noqa: S108
+
+    synthetic.ensure(args.db, args.rows, packages=args.packages)
+    digests = synthetic.sample_digests(args.db, args.lookups)["sha256"]
+
+    mb = 2**20
+    print(f"{'mode':<10}{'workers':>8}{'processes':>10}{'RSS/worker':>12}{'USS/worker':>12}{'total PSS':>12}")
+    for workers in args.workers:
+        for prefork in (False, True):
+            processes = measure(args.db, args.port, workers, prefork, digests)
+            # the busiest processes are the workers, the rest are the parent and any helpers
+            busiest = sorted(processes.values(), key=lambda m: m["uss"], reverse=True)[:workers]
+            rss = sum(m["rss"] for m in busiest) / workers
+            uss = sum(m["uss"] for m in busiest) / workers
+            pss = sum(m["pss"] for m in processes.values())
+            print(
+                f"{'prefork' if prefork else 'spawn':<10}{workers:>8}{len(processes):>10}"
+                f"{rss / mb:>10.1f}MB{uss / mb:>10.1f}MB{pss / mb:>10.1f}MB",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compare returning response models for FastAPI to validate and encode against encoding plain values directly.
+
+Both routes run the same query through the whole FastAPI stack, so the difference is building and encoding results.
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from azul_nsrl_lookup_server import crud, database, models, schema
+from azul_nsrl_lookup_server.server import json_response
+
+from . import synthetic
+
+
+def build_app(db) -> FastAPI:
+    """Build an app serving lookups both ways."""
+    app = FastAPI()
+
+    @app.get("/model/{digest}", response_model=list[schema.FileDetails])
+    async def details_model(digest: str):
+        return crud.get_details(db, digest)
+
+    @app.get("/plain/{digest}", response_model=list[schema.FileDetails])
+    async def details_plain(digest: str):
+        return json_response(crud.get_details(db, digest, plain=True))
+
+    @app.post("/model", response_model=list[schema.BatchDetailsResult])
+    async def batch_model(batch: schema.BatchLookup):
+        return crud.lookup_batch(db, batch.digests, details=True)
+
+    @app.post("/plain", response_model=list[schema.BatchDetailsResult])
+    async def batch_plain(batch: schema.BatchLookup):
+        return json_response(crud.lookup_batch(db, batch.digests, details=True, plain=True))
+
+    return app
+
+
+async def timed(http: httpx.AsyncClient, method: str, path: str, body, repeat: int) -> tuple[float, bytes]:
+    """Return the mean milliseconds per request and the last response body."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        response = await http.request(method, path, json=body)
+    return (time.perf_counter() - start) / repeat * 1e3, response.content
+
+
+async def run(app: FastAPI, cases: list[tuple], repeat: int):
+    """Time each case both ways, checking the responses are identical."""
+    transport = httpx.ASGITransport(app=app)
+    print(f"{'response':<28}{'bytes':>10}{'model (ms)':>12}{'plain (ms)':>12}{'speedup':>10}")
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for label, method, model_path, plain_path, body in cases:
+            model, expected = await timed(http, method, model_path, body, repeat)
+            plain, content = await timed(http, method, plain_path, body, repeat)
+            if content != expected:
+                raise AssertionError(f"Responses differ for {label}")
+            print(f"{label:<28}{len(content):>10}{model:>12.2f}{plain:>12.2f}{model / plain:>9.1f}x")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    engine, SessionLocal = database.setup_engine(args.db)
+    models.Reflected.prepare(bind=engine, views=True)
+    single = synthetic.sample_digests(args.db, 1000)["md5"]
+    popular = synthetic.popular_digests(args.db)[0]
+
+    cases = [
+        ("details, 1 file", "GET", f"/model/{single[0]}", f"/plain/{single[0]}", None),
+        ("details, popular file", "GET", f"/model/{popular}", f"/plain/{popular}", None),
+        ("batch details, 100 files", "POST", "/model", "/plain", {"digests": single[:100]}),
+        ("batch details, 1000 files", "POST", "/model", "/plain", {"digests": single}),
+    ]
+    with SessionLocal() as db:
+        asyncio.run(run(build_app(db), cases, args.repeat))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
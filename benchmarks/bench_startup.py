@@ -0,0 +1,79 @@
+"""Compare how long the server takes to start serving lookups, with and without the UI and schema reflection.
+
+Each run starts a server process and times it until /ready answers, along with how long importing the server module
+takes in a fresh interpreter. The fastest of the runs is reported as the others only add noise from the machine.
+"""
+
+import argparse
+import os
+import subprocess  # noqa: S404
+import sys
+import time
+
+import httpx
+
+from . import synthetic
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import azul_nsrl_lookup_server.server
+print(time.perf_counter() - start)
+"""
+
+
+def env(db: str, api_only: bool) -> dict[str, str]:
+    """Environment of a server for the database."""
+    return {**os.environ, "NSRL_DB_FILEPATH": os.path.abspath(db), "NSRL_SERVER_API_ONLY": str(api_only).lower()}
+
+
+def time_import(db: str, api_only: bool) -> float:
+    """Return the seconds taken to import the server module."""
+    output = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", IMPORT_SCRIPT], env=env(db, api_only), capture_output=True, check=True
+    ).stdout
+    return float(output)
+
+
+def time_ready(db: str, port: int, api_only: bool) -> float:
+    """Return the seconds from starting a server until it is ready."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-m", "azul_nsrl_lookup_server.cli", "server", "--port", str(port)],
+        env=env(db, api_only),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while proc.poll() is None:
+            try:
+                if httpx.get(f"http://localhost:{port}/ready").status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError("Server didn't start")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8899)
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    print(f"{'mode':<10}{'import (s)':>12}{'ready (s)':>12}")
+    for api_only in (False, True):
+        imported = min(time_import(args.db, api_only) for _ in range(args.runs))
+        ready = min(time_ready(args.db, args.port, api_only) for _ in range(args.runs))
+        print(f"{'api-only' if api_only else 'full':<10}{imported:>12.3f}{ready:>12.3f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare existence checks against sqlite with the binary hash store."""
+
+import argparse
+import os
+import time
+
+from azul_nsrl_lookup_server import crud, database
+from azul_nsrl_lookup_server.hashstore import HashStore, export_store
+
+from . import synthetic
+
+
+def timed(fn, digests: list[str]) -> float:
+    """Return the mean microseconds per lookup."""
+    start = time.perf_counter()
+    for digest in digests:
+        fn(digest)
+    return (time.perf_counter() - start) / len(digests) * 1e6
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--store", default="/tmp/nsrl_bench.store")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    if not os.path.isdir(args.store):
+        start = time.perf_counter()
+        export_store(args.db, args.store)
+        print(f"Exported store in {time.perf_counter() - start:.1f}s")
+    size = sum(os.path.getsize(os.path.join(args.store, name)) for name in os.listdir(args.store))
+    print(f"Store size {size / 2**20:.0f}MB, database size {os.path.getsize(args.db) / 2**20:.0f}MB")
+
+    engine, SessionLocal = database.setup_engine(args.db)
+    store = HashStore.open(args.store)
+    hits = synthetic.sample_digests(args.db, args.lookups)
+    misses = synthetic.missing_digests(args.lookups)
+
+    print(f"{'lookup':<16}{'sqlite (us)':>12}{'store (us)':>12}{'speedup':>10}")
+    with SessionLocal() as db:
+        for label, digests in [("hit", hits), ("miss", misses)]:
+            for dtype in ("md5", "sha1", "sha256"):
+                sqlite = timed(lambda d: crud.get_distinct(db, d), digests[dtype])
+                direct = timed(store.get, digests[dtype])
+                print(f"{dtype + ' ' + label:<16}{sqlite:>12.1f}{direct:>12.1f}{sqlite / direct:>9.1f}x")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
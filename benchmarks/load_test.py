@@ -0,0 +1,126 @@
+"""Measure sustained throughput and latency of a lookup server under many concurrent clients.
+
+Either targets a running server with --url or starts one against --db, with --cwd selecting which checkout of the
+server to run so different versions can be compared.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess  # noqa: S404
+import sys
+import time
+
+import httpx
+
+from . import synthetic
+
+
+async def client(http: httpx.AsyncClient, paths: list[str], deadline: float, latencies: list[float], errors: list):
+    """Issue requests back to back until the deadline."""
+    rand = random.Random()  # noqa: S311
+    while time.monotonic() < deadline:
+        path = rand.choice(paths)
+        start = time.perf_counter()
+        try:
+            response = await http.get(path)
+            if response.status_code not in (200, 404):
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(url: str, paths: list[str], clients: int, duration: float) -> dict:
+    """Run clients concurrently for the duration and summarise the results."""
+    latencies: list[float] = []
+    errors: list = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        # warm up connections and the page cache
+        await asyncio.gather(*[http.get(p) for p in paths[: clients * 2]], return_exceptions=True)
+        deadline = time.monotonic() + duration
+        start = time.monotonic()
+        await asyncio.gather(*[client(http, paths, deadline, latencies, errors) for _ in range(clients)])
+        elapsed = time.monotonic() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": quantiles[49] * 1e3,
+        "p99_ms": quantiles[98] * 1e3,
+    }
+
+
+def start_server(db: str, port: int, cwd: str, workers: int) -> subprocess.Popen:
+    """Start a server on the database and wait for it to accept requests."""
+    env = {
+        **os.environ,
+        "NSRL_DB_FILEPATH": os.path.abspath(db),
+        "NSRL_SERVER_CACHE_SIZE": "0",
+        "PYTHONPATH": os.path.abspath(cwd),
+    }
+    proc = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-m", "uvicorn", "azul_nsrl_lookup_server.server:app", "--port", str(port)]
+        + ["--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=cwd,
+        env=env,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://localhost:{port}/docs")
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("Server didn't start")
+
+
+def main():
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Server to test, one is started against --db if not given.")
+    parser.add_argument("--db", default="/tmp/nsrl_bench.db")  # noqa: S108
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--cwd", default=".", help="Checkout of the server to start.")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 200, 400])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--hit-ratio", type=float, default=0.05)
+    parser.add_argument("--endpoint", choices=["exists", "details"], default="exists")
+    args = parser.parse_args()
+
+    synthetic.ensure(args.db, args.rows)
+    hits = [d for digests in synthetic.sample_digests(args.db, 2000).values() for d in digests]
+    misses = [d for digests in synthetic.missing_digests(2000).values() for d in digests]
+    count = 10000
+    num_hits = int(count * args.hit_ratio)
+    digests = random.choices(hits, k=num_hits) + random.choices(misses, k=count - num_hits)  # noqa: S311
+    paths = [f"/{args.endpoint}/{d}" for d in digests]
+
+    proc = None
+    url = args.url
+    if not url:
+        proc = start_server(args.db, args.port, args.cwd, args.workers)
+        url = f"http://localhost:{args.port}"
+    try:
+        print(f"{'clients':>8}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for clients in args.clients:
+            r = asyncio.run(run(url, paths, clients, args.duration))
+            print(
+                f"{r['clients']:>8}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10.0f}"
+                f"{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            )
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
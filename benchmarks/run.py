@@ -0,0 +1,203 @@
+"""Benchmark the server end to end by endpoint, digest type, hit ratio and number of concurrent clients.
+
+A synthetic database of the requested scale is generated if it doesn't exist and a server started against it, or
+--url targets a running server. Results are written as JSON so runs can be compared to find regressions:
+
+    python -m benchmarks.run --rows 10000000 --output baseline.json
+    python -m benchmarks.run --rows 10000000 --output results.json --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess  # noqa: S404
+import sys
+import time
+
+import httpx
+
+from azul_nsrl_lookup_server import __version__
+
+from . import load_test, synthetic
+
+DIGEST_TYPES = ("md5", "sha1", "sha256")
+ENDPOINTS = ("exists", "details", "ui")
+# requests per scenario that clients pick from at random
+REQUESTS = 2000
+
+
+def build_requests(endpoint: str, hits: list[str], misses: list[str], hit_ratio: float) -> list[tuple]:
+    """Return requests for the endpoint, as method, path and form data, with the ratio of hits given."""
+    rand = random.Random(0)  # noqa: S311
+    num_hits = round(REQUESTS * hit_ratio)
+    digests = rand.choices(hits, k=num_hits) + rand.choices(misses, k=REQUESTS - num_hits)
+    if endpoint == "ui":
+        return [("POST", "/", {"digest": d, "detailed": "true"}) for d in digests]
+    return [("GET", f"/{endpoint}/{d}", None) for d in digests]
+
+
+async def client(http: httpx.AsyncClient, requests: list[tuple], deadline: float, latencies: list, errors: list):
+    """Issue requests back to back until the deadline."""
+    rand = random.Random()  # noqa: S311
+    while time.monotonic() < deadline:
+        method, path, data = rand.choice(requests)
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, path, data=data)
+            if response.status_code not in (200, 404):
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+
+async def measure(url: str, requests: list[tuple], clients: int, duration: float) -> dict:
+    """Run clients concurrently for the duration and summarise their latencies."""
+    latencies: list[float] = []
+    errors: list = []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        # open the connections before timing
+        await asyncio.gather(*[http.request(m, p, data=d) for m, p, d in requests[:clients]])
+        deadline = time.monotonic() + duration
+        start = time.monotonic()
+        await asyncio.gather(*[client(http, requests, deadline, latencies, errors) for _ in range(clients)])
+        elapsed = time.monotonic() - start
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.fmean(latencies) * 1e3,
+        "p50_ms": quantiles[49] * 1e3,
+        "p90_ms": quantiles[89] * 1e3,
+        "p99_ms": quantiles[98] * 1e3,
+        "max_ms": max(latencies) * 1e3,
+    }
+
+
+def scenario_key(result: dict) -> str:
+    """Identify a scenario so results can be matched across runs."""
+    return f"{result['endpoint']}/{result['digest_type']}/hits={result['hit_ratio']:g}/clients={result['clients']}"
+
+
+def environment(args) -> dict:
+    """Describe what was benchmarked, so results are only compared with like runs."""
+    try:
+        commit = subprocess.run(  # noqa: S603
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            cwd=args.cwd,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": str(__version__),
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "db": {
+            "filepath": os.path.abspath(args.db),
+            "bytes": os.path.getsize(args.db),
+            "rows": args.rows,
+            "skew": args.skew,
+        },
+        "workers": args.workers,
+        "duration": args.duration,
+    }
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> int:
+    """Print the change in each scenario from the baseline, returning the number of regressions."""
+    previous = {scenario_key(r): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\n{'scenario':<48}{'p50 ms':>10}{'change':>9}{'rps':>10}{'change':>9}")
+    for result in results:
+        key = scenario_key(result)
+        if key not in previous:
+            continue
+        p50 = result["p50_ms"] / previous[key]["p50_ms"] - 1
+        rps = result["rps"] / previous[key]["rps"] - 1
+        regressed = p50 > threshold or rps < -threshold
+        regressions += regressed
+        print(
+            f"{key:<48}{result['p50_ms']:>10.2f}{p50:>+9.0%}{result['rps']:>10.0f}{rps:>+9.0%}"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return regressions
+
+
+def main():
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server to test, one is started against --db if not given.")
+    parser.add_argument("--db", help="Database to test, generated if it doesn't exist.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="FILE rows when generating the database.")
+    parser.add_argument("--skew", type=float, default=2.0, help="Skew of files towards a few packages.")
+    parser.add_argument("--cwd", default=".", help="Checkout of the server to start.")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--digest-types", nargs="+", choices=DIGEST_TYPES, default=list(DIGEST_TYPES))
+    parser.add_argument("--hit-ratios", type=float, nargs="+", default=[1.0, 0.0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--duration", type=float, default=3, help="Seconds to run each scenario for.")
+    parser.add_argument("--output", help="File to write the results to as JSON.")
+    parser.add_argument("--baseline", help="Results of a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported as a regression.")
+    args = parser.parse_args()
+    args.db = args.db or f"/tmp/nsrl_bench_{args.rows}_skew{args.skew:g}.db"  # noqa: S108
+
+    synthetic.ensure(args.db, args.rows, skew=args.skew)
+    hits = synthetic.sample_digests(args.db, REQUESTS)
+    misses = synthetic.missing_digests(REQUESTS)
+
+    proc = None
+    url = args.url
+    if not url:
+        proc = load_test.start_server(args.db, args.port, args.cwd, args.workers)
+        url = f"http://localhost:{args.port}"
+    results = []
+    try:
+        print(f"{'scenario':<48}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for endpoint, dtype, hit_ratio, clients in itertools.product(
+            args.endpoints, args.digest_types, args.hit_ratios, args.clients
+        ):
+            requests = build_requests(endpoint, hits[dtype], misses[dtype], hit_ratio)
+            result = {"endpoint": endpoint, "digest_type": dtype, "hit_ratio": hit_ratio, "clients": clients}
+            result.update(asyncio.run(measure(url, requests, clients, args.duration)))
+            results.append(result)
+            print(
+                f"{scenario_key(result):<48}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.0f}"
+                f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}",
+                flush=True,
+            )
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(args), "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{regressions} scenarios regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
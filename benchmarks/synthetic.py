@@ -0,0 +1,171 @@
+"""Generate synthetic RDSv3 databases for benchmarking."""
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import Callable
+
+from azul_nsrl_lookup_server import database
+
+# FILE rows inserted per transaction
+BATCH_SIZE = 1_000_000
+
+SCHEMA = os.path.join(os.path.dirname(__file__), os.pardir, "tests", "data", "rdsv3_minimal.schema.sql")
+
+
+def generate(
+    filepath: str,
+    rows: int,
+    packages: int = 10000,
+    popular: int = 100,
+    popular_packages: int = 500,
+    skew: float = 2.0,
+    index: bool = True,
+    progress: Callable[[int], None] | None = None,
+) -> None:
+    """Create a database at filepath with the given number of random FILE rows.
+
+    Files are spread over packages with a power law, so with a skew above 1 a few packages hold many of the files as
+    in NSRL, where operating systems and SDKs dwarf most applications. Packages share names across versions.
+    A number of popular files are also added that are each in popular_packages packages.
+
+    Rows are generated inside sqlite in batches. Each sha256 starts with a prefix rising with the row number, so rows
+    are appended to the primary key index in order and databases of 100M rows can be generated without sorting.
+    """
+    db = sqlite3.connect(filepath)
+    db.create_function("skewed", 3, _skewed, deterministic=True)
+    try:
+        db.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;")
+        with open(SCHEMA) as f:
+            db.executescript(f.read())
+        db.execute(
+            "INSERT INTO VERSION VALUES (?, 'Modern', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 'Synthetic minimal')",
+            (f"synthetic-{rows}",),
+        )
+        db.execute("INSERT INTO MFG VALUES (1, 'Synthetic Manufacturer')")
+        db.execute("INSERT INTO OS VALUES (1, 'Synthetic OS', '1.0', 1)")
+        db.execute(
+            """
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO PKG
+            SELECT i, 'Package ' || (i / 4), '1.' || (i % 4), 1, 1, 'English',
+                   CASE WHEN i % 10 = 0 THEN 'Operating System' WHEN i % 10 = 1 THEN 'Game' ELSE 'Application' END
+            FROM n
+            """,
+            (packages,),
+        )
+        # the rising prefix takes 15 of the 64 hex digits, leaving the rest random
+        step = 2**60 // max(rows, 1)
+        for start in range(0, rows, BATCH_SIZE):
+            db.execute(
+                """
+                WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                INSERT INTO FILE
+                SELECT printf('%015X', i * ?) || substr(hex(randomblob(25)), 1, 49), hex(randomblob(20)),
+                       hex(randomblob(16)), 'FILE' || i || '.DLL', abs(random()) % 10000000,
+                       skewed(abs(random()) / 9223372036854775807.0, ?, ?)
+                FROM n
+                """,
+                (start, min(start + BATCH_SIZE, rows) - 1, step, packages, skew),
+            )
+            db.commit()
+            if progress:
+                progress(min(start + BATCH_SIZE, rows))
+        for i in range(popular):
+            db.execute(
+                """
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                INSERT INTO FILE SELECT ?, ?, ?, 'POPULAR' || ? || '.DLL', 1234, i FROM n
+                """,
+                (
+                    popular_packages,
+                    os.urandom(32).hex().upper(),
+                    os.urandom(20).hex().upper(),
+                    os.urandom(16).hex().upper(),
+                    i,
+                ),
+            )
+        db.commit()
+    finally:
+        db.close()
+    if index:
+        database.build_hash_indexes(filepath)
+
+
+def _skewed(uniform: float, packages: int, skew: float) -> int:
+    """Map a uniform random number in [0, 1] to a package id, favouring low ids more the higher the skew."""
+    return min(int(packages * uniform**skew), packages - 1) + 1
+
+
+def sample_digests(filepath: str, count: int) -> dict[str, list[str]]:
+    """Return a random sample of digests present in the database, by digest type."""
+    db = sqlite3.connect(filepath)
+    try:
+        rows = db.execute("SELECT sha256, sha1, md5 FROM FILE ORDER BY random() LIMIT ?", (count,)).fetchall()
+    finally:
+        db.close()
+    return {
+        "sha256": [r[0] for r in rows],
+        "sha1": [r[1] for r in rows],
+        "md5": [r[2] for r in rows],
+    }
+
+
+def popular_digests(filepath: str) -> list[str]:
+    """Return the md5 of each popular file in the database."""
+    db = sqlite3.connect(filepath)
+    try:
+        return [r[0] for r in db.execute("SELECT DISTINCT md5 FROM FILE WHERE file_name LIKE 'POPULAR%'")]
+    finally:
+        db.close()
+
+
+def missing_digests(count: int) -> dict[str, list[str]]:
+    """Return random digests that are almost certainly not in the database, by digest type."""
+    return {
+        "sha256": [os.urandom(32).hex().upper() for _ in range(count)],
+        "sha1": [os.urandom(20).hex().upper() for _ in range(count)],
+        "md5": [os.urandom(16).hex().upper() for _ in range(count)],
+    }
+
+
+def ensure(filepath: str, rows: int, **kwargs) -> None:
+    """Generate the database unless it already exists."""
+    if os.path.exists(filepath):
+        return
+    print(f"Generating {rows:,} row database at {filepath}...")
+    start = time.monotonic()
+
+    def progress(done: int):
+        elapsed = time.monotonic() - start
+        print(f"  {done:,} rows in {elapsed:.0f}s ({done / elapsed:,.0f} rows/s)", flush=True)
+
+    generate(filepath, rows, progress=progress if rows > BATCH_SIZE else None, **kwargs)
+    print(f"Generated in {time.monotonic() - start:.1f}s")
+
+
+def main():
+    """Generate a synthetic database from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("filepath")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--packages", type=int, default=10000)
+    parser.add_argument("--popular", type=int, default=100, help="Number of files that are in many packages.")
+    parser.add_argument("--popular-packages", type=int, default=500, help="Number of packages per popular file.")
+    parser.add_argument("--skew", type=float, default=2.0, help="Skew of files towards a few packages, 1 for none.")
+    parser.add_argument("--no-index", action="store_true", help="Don't build the md5/sha1 indexes.")
+    args = parser.parse_args()
+    generate(
+        args.filepath,
+        args.rows,
+        packages=args.packages,
+        popular=args.popular,
+        popular_packages=args.popular_packages,
+        skew=args.skew,
+        index=not args.no_index,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,7 @@ URL=${TRIMMED_URL}/rds_${RDS_RELEASE_VERSION}/${ARCHIVE}
 mkdir -p "${BASE_PATH}"
 cd "${BASE_PATH}"
 
-if [ -d "${RELEASE}" ]; then
+if [ -f "${RELEASE}/${RELEASE}.db" ]; then
     echo "Database already downloaded, no changes made."
     exit 0
 fi
@@ -32,12 +32,14 @@ echo Downloading database from the url \'"${URL}"\'
 echo
 
 curl -o "${ARCHIVE}" "${URL}"
-unzip "${ARCHIVE}"
+
+DB_FILE="${BASE_PATH}/${RELEASE}/${RELEASE}.db"
+mkdir -p "${BASE_PATH}/${RELEASE}"
+azul-nsrl-lookup-server ingest "${ARCHIVE}" --filepath "${DB_FILE}"
 if [ $? -ne 0 ]; then
     echo "Database extraction failed."
     exit 1
 fi
 
-DB_FILE="${BASE_PATH}/${RELEASE}/${RELEASE}.db"
 echo Database extracted to: $(ls "${DB_FILE}")
 rm -f "${ARCHIVE}"
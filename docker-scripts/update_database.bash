@@ -46,21 +46,24 @@ echo
 echo Downloading database delta from the url \'"${URL}"\'
 echo
 
-curl -o ${ARCHIVE} ${URL}
-unzip ${ARCHIVE}
-if [ $? -ne 0 ]; then
-    echo "Database extraction failed."
-    exit 1
-fi
-rm -f "${ARCHIVE}"
+curl -o "${ARCHIVE}" "${URL}"
 
 echo "Updating SQL db with delta"
 
-DELTA_SQL_FILE="${DELTA_DIR}/RDS_${DELTA_RELEASE}.sql"
-sqlite3 "${DB_FILE}" ".read ${DELTA_SQL_FILE}"
+# applied to a copy so a server using the database never sees part of the delta, then moved over it in one rename.
+# Applying the delta resumes from where it stopped in the copy if run again after a failure.
+UPDATE_FILE="${DB_FILE}.updating"
+if [ ! -f "${UPDATE_FILE}" ]; then
+    cp --reflink=auto "${DB_FILE}" "${UPDATE_FILE}.partial"
+    mv "${UPDATE_FILE}.partial" "${UPDATE_FILE}"
+fi
+# applied straight from the archive, with the indexes built again afterwards as nothing is served from the copy
+azul-nsrl-lookup-server ingest "${ARCHIVE}" --filepath "${UPDATE_FILE}" --defer-indexes
 if [ $? -ne 0 ]; then
-    echo "Database failed to update. Update sql file not removed."
+    echo "Database failed to update. Delta archive and partially updated copy not removed."
     exit 1
 fi
-rm "${DELTA_SQL_FILE}"
+mv "${UPDATE_FILE}" "${DB_FILE}"
+mkdir -p "${DELTA_DIR}"
+rm -f "${ARCHIVE}"
 echo "Database updated."
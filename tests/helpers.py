@@ -0,0 +1,31 @@
+"""Helpers shared by the tests."""
+
+import os
+import sqlite3
+import unittest
+
+from azul_nsrl_lookup_server import server
+
+SCHEMA_SCRIPT = os.path.join(os.path.dirname(__file__), "data", "rdsv3_minimal.schema.sql")
+
+# module globals of the server set by starting it or serving a database
+SERVER_GLOBALS = ("served", "db_executor", "ready", "shards")
+
+
+def create_database(filepath: str) -> sqlite3.Connection:
+    """Create an empty database with the RDS schema, returning a connection to fill it with."""
+    db = sqlite3.connect(filepath)
+    with open(SCHEMA_SCRIPT) as f:
+        db.executescript(f.read())
+    return db
+
+
+def keep_server(test: unittest.TestCase):
+    """Let a test start the server or serve its own database, restoring the server once the test has finished."""
+    saved = {name: getattr(server, name) for name in SERVER_GLOBALS}
+
+    def restore():
+        for name, value in saved.items():
+            setattr(server, name, value)
+
+    test.addCleanup(restore)
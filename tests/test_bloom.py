@@ -0,0 +1,68 @@
+"""Test the membership filter."""
+
+import os
+import tempfile
+import unittest
+
+from azul_nsrl_lookup_server.bloom import BloomFilter, build_filter
+from azul_nsrl_lookup_server.server import load_filter
+from tests.helpers import create_database
+
+
+class TestBloomFilter(unittest.TestCase):
+    """Tests for building and loading the membership filter."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Construct a database of random digests."""
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.tmpdir.name, "nsrl.db")
+        db = create_database(cls.db_file)
+        db.execute("insert into VERSION values ('2024.03.1', 'Modern', 0, 0, 'minimal')")
+        cls.rows = [
+            (os.urandom(32).hex().upper(), os.urandom(20).hex().upper(), os.urandom(16).hex().upper())
+            for _ in range(1000)
+        ]
+        db.executemany("insert into FILE values (?, ?, ?, 'A.EXE', 1, 1)", cls.rows)
+        db.commit()
+        db.close()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Remove the test database."""
+        cls.tmpdir.cleanup()
+
+    def test_build_and_open(self):
+        """All digests in the database are in the filter and most others aren't."""
+        filepath = os.path.join(self.tmpdir.name, "nsrl.filter")
+        built = build_filter(self.db_file, filepath, 0.001)
+        loaded = BloomFilter.open(filepath)
+        self.assertEqual((loaded.num_bits, loaded.num_hashes), (built.num_bits, built.num_hashes))
+        self.assertEqual(loaded.version, "2024.03.1")
+
+        for row in self.rows:
+            for digest in row:
+                self.assertIn(digest, loaded)
+                self.assertIn(digest.lower(), loaded)
+
+        false_positives = sum(os.urandom(16).hex() in loaded for _ in range(10000))
+        self.assertLess(false_positives, 50)
+
+    def test_load_stale(self):
+        """Filters built for another release aren't used."""
+        filepath = os.path.join(self.tmpdir.name, "stale.filter")
+        build_filter(self.db_file, filepath, 0.01)
+        self.assertIsNotNone(load_filter(filepath, "2024.03.1"))
+        self.assertIsNone(load_filter(filepath, "2024.03.1,2024.09.1"))
+        self.assertIsNone(load_filter(os.path.join(self.tmpdir.name, "missing.filter"), "2024.03.1"))
+
+    def test_invalid_digest(self):
+        """Digests that can't be decoded can't be ruled out."""
+        empty = BloomFilter(bytes(16), 128, 3)
+        self.assertNotIn("a" * 32, empty)
+        self.assertIn("z" * 32, empty)
+
+    def test_not_a_filter(self):
+        """Opening a file that isn't a filter fails."""
+        with self.assertRaises(ValueError):
+            BloomFilter.open(self.db_file)
@@ -0,0 +1,30 @@
+"""Test splitting streamed bulk uploads."""
+
+import unittest
+
+from azul_nsrl_lookup_server.bulk import LineSplitter
+
+
+class TestLineSplitter(unittest.TestCase):
+    """Tests for splitting uploads into digests."""
+
+    def test_split_across_chunks(self):
+        """Lines split across chunks are joined, blank lines and whitespace are dropped."""
+        splitter = LineSplitter()
+        self.assertEqual(splitter.feed(b"aa\r\nb"), ["aa"])
+        self.assertEqual(splitter.feed(b"b"), [])
+        self.assertEqual(splitter.feed(b"b\n\n  \ncc"), ["bbb"])
+        self.assertEqual(splitter.flush(), ["cc"])
+        self.assertEqual(splitter.flush(), [])
+
+    def test_long_lines(self):
+        """Lines longer than the limit are truncated without being buffered."""
+        splitter = LineSplitter(max_length=4)
+        self.assertEqual(splitter.feed(b"abc"), [])
+        self.assertEqual(splitter.feed(b"defgh"), ["abcd"])
+        self.assertEqual(splitter.feed(b"ijk"), [])
+        self.assertEqual(splitter.feed(b"lmn\nxy\n0123456\nz"), ["xy", "0123"])
+        self.assertEqual(splitter.flush(), ["z"])
+
+        splitter.feed(b"abcdefgh")
+        self.assertEqual(splitter.flush(), [])
@@ -0,0 +1,52 @@
+"""Test the lookup cache."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from azul_nsrl_lookup_server.cache import MISSING, LookupCache
+
+
+class TestLookupCache(unittest.TestCase):
+    """Tests for the in-process lookup cache."""
+
+    def test_hits_and_misses(self):
+        """Results are cached by kind and normalised digest, including negative results."""
+        cache = LookupCache(10, 60)
+        self.assertIs(cache.get("exists", "ab"), MISSING)
+        cache.set("exists", "ab", None)
+        cache.set("details", "AB", [1])
+        self.assertIsNone(cache.get("exists", "AB"))
+        self.assertEqual(cache.get("details", "ab"), [1])
+        self.assertEqual(cache.stats(), {"size": 2, "maxsize": 10, "hits": 2, "misses": 1, "invalidations": 0})
+
+    def test_lru_eviction(self):
+        """The least recently used result is evicted when full."""
+        cache = LookupCache(2, 60)
+        cache.set("exists", "a", 1)
+        cache.set("exists", "b", 2)
+        cache.get("exists", "a")
+        cache.set("exists", "c", 3)
+        self.assertEqual(cache.get("exists", "a"), 1)
+        self.assertIs(cache.get("exists", "b"), MISSING)
+        self.assertEqual(cache.get("exists", "c"), 3)
+
+    def test_ttl(self):
+        """Results expire after the time to live."""
+        cache = LookupCache(2, 0.01)
+        cache.set("exists", "a", 1)
+        time.sleep(0.02)
+        self.assertIs(cache.get("exists", "a"), MISSING)
+
+    def test_invalidated_on_change(self):
+        """The cache is cleared when the watched file changes."""
+        with tempfile.NamedTemporaryFile() as f:
+            cache = LookupCache(2, 60, watch_path=f.name, check_interval=0)
+            cache.set("exists", "a", 1)
+            self.assertEqual(cache.get("exists", "a"), 1)
+            f.write(b"new release")
+            f.flush()
+            os.utime(f.name, ns=(0, 0))
+            self.assertIs(cache.get("exists", "a"), MISSING)
+            self.assertEqual(cache.stats()["invalidations"], 1)
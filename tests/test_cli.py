@@ -0,0 +1,107 @@
+"""Test the command line interface."""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+
+from typer.testing import CliRunner
+
+from azul_nsrl_lookup_server.cli import cli
+from tests.helpers import create_database
+
+
+class TestIndex(unittest.TestCase):
+    """Tests for building the digest indexes."""
+
+    def setUp(self) -> None:
+        """Construct an empty database."""
+        self.db_file = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+        db = create_database(self.db_file)
+        db.execute("insert into FILE values ('A' , 'B', 'C', 'WORD.EXE', '1', '1')")
+        db.commit()
+        db.close()
+        self.runner = CliRunner()
+
+    def tearDown(self) -> None:
+        """Remove the test database."""
+        os.unlink(self.db_file)
+
+    def _plan(self, column: str) -> str:
+        db = sqlite3.connect(self.db_file)
+        try:
+            rows = db.execute(f"explain query plan select * from FILE where {column} = 'C'").fetchall()
+        finally:
+            db.close()
+        return " ".join(r[-1] for r in rows)
+
+    def test_index(self):
+        """Missing indexes are reported and built."""
+        result = self.runner.invoke(cli, ["index", "--filepath", self.db_file, "--check"])
+        self.assertEqual(result.exit_code, 1, result.output)
+        self.assertIn("md5, sha1", result.output)
+        self.assertIn("SCAN FILE", self._plan("md5"))
+
+        result = self.runner.invoke(cli, ["index", "--filepath", self.db_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("USING INDEX IDX_FILE__MD5", self._plan("md5"))
+        self.assertIn("USING INDEX IDX_FILE__SHA1", self._plan("sha1"))
+
+        result = self.runner.invoke(cli, ["index", "--filepath", self.db_file, "--check"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("All digest indexes present", result.output)
+
+    def test_bulk(self):
+        """Digests are looked up from a file, with a result per line."""
+        db = sqlite3.connect(self.db_file)
+        db.execute(f"insert into FILE values ('{'A' * 64}', '{'B' * 40}', '{'C' * 32}', 'WORD.EXE', '1', '1')")
+        db.commit()
+        db.close()
+        digests = "\n".join(["c" * 32, "notadigest", "d" * 64] + ["e" * 40] * 3)
+        result = self.runner.invoke(cli, ["bulk", "--filepath", self.db_file, "--chunk-size", "2"], input=digests)
+        self.assertEqual(result.exit_code, 0, result.output)
+        results = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual([r["found"] for r in results], [True, False, False, False, False, False])
+        self.assertEqual(results[0]["result"], {"sha256": "A" * 64, "sha1": "B" * 40, "md5": "C" * 32})
+        self.assertIn("Invalid digest", results[1]["error"])
+
+    def test_ingest(self):
+        """A zipped delta is applied and the digest indexes dropped for it are rebuilt."""
+        db = sqlite3.connect(self.db_file)
+        db.execute("create index IDX_FILE__MD5 on FILE (md5)")
+        db.commit()
+        db.close()
+        archive = os.path.join(os.path.dirname(self.db_file), f"{os.path.basename(self.db_file)}.delta.zip")
+        self.addCleanup(os.unlink, archive)
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("RDS_delta.sql", "INSERT INTO FILE VALUES ('D', 'E', 'F', 'NEW.EXE', 1, 1);\n")
+
+        result = self.runner.invoke(cli, ["ingest", archive, "--filepath", self.db_file, "--defer-indexes"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Applied 1 statements", result.output)
+        self.assertIn("USING INDEX IDX_FILE__MD5", self._plan("md5"))
+        self.assertIn("USING INDEX IDX_FILE__SHA1", self._plan("sha1"))
+
+        result = self.runner.invoke(cli, ["ingest", archive, "--filepath", self.db_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Applied 0 statements", result.output)
+        self.assertIn("1 were already applied", result.output)
+
+    def test_optimize(self):
+        """An optimized copy of the database is built."""
+        db = sqlite3.connect(self.db_file)
+        db.execute("update FILE set sha256 = ?, sha1 = ?, md5 = ?", ("A" * 64, "B" * 40, "C" * 32))
+        db.commit()
+        db.close()
+        output = f"{self.db_file}.optimized"
+        self.addCleanup(os.unlink, output)
+        result = self.runner.invoke(cli, ["optimize", output, "--filepath", self.db_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Optimized 1 files with 1 distinct names", result.output)
+        db = sqlite3.connect(output)
+        try:
+            self.assertEqual(db.execute("select file_name from FILE").fetchall(), [("WORD.EXE",)])
+        finally:
+            db.close()
@@ -0,0 +1,77 @@
+"""Test the database connection setup."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from azul_nsrl_lookup_server import settings
+from azul_nsrl_lookup_server.database import setup_engine
+
+
+class TestConnectionMode(unittest.TestCase):
+    """Tests for the read-only connection mode and connection PRAGMAs."""
+
+    def setUp(self) -> None:
+        """Construct a database in a path that needs quoting as a URI."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "nsrl #1?.db")
+        db = sqlite3.connect(self.db_file)
+        db.execute("create table FILE (md5 VARCHAR)")
+        db.execute("insert into FILE values ('A')")
+        db.commit()
+        db.close()
+
+    def tearDown(self) -> None:
+        """Remove the test database."""
+        self.tmpdir.cleanup()
+
+    def _pragma(self, conn, name: str):
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    def test_default(self):
+        """By default the database is writable and sqlite defaults are kept."""
+        engine, _ = setup_engine(self.db_file)
+        with engine.connect() as conn:
+            self.assertEqual(self._pragma(conn, "query_only"), 0)
+            self.assertEqual(self._pragma(conn, "temp_store"), 0)
+            conn.exec_driver_sql("insert into FILE values ('B')")
+        engine.dispose()
+
+    def test_read_only(self):
+        """Read-only mode rejects writes and PRAGMAs are applied to every connection."""
+        overrides = {"read_only": True, "mmap_size": 1 << 20, "cache_size": -4096, "temp_store": "memory"}
+        with mock.patch.multiple(settings.db, **overrides):
+            engine, _ = setup_engine(self.db_file)
+        self.assertEqual(engine.url.query, {"mode": "ro", "uri": "true"})
+        with engine.connect() as conn, engine.connect() as conn2:
+            for c in (conn, conn2):
+                self.assertEqual(self._pragma(c, "query_only"), 1)
+                self.assertEqual(self._pragma(c, "mmap_size"), 1 << 20)
+                self.assertEqual(self._pragma(c, "cache_size"), -4096)
+                self.assertEqual(self._pragma(c, "temp_store"), 2)
+            self.assertEqual(conn.exec_driver_sql("select md5 from FILE").scalar(), "A")
+            with self.assertRaises(OperationalError):
+                conn.exec_driver_sql("insert into FILE values ('B')")
+        engine.dispose()
+
+    def test_immutable(self):
+        """Immutable mode opens the database read-only without locking."""
+        with mock.patch.object(settings.db, "immutable", True):
+            engine, _ = setup_engine(self.db_file)
+        self.assertEqual(engine.url.query, {"mode": "ro", "immutable": "1", "uri": "true"})
+        with engine.connect() as conn:
+            self.assertEqual(self._pragma(conn, "query_only"), 1)
+            self.assertEqual(conn.exec_driver_sql("select md5 from FILE").scalar(), "A")
+            # an immutable database can be read while another connection holds an exclusive lock
+            locker = sqlite3.connect(self.db_file)
+            locker.execute("begin exclusive")
+            try:
+                self.assertEqual(conn.exec_driver_sql("select count(*) from FILE").scalar(), 1)
+            finally:
+                locker.rollback()
+                locker.close()
+        engine.dispose()
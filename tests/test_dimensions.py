@@ -0,0 +1,89 @@
+"""Test the preloaded dimension tables."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from azul_nsrl_lookup_server import crud, server
+from azul_nsrl_lookup_server.dimensions import Dimensions
+from tests.helpers import create_database, keep_server
+
+
+class TestDimensions(unittest.TestCase):
+    """Tests for resolving details from preloaded packages."""
+
+    def setUp(self) -> None:
+        """Construct a database of packages with and without an operating system and manufacturer."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "nsrl.db")
+        db = create_database(self.db_file)
+        db.executescript(
+            f"""
+            insert into VERSION values ('2024.03.1', 'Modern', 0, 0, 'minimal');
+            insert into MFG values (1, 'Microsoft Corporation');
+            insert into OS values (1, 'Windows NT', '4.0', 1);
+            insert into PKG values (1, 'Word', '2000', 1, 1, 'English', 'Application');
+            insert into PKG values (2, 'Word', '2003', NULL, 1, 'English', 'Application');
+            insert into PKG values (3, 'Excel', '2000', 1, NULL, 'English', 'Application');
+            insert into FILE values ('{"A" * 64}', '{"A" * 40}', '{"A" * 32}', 'WORD.EXE', 1, 1);
+            insert into FILE values ('{"A" * 64}', '{"A" * 40}', '{"A" * 32}', 'WORD.EXE', 1, 2);
+            insert into FILE values ('{"A" * 64}', '{"A" * 40}', '{"A" * 32}', 'WORD.EXE', 1, 3);
+            insert into FILE values ('{"B" * 64}', '{"B" * 40}', '{"B" * 32}', 'ORPHAN.EXE', 2, 99);
+            """
+        )
+        db.commit()
+        db.close()
+        self.engine = create_engine(f"sqlite:///{self.db_file}")
+
+    def tearDown(self) -> None:
+        """Remove the test database."""
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_details_match_joins(self):
+        """Details resolved from memory are the same as those from joining the tables."""
+        with self.engine.connect() as conn:
+            dims = Dimensions.load(conn)
+        self.assertEqual(len(dims), 3)
+        self.assertEqual(dims.version, "2024.03.1")
+        self.assertGreater(dims.memory_size(), 0)
+
+        with Session(self.engine) as db:
+            for digest in ("A" * 32, "b" * 40, "C" * 64):
+                self.assertEqual(
+                    crud.get_details(db, digest, packages=dims.packages), crud.get_details(db, digest), digest
+                )
+            self.assertEqual(
+                crud.get_details_many(db, ["A" * 64, "B" * 32], packages=dims.packages),
+                crud.get_details_many(db, ["A" * 64, "B" * 32]),
+            )
+            fields = crud.parse_fields(["file_name", "package.operating_system"])
+            self.assertEqual(
+                crud.get_details_page(db, "A" * 32, limit=2, fields=fields, packages=dims.packages),
+                crud.get_details_page(db, "A" * 32, limit=2, fields=fields),
+            )
+
+    def test_reload_on_new_release(self):
+        """The tables are only reloaded when the database release changes."""
+        keep_server(self)
+        server.serve(
+            server.ServedDatabase(self.engine, sessionmaker(bind=self.engine), "2024.03.1", self.db_file, None)
+        )
+        server.load_dimensions()
+        loaded = server._current().dimensions
+        server.load_dimensions()
+        self.assertIs(server._current().dimensions, loaded)
+
+        db = sqlite3.connect(self.db_file)
+        db.execute("insert into VERSION values ('2024.09.1', 'Modern', 0, 0, 'delta')")
+        db.execute("insert into PKG values (4, 'Access', '2000', 1, 1, 'English', 'Application')")
+        db.commit()
+        db.close()
+        server.load_dimensions()
+        self.assertIsNot(server._current().dimensions, loaded)
+        self.assertEqual(server._current().dimensions.version, "2024.03.1,2024.09.1")
+        self.assertEqual(len(server._current().dimensions), 4)
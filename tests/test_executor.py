@@ -0,0 +1,62 @@
+"""Test the database executor."""
+
+import asyncio
+import threading
+import unittest
+
+from azul_nsrl_lookup_server.executor import DBExecutor, ExecutorBusy
+
+
+class TestDBExecutor(unittest.IsolatedAsyncioTestCase):
+    """Tests for running database work off the event loop."""
+
+    async def test_run(self):
+        """Calls run on the executor's threads."""
+        executor = DBExecutor(2)
+        try:
+            name = await executor.run(lambda prefix: prefix + threading.current_thread().name, prefix="thread ")
+            self.assertTrue(name.startswith("thread nsrl-db"), name)
+            self.assertEqual(executor.pending, 0)
+        finally:
+            executor.shutdown()
+
+    async def test_max_workers(self):
+        """No more than max_workers calls run at once."""
+        executor = DBExecutor(2)
+        running = 0
+        peak = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            threading.Event().wait(0.01)
+            with lock:
+                running -= 1
+
+        try:
+            await asyncio.gather(*[executor.run(work) for _ in range(10)])
+        finally:
+            executor.shutdown()
+        self.assertEqual(peak, 2)
+
+    async def test_max_pending(self):
+        """Calls are rejected once max_pending are waiting."""
+        executor = DBExecutor(1, max_pending=2)
+        release = threading.Event()
+        try:
+            waiting = [asyncio.create_task(executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            self.assertTrue(executor.busy)
+            with self.assertRaises(ExecutorBusy):
+                await executor.run(release.wait)
+            waiting.append(asyncio.create_task(executor.run(release.wait, admitted=True)))
+            await asyncio.sleep(0)
+            self.assertEqual(executor.pending, 3)
+            release.set()
+            self.assertEqual(await asyncio.gather(*waiting), [True, True, True])
+        finally:
+            release.set()
+            executor.shutdown()
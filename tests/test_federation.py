@@ -0,0 +1,129 @@
+"""Test looking up digests across several datasets."""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from azul_nsrl_lookup_server import crud, federation, server, settings
+from azul_nsrl_lookup_server.bloom import BloomFilter
+from azul_nsrl_lookup_server.server import app
+from tests.helpers import create_database, keep_server
+
+# never finishes unless interrupted
+ENDLESS = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+
+
+def create_dataset(filepath: str, digests: list[str]):
+    """Create a database containing a file for each digest."""
+    db = create_database(filepath)
+    db.execute("insert into PKG values (1, 'Package', '1.0', NULL, NULL, 'English', 'Operating System')")
+    for digest in digests:
+        db.execute("insert into FILE values (?, ?, ?, 'FILE.EXE', 1, 1)", (digest * 64, digest * 40, digest * 32))
+    db.commit()
+    db.close()
+
+
+class TestFederation(unittest.TestCase):
+    """Tests for federated lookups."""
+
+    def setUp(self) -> None:
+        """Serve a main database with two other datasets."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        paths = {name: os.path.join(self.tmpdir.name, f"{name}.db") for name in ("modern", "legacy", "android")}
+        create_dataset(paths["modern"], ["A"])
+        create_dataset(paths["legacy"], ["A", "B"])
+        create_dataset(paths["android"], ["C"])
+
+        keep_server(self)
+        self.patches = [
+            mock.patch.object(settings.db, "filepath", paths["modern"]),
+            mock.patch.object(settings.db, "datasets", {"legacy": paths["legacy"], "android": paths["android"]}),
+            mock.patch.object(settings.db, "dataset_timeout", 0.5),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.client = TestClient(app)
+        self.client.__enter__()
+
+    def tearDown(self) -> None:
+        """Stop the server and remove the databases."""
+        self.client.__exit__(None, None, None)
+        for patch in self.patches:
+            patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_exists(self):
+        """Existence lookups report every dataset containing the file."""
+        response = self.client.get("/federated/exists/" + "a" * 32)
+        self.assertEqual(response.status_code, 200, response.text)
+        result = response.json()
+        self.assertEqual(result["datasets"], ["modern", "legacy"])
+        self.assertEqual(result["result"]["sha1"], "A" * 40)
+        self.assertEqual(result["errors"], {})
+
+        response = self.client.get("/federated/exists/" + "C" * 40)
+        self.assertEqual(response.json()["datasets"], ["android"])
+        self.assertEqual(self.client.get("/federated/exists/" + "D" * 40).status_code, 404)
+        self.assertEqual(self.client.get("/federated/exists/nothex").status_code, 400)
+
+    def test_details(self):
+        """Details from every dataset are merged, tagged by dataset."""
+        response = self.client.get("/federated/details/" + "A" * 64)
+        self.assertEqual(response.status_code, 200, response.text)
+        result = response.json()
+        self.assertEqual([r["dataset"] for r in result["results"]], ["modern", "legacy"])
+        self.assertEqual(result["results"][1]["package"]["name"], "Package")
+
+        # the main database is skipped when its membership filter rules the file out
+        server._current().membership_filter = BloomFilter(bytes(16), 128, 3)
+        result = self.client.get("/federated/details/" + "A" * 64).json()
+        self.assertEqual(result["datasets"], ["legacy"])
+
+    def test_timeout(self):
+        """Datasets that don't answer in time are reported while results from the others are returned."""
+        get_details = crud.get_details
+
+        def slow_legacy(db, *args, **kwargs):
+            if db.get_bind().url.database.endswith("legacy.db"):
+                db.execute(text(ENDLESS))
+            return get_details(db, *args, **kwargs)
+
+        with mock.patch.object(crud, "get_details", slow_legacy):
+            start = time.monotonic()
+            response = self.client.get("/federated/details/" + "A" * 32)
+            self.assertLess(time.monotonic() - start, 2)
+            self.assertEqual(response.status_code, 200, response.text)
+            result = response.json()
+            self.assertEqual(result["datasets"], ["modern"])
+            self.assertEqual(result["errors"], {"legacy": "Timed out after 0.5s."})
+
+            response = self.client.get("/federated/details/" + "B" * 32)
+            self.assertEqual(response.status_code, 504, response.text)
+            self.assertIn("legacy", response.json()["detail"])
+
+    def test_interrupted(self):
+        """Queries past their deadline are interrupted, freeing their thread."""
+        shard = server.shards[0]
+        start = time.monotonic()
+        with self.assertRaises(OperationalError):
+            federation.call_with_deadline(lambda db: db.execute(text(ENDLESS)), shard.sessions, start + 0.2)
+        self.assertLess(time.monotonic() - start, 2)
+        # connections are reused without a deadline afterwards
+        self.assertEqual(
+            federation.call_with_deadline(lambda db: db.execute(text("SELECT 1")).scalar(), shard.sessions, None), 1
+        )
+
+    def test_missing(self):
+        """Startup fails if a dataset doesn't exist."""
+        with mock.patch.object(settings.db, "datasets", {"ios": os.path.join(self.tmpdir.name, "ios.db")}):
+            with self.assertRaises(FileNotFoundError):
+                server.open_shards()
+        with mock.patch.object(settings.db, "datasets", {"modern": settings.db.filepath}):
+            with self.assertRaises(ValueError):
+                server.open_shards()
@@ -0,0 +1,75 @@
+"""Test the binary hash store."""
+
+import os
+import tempfile
+import unittest
+
+from azul_nsrl_lookup_server.hashstore import HashStore, export_store
+from azul_nsrl_lookup_server.server import load_store
+from tests.helpers import create_database
+
+
+class TestHashStore(unittest.TestCase):
+    """Tests for exporting and searching the hash store."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Construct a database of random digests."""
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.db_file = os.path.join(cls.tmpdir.name, "nsrl.db")
+        db = create_database(cls.db_file)
+        db.execute("insert into VERSION values ('2024.03.1', 'Modern', 0, 0, 'minimal')")
+        cls.rows = [
+            (os.urandom(32).hex().upper(), os.urandom(20).hex().upper(), os.urandom(16).hex().upper())
+            for _ in range(5000)
+        ]
+        db.executemany("insert into FILE values (?, ?, ?, 'A.EXE', 1, 1)", cls.rows)
+        # the same file in another package is only stored once
+        db.executemany("insert into FILE values (?, ?, ?, 'B.EXE', 1, 2)", cls.rows[:100])
+        db.commit()
+        db.close()
+        cls.store_dir = os.path.join(cls.tmpdir.name, "store")
+        cls.store = export_store(cls.db_file, cls.store_dir)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Remove the test database."""
+        cls.tmpdir.cleanup()
+
+    def test_export(self):
+        """Every distinct file is exported once."""
+        self.assertEqual(len(self.store), len(self.rows))
+        self.assertEqual(self.store.version, "2024.03.1")
+        self.assertEqual(os.path.getsize(os.path.join(self.store_dir, "md5.bin")) // len(self.rows), 20)
+        self.assertEqual(sorted(os.listdir(self.store_dir)), ["md5.bin", "sha1.bin", "sha256.bin"])
+
+    def test_get(self):
+        """Files are found by any of their digests, in any case, and nothing else is."""
+        store = HashStore.open(self.store_dir)
+        for row in self.rows:
+            for digest in row:
+                self.assertEqual(store.get(digest), row)
+                self.assertEqual(store.get(digest.lower()), row)
+        for size in (16, 20, 32):
+            for _ in range(1000):
+                self.assertIsNone(store.get(os.urandom(size).hex()))
+        self.assertIsNone(store.get("00" * 16))
+        self.assertIsNone(store.get("ff" * 32))
+        self.assertIsNone(store.get("notadigest"))
+        self.assertIsNone(store.get("ab" * 24))
+
+    def test_load_stale(self):
+        """Stores exported from another release aren't used."""
+        self.assertIsNotNone(load_store(self.store_dir, "2024.03.1"))
+        self.assertIsNone(load_store(self.store_dir, "2024.03.1,2024.09.1"))
+        self.assertIsNone(load_store(os.path.join(self.tmpdir.name, "missing"), "2024.03.1"))
+
+    def test_not_a_store(self):
+        """Files that aren't part of a store are rejected."""
+        directory = os.path.join(self.tmpdir.name, "bad")
+        os.makedirs(directory)
+        for name in ("md5.bin", "sha1.bin", "sha256.bin"):
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(bytes(64))
+        with self.assertRaises(ValueError):
+            HashStore.open(directory)
@@ -0,0 +1,185 @@
+"""Test ingesting releases from their archives."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from azul_nsrl_lookup_server import ingest
+from tests.helpers import create_database
+
+DELTA = """BEGIN TRANSACTION;
+DELETE FROM FILE WHERE sha256 = 'A';
+INSERT INTO FILE VALUES ('D', 'D', 'D', 'SEMI;COLON.EXE', 1, 1);
+INSERT INTO FILE VALUES ('E', 'E', 'E', 'MULTI
+LINE.EXE', 1, 1);
+INSERT INTO FILE VALUES ('F', 'F', 'F', 'F.EXE', 1, 1);
+INSERT INTO VERSION VALUES ('2099.01.1', 'modern', 0, 0, 'delta');
+COMMIT;
+"""
+
+
+def create_indexed_database(filepath: str):
+    """Create an indexed database with a few files."""
+    db = create_database(filepath)
+    for digest in "ABC":
+        db.execute("insert into FILE values (?, ?, ?, 'FILE.EXE', 1, 1)", (digest, digest, digest))
+    db.execute("create index IDX_FILE__MD5 on FILE (md5)")
+    db.execute("create index IDX_FILE__SHA1 on FILE (sha1)")
+    db.commit()
+    db.close()
+
+
+def query(filepath: str, sql: str) -> list:
+    """Return the rows of a query on the database."""
+    db = sqlite3.connect(filepath)
+    try:
+        return db.execute(sql).fetchall()
+    finally:
+        db.close()
+
+
+class TestIngest(unittest.TestCase):
+    """Tests for applying deltas and extracting databases."""
+
+    def setUp(self) -> None:
+        """Construct a database and a zipped delta for it."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "RDS_modern_minimal.db")
+        create_indexed_database(self.db_file)
+        self.archive = os.path.join(self.tmpdir.name, "delta.zip")
+        with zipfile.ZipFile(self.archive, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("RDS_2099.01.1_modern_minimal_delta/README.txt", "readme")
+            z.writestr("RDS_2099.01.1_modern_minimal_delta/RDS_2099.01.1_modern_minimal_delta.sql", DELTA)
+
+    def tearDown(self) -> None:
+        """Remove the databases."""
+        self.tmpdir.cleanup()
+
+    def test_statements(self):
+        """Statements are split at their end, not at semicolons or line breaks inside them."""
+        lines = DELTA.encode().splitlines(keepends=True)
+        result = list(ingest.statements(iter(lines)))
+        self.assertEqual(len(result), 7)
+        self.assertIn(b"SEMI;COLON", result[2][0])
+        self.assertIn(b"MULTI\nLINE", result[3][0])
+        self.assertEqual(result[-1][1], len(DELTA))
+        # a trailing statement without a semicolon is still returned
+        self.assertEqual(list(ingest.statements(iter([b"SELECT 1"]))), [(b"SELECT 1", 8)])
+
+    def test_apply_delta(self):
+        """The delta is applied with the digest indexes dropped, and applying it again does nothing."""
+        with ingest.Source(self.archive) as source:
+            self.assertTrue(source.is_delta)
+            result = ingest.apply_delta(self.db_file, source, batch_size=2, defer_indexes=True)
+        self.assertEqual(result, {"applied": 7, "skipped": 0, "dropped_indexes": ["IDX_FILE__MD5", "IDX_FILE__SHA1"]})
+        self.assertEqual(query(self.db_file, "select sha256 from FILE order by sha256"), [(d,) for d in "BCDEF"])
+        self.assertEqual(query(self.db_file, "select version from VERSION"), [("2099.01.1",)])
+        self.assertEqual(query(self.db_file, "select name from sqlite_master where name like 'IDX_FILE__%'"), [])
+        self.assertEqual(query(self.db_file, "pragma journal_mode"), [("delete",)])
+
+        with ingest.Source(self.archive) as source:
+            result = ingest.apply_delta(self.db_file, source, batch_size=2, defer_indexes=True)
+        self.assertEqual(result, {"applied": 0, "skipped": 7, "dropped_indexes": ["IDX_FILE__MD5", "IDX_FILE__SHA1"]})
+        self.assertEqual(query(self.db_file, "select count(*) from FILE"), [(5,)])
+
+    def test_comments_and_shared_lines(self):
+        """Comments before statements and several statements on a line are applied as sqlite3 would."""
+        delta = (
+            "-- NSRL delta\n"
+            "BEGIN TRANSACTION;\n"
+            "/* removed */ DELETE FROM FILE WHERE sha256 = 'A'; DELETE FROM FILE WHERE sha256 = 'B';\n"
+            "INSERT INTO FILE VALUES ('D', 'D', 'D', 'D.EXE', 1, 1); -- added\n"
+            "INSERT INTO FILE VALUES ('E', 'E', 'E', 'E.EXE', 1, 1);\n"
+            "-- done\n"
+            "COMMIT;\n"
+        )
+        lines = delta.encode().splitlines(keepends=True)
+        self.assertEqual(
+            [statement.strip() for statement, _ in ingest.statements(iter(lines))],
+            [
+                b"-- NSRL delta\nBEGIN TRANSACTION;",
+                b"/* removed */ DELETE FROM FILE WHERE sha256 = 'A';",
+                b"DELETE FROM FILE WHERE sha256 = 'B';",
+                b"INSERT INTO FILE VALUES ('D', 'D', 'D', 'D.EXE', 1, 1);",
+                b"-- added\nINSERT INTO FILE VALUES ('E', 'E', 'E', 'E.EXE', 1, 1);",
+                b"-- done\nCOMMIT;",
+            ],
+        )
+
+        with zipfile.ZipFile(self.archive, "w") as z:
+            z.writestr("RDS_delta.sql", delta)
+        with ingest.Source(self.archive) as source:
+            result = ingest.apply_delta(self.db_file, source, batch_size=4)
+        self.assertEqual(result["applied"], 6)
+        self.assertEqual(query(self.db_file, "select sha256 from FILE order by sha256"), [(d,) for d in "CDE"])
+
+    def test_resume(self):
+        """An interrupted delta resumes after the last batch applied."""
+
+        def interrupt(done: int, total: int, statements: int):
+            if statements >= 4:
+                raise KeyboardInterrupt()
+
+        with ingest.Source(self.archive) as source:
+            with self.assertRaises(KeyboardInterrupt):
+                ingest.apply_delta(self.db_file, source, batch_size=2, progress=interrupt)
+        self.assertEqual(query(self.db_file, "select statements, completed from INGEST_PROGRESS"), [(4, 0)])
+        self.assertEqual(query(self.db_file, "select sha256 from FILE order by sha256"), [(d,) for d in "BCDE"])
+
+        with ingest.Source(self.archive) as source:
+            result = ingest.apply_delta(self.db_file, source, batch_size=2)
+        # the indexes are kept unless deferred
+        self.assertEqual(result, {"applied": 3, "skipped": 4, "dropped_indexes": []})
+        self.assertEqual(query(self.db_file, "select sha256 from FILE order by sha256"), [(d,) for d in "BCDEF"])
+        self.assertEqual(query(self.db_file, "pragma integrity_check"), [("ok",)])
+
+    def test_extract_database(self):
+        """A full database is extracted from its archive, resuming a partial extraction."""
+        archive = os.path.join(self.tmpdir.name, "full.zip")
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+            z.write(self.db_file, "RDS_modern_minimal/RDS_modern_minimal.db")
+        with open(self.db_file, "rb") as f:
+            expected = f.read()
+        output = os.path.join(self.tmpdir.name, "out.db")
+
+        with mock.patch.object(ingest, "CHUNK_SIZE", 1024), ingest.Source(archive) as source:
+            self.assertFalse(source.is_delta)
+            # a partial extraction with a corrupt final chunk
+            with open(f"{output}.partial", "wb") as f:
+                f.write(expected[:3000] + b"\0" * 100)
+            with open(f"{output}.partial.id", "w") as f:
+                f.write(source.id)
+            written = ingest.extract_database(source, output)
+        self.assertEqual(written, len(expected) - 2048)
+        self.assertFalse(os.path.exists(f"{output}.partial"))
+        self.assertFalse(os.path.exists(f"{output}.partial.id"))
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+        # a partial extraction of another release is started again
+        with open(f"{output}.partial", "wb") as f:
+            f.write(b"\1" * 3000)
+        with open(f"{output}.partial.id", "w") as f:
+            f.write("RDS_2024.03.1_modern_minimal.db:00000000")
+        with mock.patch.object(ingest, "CHUNK_SIZE", 1024), ingest.Source(archive) as source:
+            written = ingest.extract_database(source, output)
+        self.assertEqual(written, len(expected))
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_source(self):
+        """Archives without a database or delta are rejected, plain files are read directly."""
+        archive = os.path.join(self.tmpdir.name, "empty.zip")
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("README.txt", "readme")
+        with self.assertRaises(ValueError):
+            ingest.Source(archive)
+
+        with ingest.Source(self.db_file) as source:
+            self.assertFalse(source.is_delta)
+            self.assertEqual(source.size, os.path.getsize(self.db_file))
+            with source.open() as f:
+                self.assertEqual(f.read(16), b"SQLite format 3\0")
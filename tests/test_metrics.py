@@ -0,0 +1,53 @@
+"""Test the metrics."""
+
+import unittest
+
+from azul_nsrl_lookup_server.metrics import Counter, Gauge, Histogram, Registry
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for rendering metrics in the Prometheus text format."""
+
+    def test_counter(self):
+        """Counters are tracked per label values."""
+        counter = Counter("requests_total", "Requests.", ("route", "status"))
+        counter.inc("exists", "200")
+        counter.inc("exists", "200")
+        counter.inc("details", "404")
+        self.assertEqual(counter.value("exists", "200"), 2)
+        self.assertEqual(
+            counter.render(),
+            [
+                "# HELP requests_total Requests.",
+                "# TYPE requests_total counter",
+                'requests_total{route="exists",status="200"} 2',
+                'requests_total{route="details",status="404"} 1',
+            ],
+        )
+
+    def test_histogram(self):
+        """Histogram buckets are cumulative with a +Inf bucket, sum and count."""
+        histogram = Histogram("rows", "Rows.", buckets=(1, 5))
+        for value in (0, 1, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.count(), 4)
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'rows_bucket{le="1"} 2',
+                'rows_bucket{le="5"} 3',
+                'rows_bucket{le="+Inf"} 4',
+                "rows_sum 14.0",
+                "rows_count 4",
+            ],
+        )
+
+    def test_registry(self):
+        """Gauges without a value are rendered without samples."""
+        registry = Registry()
+        registry.register(Gauge("ready", "Ready.", lambda: 1))
+        registry.register(Gauge("unset", "Unset.", lambda: None))
+        self.assertEqual(
+            registry.render(),
+            "# HELP ready Ready.\n# TYPE ready gauge\nready 1\n# HELP unset Unset.\n# TYPE unset gauge\n",
+        )
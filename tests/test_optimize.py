@@ -0,0 +1,109 @@
+"""Test building and querying optimized databases."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from azul_nsrl_lookup_server import database, ingest, optimize, warmup
+from azul_nsrl_lookup_server.models import Reflected
+from tests.helpers import create_database
+
+FILES = [
+    ("A" * 64, "B" * 40, "C" * 32, "COMMON.DLL", 10, 1),
+    ("A" * 64, "B" * 40, "C" * 32, "RARE.EXE", 10, 2),
+    ("D" * 64, "E" * 40, "F" * 32, "COMMON.DLL", 20, 1),
+    ("0" * 64, "1" * 40, "2" * 32, "COMMON.DLL", 30, 3),
+]
+
+
+class TestOptimize(unittest.TestCase):
+    """Tests for the optimized database layout."""
+
+    def setUp(self) -> None:
+        """Construct a database and an optimized copy of it."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "rds.db")
+        db = create_database(self.db_file)
+        db.executemany("insert into FILE values (?, ?, ?, ?, ?, ?)", FILES)
+        db.execute("insert into PKG values (1, 'Package', '1.0', NULL, NULL, 'English', 'Operating System')")
+        db.execute("insert into VERSION values ('2024.03.1', 'modern', 0, 0, 'minimal')")
+        db.commit()
+        db.close()
+        self.optimized_file = os.path.join(self.tmpdir.name, "optimized.db")
+        self.built = optimize.optimize_database(self.db_file, self.optimized_file)
+
+    def tearDown(self) -> None:
+        """Remove the databases."""
+        self.tmpdir.cleanup()
+
+    def query(self, sql: str, filepath: str | None = None) -> list:
+        """Return the rows of a query on the optimized database, or the database given."""
+        db = sqlite3.connect(filepath or self.optimized_file)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_layout(self):
+        """Digests are stored as bytes and names once each, most common first."""
+        self.assertEqual(self.built, {"files": 4, "names": 2})
+        self.assertEqual(self.query("select * from FILE_NAME"), [(1, "COMMON.DLL"), (2, "RARE.EXE")])
+        self.assertEqual(self.query("select typeof(sha256), length(md5) from FILE_PACKED limit 1"), [("blob", 16)])
+        self.assertFalse(os.path.exists(f"{self.optimized_file}.partial"))
+        # the RDS tables and views read the same as the original
+        for table in ("FILE", "DISTINCT_HASH", "PKG", "VERSION"):
+            sql = f"select * from {table} order by 1, 2, 3"  # noqa: S608
+            self.assertEqual(self.query(sql), self.query(sql, self.db_file), table)
+
+        with self.assertRaises(ValueError):
+            optimize.optimize_database(self.optimized_file, os.path.join(self.tmpdir.name, "again.db"))
+
+    def test_lookups(self):
+        """Lookups find the optimized layout and query it by index."""
+        engine = create_engine(f"sqlite:///{self.optimized_file}")
+        try:
+            Reflected.prepare(engine, views=True)
+            with engine.connect() as conn:
+                self.assertTrue(optimize.is_optimized(conn))
+            self.assertEqual(database.missing_hash_indexes(engine), [])
+            for column in ("sha256", "sha1", "md5"):
+                plan = self.query(f"explain query plan select * from FILE_BLOB where {column} = x'00'")
+                self.assertIn("USING INDEX IDX_FILE_PACKED", plan[0][-1])
+
+            warmed = warmup.warm_up(engine, sessionmaker(bind=engine))
+            self.assertEqual(warmed["probes"], 3 * 4096)
+        finally:
+            engine.dispose()
+
+        engine = create_engine(f"sqlite:///{self.db_file}")
+        try:
+            with engine.connect() as conn:
+                self.assertFalse(optimize.is_optimized(conn))
+        finally:
+            engine.dispose()
+
+    def test_indexes(self):
+        """Missing digest indexes of an optimized database are reported and built on its table of files."""
+        db = sqlite3.connect(self.optimized_file)
+        db.execute("drop index IDX_FILE_PACKED__MD5")
+        db.commit()
+        db.close()
+        engine = create_engine(f"sqlite:///{self.optimized_file}")
+        try:
+            self.assertEqual(database.missing_hash_indexes(engine), ["md5"])
+        finally:
+            engine.dispose()
+        self.assertEqual(database.build_hash_indexes(self.optimized_file), ["IDX_FILE_PACKED__MD5"])
+
+    def test_ingest(self):
+        """Deltas can't be applied to an optimized database."""
+        delta = os.path.join(self.tmpdir.name, "delta.sql")
+        with open(delta, "w") as f:
+            f.write("DELETE FROM FILE;\n")
+        with ingest.Source(delta) as source:
+            with self.assertRaises(ValueError):
+                ingest.apply_delta(self.optimized_file, source)
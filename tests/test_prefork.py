@@ -0,0 +1,82 @@
+"""Test serving from workers forked from a prepared parent."""
+
+import os
+import signal
+import socket
+import subprocess  # noqa: S404
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import httpx
+from fastapi.testclient import TestClient
+
+from azul_nsrl_lookup_server import server, settings
+from azul_nsrl_lookup_server.server import app
+from tests.helpers import create_database, keep_server
+
+
+class TestPrefork(unittest.TestCase):
+    """Tests for pre-fork serving."""
+
+    def setUp(self) -> None:
+        """Construct a test database."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "nsrl.db")
+        db = create_database(self.db_file)
+        db.execute("insert into FILE values (?, ?, ?, 'FILE.EXE', 1, 1)", ("A" * 64, "A" * 40, "A" * 32))
+        db.commit()
+        db.close()
+
+    def tearDown(self) -> None:
+        """Remove the test database."""
+        self.tmpdir.cleanup()
+
+    def test_prepare(self):
+        """Workers serve the database opened and warmed up before forking rather than opening their own."""
+        keep_server(self)
+        with (
+            mock.patch.object(settings.db, "filepath", self.db_file),
+            mock.patch.object(settings.db, "warmup", True),
+        ):
+            server.prepare()
+            prepared = server._current().engine
+            self.assertEqual(prepared.pool.checkedin(), 0)
+            with self.assertLogs(server.logger, "INFO") as logs, TestClient(app) as client:
+                self.assertEqual(client.get("/ready").status_code, 200)
+                self.assertIs(server._current().engine, prepared)
+            self.assertTrue(any("Started serving database" in line for line in logs.output))
+            self.assertIsNone(server.served)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/task"), "Needs os.fork and /proc")
+    def test_workers(self):
+        """Forked workers serve lookups, and all exit when the parent is stopped."""
+        with socket.socket() as sock:
+            sock.bind(("localhost", 0))
+            port = sock.getsockname()[1]
+        env = {**os.environ, "NSRL_DB_FILEPATH": self.db_file}
+        proc = subprocess.Popen(  # noqa: S603
+            [sys.executable, "-m", "azul_nsrl_lookup_server.cli", "server", "--port", str(port)]
+            + ["--workers", "2", "--prefork"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            for _ in range(100):
+                try:
+                    response = httpx.get(f"http://localhost:{port}/exists/{'A' * 32}")
+                    break
+                except httpx.HTTPError:
+                    time.sleep(0.1)
+            self.assertEqual(response.status_code, 200)
+            with open(f"/proc/{proc.pid}/task/{proc.pid}/children") as f:
+                workers = [int(pid) for pid in f.read().split()]
+            self.assertEqual(len(workers), 2)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            self.assertEqual(proc.wait(timeout=10), 0)
+        for pid in workers:
+            self.assertFalse(os.path.exists(f"/proc/{pid}"))
@@ -1,16 +1,43 @@
 """Test the web server."""
 
+import asyncio
+import base64
+import json
 import os
-import sqlite3
+import subprocess  # noqa: S404
+import sys
 import tempfile
+import time
 import unittest
+from unittest import mock
 
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from azul_nsrl_lookup_server import crud, metrics, models, server, settings
+from azul_nsrl_lookup_server.bloom import BloomFilter
+from azul_nsrl_lookup_server.cache import LookupCache
+from azul_nsrl_lookup_server.database import db_version
+from azul_nsrl_lookup_server.dimensions import Dimensions
+from azul_nsrl_lookup_server.executor import DBExecutor
+from azul_nsrl_lookup_server.hashstore import export_store
 from azul_nsrl_lookup_server.models import Reflected
-from azul_nsrl_lookup_server.server import app, get_db
+from azul_nsrl_lookup_server.optimize import optimize_database
+from azul_nsrl_lookup_server.server import app
+from azul_nsrl_lookup_server.sharedcache import SharedCache
+from tests.helpers import create_database
+
+# serves lookups in a new process, as API-only servers are set up as the server module is imported
+API_ONLY_SCRIPT = """
+import json, sys
+from fastapi.testclient import TestClient
+from azul_nsrl_lookup_server.server import app
+with TestClient(app) as client:
+    paths = [f"/details/{sys.argv[1]}", "/", "/docs", "/static/css/swagger-ui.css", "/openapi.json"]
+    status = {path: client.get(path).status_code for path in paths}
+print(json.dumps({"status": status, "jinja2": "jinja2" in sys.modules}))
+"""
 
 
 class TestServer(unittest.TestCase):
@@ -20,12 +47,8 @@ class TestServer(unittest.TestCase):
     def setUpClass(cls) -> None:
         """Construct a test database."""
         cls.db_file = tempfile.NamedTemporaryFile().name
-        db_url = f"sqlite:///{cls.db_file}"
 
-        db = sqlite3.connect(cls.db_file)
-        script = os.path.join(os.path.dirname(__file__), "data", "rdsv3_minimal.schema.sql")
-        with open(script) as f:
-            db.executescript(f.read())
+        db = create_database(cls.db_file)
 
         cls.valid_sha256 = "E3B0C44298FC1C149AFBF4C8996FB92427AE41E4649B934CA495991B7852B855"
         cls.valid_sha1 = "AC91EF00F33F12DD491CC91EF00F33F12DD491CA"
@@ -58,20 +81,19 @@ class TestServer(unittest.TestCase):
         db.executescript(script)
         db.commit()
         db.close()
+        cls.serve_database()
 
-        engine = create_engine(db_url, connect_args={"check_same_thread": False})
+    @classmethod
+    def serve_database(cls):
+        """Serve lookups from the test database."""
+        engine = create_engine(f"sqlite:///{cls.db_file}", connect_args={"check_same_thread": False})
         TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
         Reflected.prepare(engine, views=True)
 
-        def override_get_db():
-            try:
-                db = TestingSessionLocal()
-                yield db
-            finally:
-                db.close()
-
-        app.dependency_overrides[get_db] = override_get_db
+        with engine.connect() as conn:
+            version = db_version(conn)
+        server.serve(server.ServedDatabase(engine, TestingSessionLocal, version, cls.db_file, None))
         cls.client = TestClient(app)
 
     @classmethod
@@ -241,3 +263,418 @@ class TestServer(unittest.TestCase):
         response_c = self.client.get(f"/details/{self.partial_md5c}")
         self.assertEqual(response_c.status_code, 200, response_c.text)
         self.assertEqual(response_c.json(), expected_c)
+
+    def test_paged_details(self):
+        """Details are paged with a cursor and projected to the requested fields."""
+        expected = self.client.get(f"/details/{self.valid_sha256}").json()
+        pages = []
+        cursor = None
+        for _ in range(3):
+            params = {"limit": 1} if cursor is None else {"limit": 1, "after": cursor}
+            response = self.client.get(f"/details/{self.valid_sha256}", params=params)
+            self.assertEqual(response.status_code, 200, response.text)
+            pages.append(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[expected[0]], [expected[1]]])
+
+        response = self.client.get(
+            f"/details/{self.valid_md5}", params={"fields": "file_name,package.name,package.manufacturer"}
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "file_name": "WORD.EXE",
+                    "package": {"name": "Microsoft Word", "manufacturer": {"name": "Microsoft Corporation"}},
+                },
+                {
+                    "file_name": "WORD.EXE",
+                    "package": {"name": "Word", "manufacturer": {"name": "Microsoft Corporation"}},
+                },
+            ],
+        )
+        response = self.client.get(f"/details/{self.partial_md5b}", params={"fields": "md5,package.operating_system"})
+        self.assertEqual(response.json(), [{"md5": self.partial_md5b, "package": {"operating_system": None}}])
+
+        response = self.client.get(f"/details/{self.valid_md5}", params={"fields": "package.colour"})
+        self.assertEqual(response.status_code, 400, response.text)
+        response = self.client.get(f"/details/{self.valid_md5}", params={"after": "notacursor"})
+        self.assertEqual(response.status_code, 400, response.text)
+        response = self.client.get(f"/details/{'a' * 32}", params={"limit": 10})
+        self.assertEqual(response.status_code, 404, response.text)
+        response = self.client.get(f"/details/{self.valid_md5}", params={"limit": 0})
+        self.assertEqual(response.status_code, 422, response.text)
+        response = self.client.get(f"/details/{self.valid_md5}", params={"limit": 2**63 - 1})
+        self.assertEqual(response.status_code, 422, response.text)
+        cursor = base64.urlsafe_b64encode(json.dumps(["A", "A", "A", "X", 10**30, 1]).encode()).decode()
+        response = self.client.get(f"/details/{self.valid_md5}", params={"limit": 1, "after": cursor})
+        self.assertEqual(response.status_code, 400, response.text)
+
+    def test_summary(self):
+        """Packages containing a file are summarised."""
+        response = self.client.get(f"/summary/{self.valid_sha1}")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(
+            response.json(),
+            {
+                "files": 2,
+                "unique_packages": 2,
+                "application_types": {"Operating System": 2},
+                "packages": [
+                    {
+                        "name": "Microsoft Word",
+                        "versions": ["2000"],
+                        "application_types": ["Operating System"],
+                        "packages": 1,
+                    },
+                    {"name": "Word", "versions": ["2000"], "application_types": ["Operating System"], "packages": 1},
+                ],
+            },
+        )
+        response = self.client.get(f"/summary/{'a' * 64}")
+        self.assertEqual(response.status_code, 404, response.text)
+        response = self.client.get("/summary/notadigest")
+        self.assertEqual(response.status_code, 400, response.text)
+
+    def test_batch_distinct(self):
+        """Validate batch existence lookups."""
+        missing = "a" * 32
+        digests = [self.valid_md5, self.partial_sha1b.lower(), missing, "notadigest", self.valid_sha256]
+        response = self.client.post("/exists", json={"digests": digests})
+        self.assertEqual(response.status_code, 200, response.text)
+        results = response.json()
+        self.assertEqual([r["digest"] for r in results], digests)
+        self.assertEqual([r["found"] for r in results], [True, True, False, False, True])
+        self.assertEqual(
+            results[0]["result"], {"sha256": self.valid_sha256, "sha1": self.valid_sha1, "md5": self.valid_md5}
+        )
+        self.assertEqual(results[1]["result"]["sha256"], self.partial_sha256b)
+        self.assertIsNone(results[2]["result"])
+        self.assertIsNone(results[2]["error"])
+        self.assertIn("Invalid digest", results[3]["error"])
+        self.assertEqual(results[4]["result"], results[0]["result"])
+
+    def test_batch_details(self):
+        """Validate batch detailed lookups match single lookups."""
+        digests = [self.valid_sha1, self.partial_md5c, "b" * 64]
+        response = self.client.post("/details", json={"digests": digests})
+        self.assertEqual(response.status_code, 200, response.text)
+        results = response.json()
+        self.assertEqual([r["found"] for r in results], [True, True, False])
+        self.assertEqual(results[0]["results"], self.client.get(f"/details/{self.valid_sha1}").json())
+        self.assertEqual(results[1]["results"], self.client.get(f"/details/{self.partial_md5c}").json())
+        self.assertEqual(results[2]["results"], [])
+
+    def test_batch_too_large(self):
+        """Batches over the configured limit are rejected."""
+        response = self.client.post("/exists", json={"digests": ["a" * 32] * 10001})
+        self.assertEqual(response.status_code, 422, response.text)
+
+    def test_bulk(self):
+        """Uploaded digests are streamed back as NDJSON results."""
+        digests = [self.valid_md5, "notadigest", self.partial_sha1b.lower(), "a" * 32]
+        body = "\r\n".join(digests) + "\n\n" + self.partial_sha256c
+        with mock.patch.object(settings.server, "bulk_chunk_size", 2):
+            response = self.client.post("/bulk/exists", content=body)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        results = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([r["digest"] for r in results], digests + [self.partial_sha256c])
+        self.assertEqual([r["found"] for r in results], [True, False, True, False, True])
+
+        response = self.client.post("/bulk/details", content=self.valid_sha1)
+        self.assertEqual(response.status_code, 200, response.text)
+        results = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(results[0]["results"], self.client.get(f"/details/{self.valid_sha1}").json())
+
+    def test_membership_filter(self):
+        """Digests ruled out by the membership filter aren't looked up."""
+        server._current().membership_filter = BloomFilter(bytes(16), 128, 3)
+        try:
+            response = self.client.get(f"/exists/{self.valid_md5}")
+            self.assertEqual(response.status_code, 404, response.text)
+            response = self.client.get(f"/details/{self.valid_sha1}")
+            self.assertEqual(response.status_code, 404, response.text)
+            response = self.client.get("/exists/notadigest")
+            self.assertEqual(response.status_code, 400, response.text)
+            response = self.client.post("/exists", json={"digests": [self.valid_md5]})
+            self.assertEqual(response.json()[0]["found"], False)
+        finally:
+            server._current().membership_filter = None
+
+    def test_hash_store(self):
+        """Existence lookups are answered from the hash store when it is loaded."""
+        with tempfile.TemporaryDirectory() as directory:
+            server._current().hash_store = export_store(self.db_file, directory)
+            try:
+                expected = {"sha256": self.valid_sha256, "sha1": self.valid_sha1, "md5": self.valid_md5}
+                for digest in (self.valid_md5, self.valid_sha1.lower(), self.valid_sha256):
+                    response = self.client.get(f"/exists/{digest}")
+                    self.assertEqual(response.status_code, 200, response.text)
+                    self.assertEqual(response.json(), expected)
+                response = self.client.get(f"/exists/{'a' * 32}")
+                self.assertEqual(response.status_code, 404, response.text)
+                response = self.client.get("/exists/notadigest")
+                self.assertEqual(response.status_code, 400, response.text)
+                response = self.client.get(f"/details/{self.valid_md5}")
+                self.assertEqual(len(response.json()), 2)
+            finally:
+                server._current().hash_store = None
+
+    def test_preloaded_dimensions(self):
+        """Details are the same when packages are resolved from memory."""
+        expected = [self.client.get(f"/details/{d}").json() for d in (self.valid_md5, self.partial_sha1c)]
+        engine = create_engine(f"sqlite:///{self.db_file}")
+        with engine.connect() as conn:
+            server._current().dimensions = Dimensions.load(conn)
+        engine.dispose()
+        try:
+            self.assertEqual(
+                [self.client.get(f"/details/{d}").json() for d in (self.valid_md5, self.partial_sha1c)], expected
+            )
+            response = self.client.post("/details", json={"digests": [self.valid_md5, self.partial_sha1c]})
+            self.assertEqual([r["results"] for r in response.json()], expected)
+        finally:
+            server._current().dimensions = None
+
+    def test_lookup_cache(self):
+        """Lookup results are cached and counted."""
+        response = self.client.get("/cache/stats")
+        self.assertEqual(response.status_code, 404, response.text)
+
+        server._current().lookup_cache = LookupCache(10, 60)
+        try:
+            missing = "c" * 40
+            for _ in range(2):
+                response = self.client.get(f"/details/{self.valid_md5.lower()}")
+                self.assertEqual(response.status_code, 200, response.text)
+                self.assertEqual(len(response.json()), 2)
+                response = self.client.get(f"/exists/{missing}")
+                self.assertEqual(response.status_code, 404, response.text)
+            response = self.client.get("/cache/stats")
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(response.json(), {"size": 2, "maxsize": 10, "hits": 2, "misses": 2, "invalidations": 0})
+        finally:
+            server._current().lookup_cache = None
+
+    def test_shared_cache(self):
+        """Details found are shared through the shared cache, behind the cache of each worker."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            server._current().shared_cache = SharedCache(os.path.join(tmpdir, "cache.db"), 2**20, "test")
+            try:
+                expected = self.client.get(f"/details/{self.valid_md5}").json()
+                self.assertEqual(self.client.get("/details/" + "c" * 40).status_code, 404)
+                server._current().lookup_cache = LookupCache(10, 60)
+                with mock.patch.object(crud, "get_details", side_effect=AssertionError("queried")):
+                    response = self.client.get(f"/details/{self.valid_md5.lower()}")
+                    self.assertEqual(response.status_code, 200, response.text)
+                    self.assertEqual(response.json(), expected)
+                    # the result was promoted to the cache of the worker
+                    self.client.get(f"/details/{self.valid_md5}")
+                self.assertEqual(server._current().shared_cache.stats(), {"hits": 1, "misses": 2, "evictions": 0})
+                self.assertEqual(server._current().lookup_cache.stats()["hits"], 1)
+            finally:
+                server._current().shared_cache = None
+                server._current().lookup_cache = None
+
+    def test_db_executor(self):
+        """Lookups run on the database executor and are rejected when it is saturated."""
+        server.db_executor = DBExecutor(1)
+        try:
+            response = self.client.get(f"/exists/{self.valid_md5}")
+            self.assertEqual(response.status_code, 200, response.text)
+            response = self.client.post("/details", json={"digests": [self.valid_md5]})
+            self.assertEqual(len(response.json()[0]["results"]), 2)
+
+            server.db_executor.max_pending = 1
+            server.db_executor.pending = 1
+            response = self.client.get(f"/details/{self.valid_md5}")
+            self.assertEqual(response.status_code, 503, response.text)
+            response = self.client.post("/bulk/exists", content=self.valid_md5)
+            self.assertEqual(response.status_code, 503, response.text)
+        finally:
+            server.db_executor.shutdown()
+            server.db_executor = None
+
+    def test_connection_released(self):
+        """Sessions return their connection to the pool after each database call, not when the request ends."""
+        engine = create_engine(f"sqlite:///{self.db_file}", pool_size=1, max_overflow=0)
+        server.db_executor = DBExecutor(1)
+        try:
+            with sessionmaker(bind=engine)() as db:
+                result = asyncio.run(server.run_db(crud.get_distinct, db, self.valid_md5))
+                self.assertEqual(result.md5, self.valid_md5)
+                self.assertEqual(engine.pool.checkedout(), 0)
+                # the session is still usable for the request's next query
+                self.assertEqual(len(asyncio.run(server.run_db(crud.get_details, db, self.valid_md5))), 2)
+        finally:
+            server.db_executor.shutdown()
+            server.db_executor = None
+            engine.dispose()
+
+    def test_coalesced_cancelled(self):
+        """A query shared by concurrent lookups has its own session, so it completes if the first lookup is cancelled."""
+        sessions = server._current().sessions
+        get_details = crud.get_details
+        used = []
+
+        def slow_details(db, *args, **kwargs):
+            used.append((db, server._current().in_flight))
+            time.sleep(0.2)
+            return get_details(db, *args, **kwargs)
+
+        async def lookups():
+            first_db, second_db = (sessions(info={"served": server.served}) for _ in range(2))
+            first = asyncio.ensure_future(server._lookup(self.valid_md5, first_db, details=True))
+            await asyncio.sleep(0.05)
+            second = asyncio.ensure_future(server._lookup(self.valid_md5, second_db, details=True))
+            await asyncio.sleep(0.05)
+            # as get_db does once the first request is cancelled
+            first.cancel()
+            first_db.close()
+            result = await second
+            second_db.close()
+            return first_db, second_db, result
+
+        in_flight = server._current().in_flight
+        with mock.patch.object(crud, "get_details", slow_details):
+            first_db, second_db, result = asyncio.run(lookups())
+        self.assertEqual(len(result), 2)
+        self.assertEqual(len(used), 1)
+        self.assertNotIn(used[0][0], (first_db, second_db))
+        self.assertEqual(used[0][1], in_flight + 1)
+        self.assertEqual(server._current().in_flight, in_flight)
+
+    def test_coalesced(self):
+        """Concurrent lookups of the same digest share a single query."""
+        engine = create_engine(f"sqlite:///{self.db_file}", connect_args={"check_same_thread": False})
+        sessions = sessionmaker(bind=engine)
+        get_details = crud.get_details
+        calls = []
+
+        def slow_details(db, *args, **kwargs):
+            calls.append(kwargs["digest"])
+            time.sleep(0.1)
+            return get_details(db, *args, **kwargs)
+
+        async def lookups(*digests: str):
+            return await asyncio.gather(
+                *[server._lookup(d, sessions(info={"served": server.served}), details=True) for d in digests]
+            )
+
+        try:
+            with mock.patch.object(crud, "get_details", slow_details):
+                shared = server.flights.shared
+                results = asyncio.run(lookups(*[self.valid_md5] * 5, self.valid_md5.lower(), self.valid_sha1))
+                self.assertEqual(len(calls), 2)
+                self.assertEqual(server.flights.shared - shared, 5)
+                self.assertTrue(all(r is results[0] for r in results[:6]))
+                self.assertEqual(results[0], results[6])
+
+                calls.clear()
+                with mock.patch.object(settings.server, "coalesce_lookups", False):
+                    asyncio.run(lookups(*[self.valid_md5] * 3))
+                self.assertEqual(len(calls), 3)
+        finally:
+            engine.dispose()
+
+    def test_metrics(self):
+        """Requests and the stages of handling them are counted and timed."""
+        before = metrics.requests.value("details", "200")
+        serialized = metrics.stage_seconds.count("serialize")
+        rows = metrics.details_rows.count()
+        self.client.get(f"/details/{self.valid_md5}")
+        self.client.get(f"/exists/{self.valid_md5}")
+        self.client.get("/exists/notadigest")
+        self.assertEqual(metrics.requests.value("details", "200"), before + 1)
+        self.assertGreaterEqual(metrics.requests.value("exists", "400"), 1)
+        self.assertEqual(metrics.stage_seconds.count("serialize"), serialized + 2)
+        self.assertEqual(metrics.details_rows.count(), rows + 1)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn('nsrl_requests_total{route="exists",status="200"}', response.text)
+        self.assertIn('nsrl_stage_seconds_count{stage="get_details"}', response.text)
+        self.assertIn('nsrl_stage_seconds_count{stage="get_distinct"}', response.text)
+        self.assertIn("nsrl_details_rows_count", response.text)
+
+    def test_ui(self):
+        """The search page renders results."""
+        response = self.client.get("/")
+        self.assertEqual(response.status_code, 200, response.text)
+        response = self.client.post("/", data={"digest": self.valid_md5, "detailed": "true"})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("Microsoft Word", response.text)
+        self.assertIn("Windows NT", response.text)
+        response = self.client.post("/", data={"digest": self.valid_md5})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn(self.valid_sha256, response.text)
+        response = self.client.post("/", data={"digest": "a" * 32, "detailed": "true"})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertNotIn("Microsoft Word", response.text)
+
+        # the docs are served from the bundled assets rather than a CDN
+        response = self.client.get("/docs")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("/static/js/swagger-ui-bundle.js", response.text)
+        self.assertEqual(self.client.get("/docs/oauth2-redirect").status_code, 200)
+
+        # the UI doesn't import the server, so either can be imported first
+        subprocess.run([sys.executable, "-c", "import azul_nsrl_lookup_server.ui"], check=True)  # noqa: S603
+
+    def test_api_only(self):
+        """API-only servers serve lookups without reflecting the database, the UI or docs."""
+        env = {**os.environ, "NSRL_DB_FILEPATH": self.db_file, "NSRL_SERVER_API_ONLY": "true"}
+        output = subprocess.run(  # noqa: S603
+            [sys.executable, "-c", API_ONLY_SCRIPT, self.valid_md5], env=env, capture_output=True, check=True
+        ).stdout
+        served = json.loads(output)
+        self.assertEqual(
+            served["status"],
+            {
+                f"/details/{self.valid_md5}": 200,
+                "/": 404,
+                "/docs": 404,
+                "/static/css/swagger-ui.css": 404,
+                "/openapi.json": 200,
+            },
+        )
+        self.assertFalse(served["jinja2"])
+
+        # the schema is checked instead
+        engine = create_engine(f"sqlite:///{self.db_file}")
+        try:
+            with engine.connect() as conn:
+                models.check_schema(conn)
+        finally:
+            engine.dispose()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'broken.db')}")
+            try:
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("CREATE TABLE FILE (sha256 VARCHAR)")
+                    with self.assertRaisesRegex(ValueError, "RDS schema"):
+                        models.check_schema(conn)
+            finally:
+                engine.dispose()
+
+
+class TestServerOptimized(TestServer):
+    """The server tests against an optimized copy of the test database."""
+
+    @classmethod
+    def serve_database(cls):
+        """Serve lookups from an optimized copy of the test database."""
+        cls.original_db_file = cls.db_file
+        cls.db_file = f"{cls.original_db_file}.optimized"
+        optimize_database(cls.original_db_file, cls.db_file)
+        super().serve_database()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Remove both test databases."""
+        super().tearDownClass()
+        os.unlink(cls.original_db_file)
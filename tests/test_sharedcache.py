@@ -0,0 +1,90 @@
+"""Test the lookup cache shared between workers."""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from pydantic_core import to_json
+
+from azul_nsrl_lookup_server import sharedcache
+from azul_nsrl_lookup_server.cache import MISSING
+from azul_nsrl_lookup_server.sharedcache import SharedCache
+
+DETAILS = [{"sha256": "A" * 64, "file_name": "WORD.EXE", "file_size": 1, "package": None}]
+
+
+def _set_in_child(filepath: str):
+    """Cache a result from a forked worker."""
+    SharedCache(filepath, 2**20, "2024.03.1:1").set("details", "c" * 32, DETAILS)
+
+
+class TestSharedCache(unittest.TestCase):
+    """Tests for the shared cache."""
+
+    def setUp(self) -> None:
+        """Create a directory for the cache file."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmpdir.name, "cache.db")
+
+    def tearDown(self) -> None:
+        """Remove the cache file."""
+        self.tmpdir.cleanup()
+
+    def test_get_set(self):
+        """Results are kept across instances, separately for each release."""
+        cache = SharedCache(self.filepath, 2**20, "2024.03.1:1")
+        self.assertIs(cache.get("details", "a" * 32), MISSING)
+        cache.set("details", "a" * 32, DETAILS)
+        self.assertEqual(json.loads(cache.get("details", "A" * 32)), DETAILS)
+        self.assertIs(cache.get("exists", "A" * 32), MISSING)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "evictions": 0})
+
+        # a restarted worker sees the same results, a new release doesn't
+        self.assertEqual(SharedCache(self.filepath, 2**20, "2024.03.1:1").get("details", "a" * 32), to_json(DETAILS))
+        self.assertIs(SharedCache(self.filepath, 2**20, "2024.09.1:1").get("details", "a" * 32), MISSING)
+
+    def test_workers(self):
+        """Results cached by a forked worker are seen by the others."""
+        cache = SharedCache(self.filepath, 2**20, "2024.03.1:1")
+        self.assertIs(cache.get("details", "c" * 32), MISSING)
+        child = multiprocessing.get_context("fork").Process(target=_set_in_child, args=(self.filepath,))
+        child.start()
+        child.join()
+        self.assertEqual(child.exitcode, 0)
+        self.assertEqual(json.loads(cache.get("details", "c" * 32)), DETAILS)
+
+    def test_eviction(self):
+        """The least recently used results are evicted to keep the file under its size limit."""
+        cache = SharedCache(self.filepath, 256 * 1024, "2024.03.1:1")
+        value = [{"file_name": "X" * 2000}]
+        with mock.patch.object(sharedcache, "TOUCH_INTERVAL", 0):
+            cache.set("details", "0" * 32, value)
+            for i in range(1, 500):
+                cache.set("details", f"{i:032X}", value)
+                # keep using the first result so it isn't evicted
+                self.assertEqual(json.loads(cache.get("details", "0" * 32)), value)
+        self.assertGreater(cache.evictions, 0)
+        self.assertIs(cache.get("details", f"{1:032X}"), MISSING)
+        self.assertEqual(json.loads(cache.get("details", f"{499:032X}")), value)
+        self.assertLess(os.path.getsize(self.filepath), 320 * 1024)
+
+        # results too large to keep are never cached
+        cache.set("details", "F" * 32, [{"file_name": "X" * 50000}])
+        self.assertIs(cache.get("details", "F" * 32), MISSING)
+
+    def test_busy(self):
+        """Results are left uncached rather than waiting long for another worker writing."""
+        cache = SharedCache(self.filepath, 2**20, "2024.03.1:1")
+        other = sqlite3.connect(self.filepath, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            with mock.patch.object(sharedcache, "BUSY_TIMEOUT", 0):
+                cache.set("details", "a" * 32, DETAILS)
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        self.assertIs(cache.get("details", "a" * 32), MISSING)
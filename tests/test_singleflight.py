@@ -0,0 +1,71 @@
+"""Test coalescing concurrent identical lookups."""
+
+import asyncio
+import unittest
+
+from azul_nsrl_lookup_server.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for sharing lookups between concurrent callers."""
+
+    def setUp(self) -> None:
+        """Count the lookups run."""
+        self.flights = SingleFlight()
+        self.calls = []
+
+    async def lookup(self, value, delay: float = 0.05):
+        self.calls.append(value)
+        await asyncio.sleep(delay)
+        if isinstance(value, Exception):
+            raise value
+        return [value]
+
+    def test_shared(self):
+        """Concurrent callers with the same key share one lookup and its result."""
+
+        async def run():
+            return await asyncio.gather(
+                *[self.flights.do("a", self.lookup, "a") for _ in range(5)],
+                self.flights.do("b", self.lookup, "b"),
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [["a"]] * 5 + [["b"]])
+        self.assertIs(results[0], results[4])
+        self.assertEqual(self.calls, ["a", "b"])
+        self.assertEqual((self.flights.started, self.flights.shared), (2, 4))
+        self.assertEqual(len(self.flights), 0)
+
+        # finished lookups aren't reused
+        asyncio.run(self.flights.do("a", self.lookup, "a"))
+        self.assertEqual(self.calls, ["a", "b", "a"])
+
+    def test_exception(self):
+        """An exception from the lookup is raised to every caller."""
+
+        async def run():
+            return await asyncio.gather(
+                *[self.flights.do("a", self.lookup, ValueError("failed")) for _ in range(3)], return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(len(self.flights), 0)
+
+    def test_cancelled(self):
+        """Cancelling the caller that started a lookup doesn't cancel it for the others."""
+
+        async def run():
+            first = asyncio.create_task(self.flights.do("a", self.lookup, "a"))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(self.flights.do("a", self.lookup, "a"))
+            await asyncio.sleep(0)
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await second
+
+        self.assertEqual(asyncio.run(run()), ["a"])
+        self.assertEqual(self.calls, ["a"])
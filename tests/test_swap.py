@@ -0,0 +1,178 @@
+"""Test swapping the server to a new database release."""
+
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from azul_nsrl_lookup_server import server, settings
+from azul_nsrl_lookup_server.server import app, get_db
+from tests.helpers import create_database, keep_server
+
+
+def create_release(filepath: str, version: str, digests: list[str]):
+    """Create a database of a release containing a file for each digest."""
+    db = create_database(filepath)
+    db.execute("insert into VERSION values (?, 'Modern', 0, 0, 'minimal')", (version,))
+    for digest in digests:
+        db.execute("insert into FILE values (?, ?, ?, 'FILE.EXE', 1, 1)", (digest * 64, digest * 40, digest * 32))
+    db.commit()
+    db.close()
+
+
+class TestSwap(unittest.TestCase):
+    """Tests for swapping database releases without a restart."""
+
+    def setUp(self) -> None:
+        """Serve the first of two releases through a symlink."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.first = os.path.join(self.tmpdir.name, "first.db")
+        self.second = os.path.join(self.tmpdir.name, "second.db")
+        create_release(self.first, "2024.03.1", ["A"])
+        create_release(self.second, "2024.09.1", ["A", "B"])
+        self.current = os.path.join(self.tmpdir.name, "current.db")
+        os.symlink(self.first, self.current)
+
+        keep_server(self)
+        self.patches = [
+            mock.patch.object(settings.db, "filepath", self.current),
+            mock.patch.object(settings.db, "drain_timeout", 5),
+            mock.patch.object(settings.server, "cache_size", 10),
+            mock.patch.object(settings.server, "admin_token", "secret"),
+        ]
+        for patch in self.patches:
+            patch.start()
+        server.serve(server.open_database(self.current))
+        self.client = TestClient(app)
+
+    def tearDown(self) -> None:
+        """Restore the server and remove the databases."""
+        server._current().engine.dispose()
+        for patch in self.patches:
+            patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_admin_swap(self):
+        """The admin endpoint swaps to a new release with its cache warmed from the previous one."""
+        self.assertEqual(self.client.get("/exists/" + "A" * 32).status_code, 200)
+        self.assertEqual(self.client.get("/exists/" + "B" * 32).status_code, 404)
+        previous = server._current().engine
+
+        response = self.client.post("/admin/swap", json={"filepath": self.second})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post("/admin/swap", json={"filepath": self.second}, headers={"X-Admin-Token": "wrong"})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            "/admin/swap", json={"filepath": self.second + ".missing"}, headers={"X-Admin-Token": "secret"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIs(server._current().engine, previous)
+
+        response = self.client.post("/admin/swap", json={"filepath": self.second}, headers={"X-Admin-Token": "secret"})
+        self.assertEqual(response.status_code, 200, response.text)
+        result = response.json()
+        self.assertEqual(result["filepath"], os.path.realpath(self.second))
+        self.assertEqual(result["version"], "2024.09.1")
+        self.assertEqual(result["warmed"], 2)
+        self.assertIsNot(server._current().engine, previous)
+
+        # the negative result cached for the previous release was re-run against the new one
+        response = self.client.get("/exists/" + "B" * 32)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server._current().lookup_cache.stats()["hits"], 1)
+
+        with mock.patch.object(settings.server, "admin_token", None):
+            response = self.client.post("/admin/swap", json={"filepath": self.first})
+            self.assertEqual(response.status_code, 404)
+
+    def test_drain(self):
+        """Requests that started before a swap finish on the previous database, which is closed afterwards."""
+
+        async def swap():
+            sessions = get_db()
+            db = await anext(sessions)
+            previous = server._current()
+            await server.swap_database(self.second)
+            self.assertIsNot(server.served, previous)
+            self.assertEqual(db.execute(text("SELECT version FROM VERSION")).scalar(), "2024.03.1")
+            await asyncio.sleep(0.2)
+            self.assertEqual(previous.in_flight, 1)
+            self.assertTrue(server.draining)
+
+            await sessions.aclose()
+            await asyncio.gather(*server.draining)
+            self.assertEqual(previous.in_flight, 0)
+
+        asyncio.run(swap())
+
+    def test_drain_timeout(self):
+        """Requests still running when the previous database is closed finish counting against it alone."""
+
+        async def swap():
+            sessions = get_db()
+            await anext(sessions)
+            previous = server._current()
+            with mock.patch.object(settings.db, "drain_timeout", 0.1):
+                await server.swap_database(self.second)
+                await asyncio.gather(*server.draining)
+            self.assertEqual(previous.in_flight, 1)
+
+            await sessions.aclose()
+            self.assertEqual(previous.in_flight, 0)
+            self.assertEqual(server._current().in_flight, 0)
+
+        asyncio.run(swap())
+
+    def test_watch_database(self):
+        """The server swaps when the configured database path is repointed at a new release."""
+
+        async def watch():
+            previous = server._current().file_id
+            watcher = asyncio.create_task(server.watch_database(0.01))
+            try:
+                await asyncio.sleep(0.1)
+                self.assertEqual(server._current().file_id, previous)
+
+                link = self.current + ".new"
+                os.symlink(self.second, link)
+                os.replace(link, self.current)
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if server._current().file_id != previous:
+                        break
+                self.assertEqual(server._current().file_id[0], os.path.realpath(self.second))
+                await asyncio.gather(*server.draining)
+            finally:
+                watcher.cancel()
+
+        asyncio.run(watch())
+
+    def test_watch_after_admin_swap(self):
+        """The server keeps serving the database an admin swapped to rather than the configured one."""
+
+        async def watch():
+            watcher = asyncio.create_task(server.watch_database(0.01))
+            try:
+                await server.swap_database(self.second)
+                await asyncio.sleep(0.2)
+                self.assertEqual(server._current().file_id[0], os.path.realpath(self.second))
+                self.assertFalse(server.draining)
+
+                # replacing the database swapped to is still noticed
+                third = os.path.join(self.tmpdir.name, "third.db")
+                create_release(third, "2025.03.1", ["C"])
+                os.replace(third, self.second)
+                for _ in range(100):
+                    await asyncio.sleep(0.05)
+                    if server._current().version == "2025.03.1":
+                        break
+                self.assertEqual(server._current().version, "2025.03.1")
+                await asyncio.gather(*server.draining)
+            finally:
+                watcher.cancel()
+
+        asyncio.run(watch())
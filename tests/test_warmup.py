@@ -0,0 +1,82 @@
+"""Test warming up the database."""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from azul_nsrl_lookup_server import server, settings
+from azul_nsrl_lookup_server.database import build_hash_indexes, setup_engine
+from azul_nsrl_lookup_server.server import app
+from azul_nsrl_lookup_server.warmup import probe_keys, read_sample, warm_up
+from tests.helpers import create_database, keep_server
+
+
+class TestWarmup(unittest.TestCase):
+    """Tests for warming up the database at startup."""
+
+    def setUp(self) -> None:
+        """Construct a test database and a sample of digests."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmpdir.name, "nsrl.db")
+        db = create_database(self.db_file)
+        for digest in "0123456789ABCDEF":
+            db.execute("insert into FILE values (?, ?, ?, 'FILE.EXE', 1, 1)", (digest * 64, digest * 40, digest * 32))
+        db.commit()
+        db.close()
+        self.sample_file = os.path.join(self.tmpdir.name, "sample.txt")
+        with open(self.sample_file, "w") as f:
+            f.write("A" * 32 + "\n\n" + "B" * 40 + "\n" + "F" * 64 + "\n")
+
+    def tearDown(self) -> None:
+        """Remove the test database."""
+        self.tmpdir.cleanup()
+
+    def test_probe_keys(self):
+        """Probe keys are spread evenly across the keyspace."""
+        keys = probe_keys(16)
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(keys[0], "00000000")
+        self.assertEqual(keys[8], "80000000")
+        self.assertEqual(keys[-1], "F0000000")
+
+    def test_read_sample(self):
+        """Blank lines are skipped and the sample limited."""
+        self.assertEqual(read_sample(self.sample_file), ["A" * 32, "B" * 40, "F" * 64])
+        self.assertEqual(read_sample(self.sample_file, 2), ["A" * 32, "B" * 40])
+
+    def test_warm_up(self):
+        """Only indexed digest columns are probed."""
+        engine, sessions = setup_engine(self.db_file)
+        try:
+            warmed = warm_up(engine, sessions, probes=64, sample=read_sample(self.sample_file), threads=4)
+            self.assertEqual(warmed["probes"], 64)
+            self.assertEqual(warmed["sample"], 3)
+
+            build_hash_indexes(self.db_file)
+            warmed = warm_up(engine, sessions, probes=64)
+            self.assertEqual(warmed["probes"], 64 * 3)
+            self.assertEqual(warmed["sample"], 0)
+        finally:
+            engine.dispose()
+
+    def test_ready(self):
+        """The server is only ready once warmed up."""
+        keep_server(self)
+        with (
+            mock.patch.object(settings.db, "filepath", self.db_file),
+            mock.patch.object(settings.db, "warmup", True),
+            mock.patch.object(settings.db, "warmup_sample_filepath", self.sample_file),
+        ):
+            with TestClient(app) as client:
+                for _ in range(100):
+                    response = client.get("/ready")
+                    if response.status_code == 200:
+                        break
+                    self.assertEqual(response.status_code, 503)
+                    time.sleep(0.05)
+                self.assertEqual(response.status_code, 200)
+            self.assertFalse(server.ready)